@@ -67,7 +67,7 @@ class TbifAcquirer(FileAcquirer):
         else:
             logger.error('Done with all available frames: {0}'.format(self.frame_num))
             self.data = None
-            self.q_comm.put(None)
+            self.q_comm.put([Spike.done()])
             self.done = True
 
         self.total_times.append(time.time()-t)
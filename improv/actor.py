@@ -1,8 +1,12 @@
 import asyncio
+import pickle
 from queue import Empty
+import select
 import time
 from typing import Awaitable, Callable
 import traceback
+from improv import trace
+from improv import metrics as _metrics # module, not names: improv.metrics imports this through improv.store
 
 import logging; logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -28,6 +32,13 @@ class Actor():
         self.q_in = None
         self.q_out = None
 
+        # private until Nexus hands over the shared registry
+        self.metrics = _metrics.MetricsRegistry()
+
+        # store ID of the last checkpoint of the instance this one replaces,
+        # set by Nexus when it restarts a crashed actor (see restore)
+        self.checkpoint_id = None
+
     def __repr__(self):
         ''' Return this instance name and links dict
         '''
@@ -38,6 +49,14 @@ class Actor():
         '''
         self.client = client
 
+    def setMetrics(self, registry):
+        ''' Set the metrics registry shared with Nexus, also for the store
+            client's own metrics (e.g. Limbo's LMDB writer)
+        '''
+        self.metrics = registry
+        if hasattr(getattr(self, 'client', None), 'setMetrics'):
+            self.client.setMetrics(registry)
+
     def setLinks(self, links):
         ''' General full dict set for links
         '''
@@ -95,6 +114,27 @@ class Actor():
         ''' Suggested implementation for synchronous running: see RunManager class below
         '''
 
+    def checkpoint(self, state):
+        ''' Save state (anything picklable) in the store, for restore() in a
+            replacement instance should this actor's process die.
+            Nexus keeps only the latest checkpoint of each actor.
+        '''
+        obj_id = self.client.put(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), self.name+'_checkpoint')
+        if obj_id is not None:
+            self.q_comm.put([Spike.checkpoint(), obj_id])
+
+    def restore(self):
+        ''' State saved by the last checkpoint() of the instance this one
+            replaces, or None if this is not a restarted actor
+        '''
+        if self.checkpoint_id is None:
+            return None
+        try:
+            return pickle.loads(self.client.getID(self.checkpoint_id))
+        except Exception as e:
+            logger.error('Cannot restore checkpoint of {}: {}'.format(self.name, e))
+            return None
+
     def changePriority(self):
         ''' Try to lower this process' priority
             Only changes priority if lower_priority is set
@@ -146,11 +186,43 @@ class Spike():
     def ready():
         return 'ready'
 
+    @staticmethod
+    def checkpoint():
+        return 'checkpoint'
+
+    @staticmethod
+    def done():
+        return 'done'
+
+    @staticmethod
+    def failed():
+        return 'failed'
+
 
 class RunManager():
+    ''' Runs an actor: handles signals from Nexus on q_sig and calls
+        runMethod while running.
+
+        links: optional list of the actor's input Links. If given and
+        every Link (and q_sig) can be waited on (fileno, i.e. shm Links),
+        the manager blocks until a signal or data arrives and only calls
+        runMethod while there is input, instead of spinning; items a Link's
+        ReorderBuffer holds back count as input once their wait is up.
+        Otherwise it polls: runMethod is called continually between short
+        q_sig checks.
+
+        runBatch: optional replacement for runMethod that is handed a list
+        of items already taken from the first of links: up to batchSize
+        items (None for no limit), stopping after batchTime seconds if set. The
+        list may be empty (e.g. when only another link has data), so that
+        an actor that has fallen behind can catch up a batch at a time.
+
+        metrics: optional MetricsRegistry (the actor's self.metrics) in which
+        the gauge <name>.heartbeat is set to time.monotonic() on every
+        dispatch, so that Nexus can tell a stalled actor from an idle one.
     '''
-    '''
-    def __init__(self, name, runMethod, setup, q_sig, q_comm):
+    def __init__(self, name, runMethod, setup, q_sig, q_comm, links=None,
+                 runBatch=None, batchSize=1, batchTime=None, metrics=None):
         self.run = False
         self.config = False
         self.runMethod = runMethod
@@ -158,6 +230,13 @@ class RunManager():
         self.q_sig = q_sig
         self.q_comm = q_comm
         self.actorName = name
+        self.links = links
+        self.runBatch = runBatch
+        self.batchSize = batchSize
+        self.batchTime = batchTime
+        if runBatch is not None and not links:
+            raise ValueError('runBatch needs the input links to take items from')
+        self.heartbeat = None if metrics is None else metrics.gauge(name+'.heartbeat')
 
         #TODO make this tunable
         self.timeout = 0.000001
@@ -165,41 +244,108 @@ class RunManager():
     def __enter__(self):
         self.start = time.time()
 
+        if self.links is not None and all(hasattr(q, 'fileno') for q in [self.q_sig, *self.links]):
+            self._waitEvents()
+        else:
+            self._poll()
+        return None #Status...?
+
+    def _poll(self):
         while True:
             if self.run:
-                try:
-                    self.runMethod() #subfunction for running singly
-                except Exception as e:
-                    logger.error('Actor '+self.actorName+' exception during run: {}'.format(e))
-                    print(traceback.format_exc())
+                self._runOnce()
             elif self.config:
-                try:
-                    self.setup() #subfunction for setting up the actor
-                    self.q_comm.put([Spike.ready()])
-                except Exception as e:
-                    logger.error('Actor '+self.actorName+' exception during setup: {}'.format(e))  
-                    raise Exception
-                self.config = False #Run once
+                self._setup()
             try: 
                 signal = self.q_sig.get(timeout=self.timeout)
-                if signal == Spike.run(): 
-                    self.run = True
-                    logger.warning('Received run signal, begin running')
-                elif signal == Spike.setup():
-                    self.config = True
-                elif signal == Spike.quit():
-                    logger.warning('Received quit signal, aborting')
+                if not self._handleSignal(signal):
                     break
-                elif signal == Spike.pause():
-                    logger.warning('Received pause signal, pending...')
-                    self.run = False
-                elif signal == Spike.resume(): #currently treat as same as run
-                    logger.warning('Received resume signal, resuming')
-                    self.run = True
             except Empty as e:
                 pass #no signal from Nexus
-        return None #Status...?
 
+    def _waitEvents(self):
+        while True:
+            if self.config:
+                self._setup()
+            waitOn = [self.q_sig, *self.links] if self.run else [self.q_sig]
+            for q in select.select(waitOn, [], [], self._heldTimeout() if self.run else None)[0]:
+                q.drain()
+            while not self.q_sig.empty():
+                try:
+                    signal = self.q_sig.get_nowait()
+                except Empty:
+                    break
+                if not self._handleSignal(signal):
+                    return
+            while self.run and self.q_sig.empty() and any(not q.empty() for q in self.links):
+                self._runOnce()
+
+    def _heldTimeout(self):
+        ''' Seconds until an item held back by an input Link's ReorderBuffer
+            (see improv.link) must be handed out, since no data arrives
+            for it; None if no item is held
+        '''
+        waits = [q.reorder.timeout() for q in self.links if getattr(q, 'reorder', None) is not None]
+        waits = [w for w in waits if w is not None]
+        return min(waits) if waits else None
+
+    def _runOnce(self):
+        if self.heartbeat is not None:
+            self.heartbeat.set(time.monotonic())
+        try:
+            if self.runBatch is not None:
+                items = self._takeBatch()
+                with trace.span(self.runBatch.__name__, 'run'):
+                    self.runBatch(items)
+            else:
+                with trace.span(self.runMethod.__name__, 'run'):
+                    self.runMethod() #subfunction for running singly
+        except Exception as e:
+            logger.error('Actor '+self.actorName+' exception during run: {}'.format(e))
+            print(traceback.format_exc())
+
+    def _takeBatch(self):
+        ''' Take up to batchSize pending items from the first input link
+            without waiting for more, stopping early after batchTime
+        '''
+        items = []
+        deadline = None if self.batchTime is None else time.perf_counter()+self.batchTime
+        while self.batchSize is None or len(items) < self.batchSize:
+            try:
+                items.append(self.links[0].get_nowait())
+            except Empty:
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+        return items
+
+    def _setup(self):
+        try:
+            self.setup() #subfunction for setting up the actor
+            self.q_comm.put([Spike.ready()])
+        except Exception as e:
+            logger.error('Actor '+self.actorName+' exception during setup: {}'.format(e))  
+            raise Exception
+        self.config = False #Run once
+
+    def _handleSignal(self, signal):
+        ''' Returns False once the actor should quit
+        '''
+        if signal == Spike.run(): 
+            self.run = True
+            logger.warning('Received run signal, begin running')
+        elif signal == Spike.setup():
+            self.config = True
+        elif signal == Spike.quit():
+            logger.warning('Received quit signal, aborting')
+            return False
+        elif signal == Spike.pause():
+            logger.warning('Received pause signal, pending...')
+            self.run = False
+        elif signal == Spike.resume(): #currently treat as same as run
+            logger.warning('Received resume signal, resuming')
+            self.run = True
+        return True
 
     def __exit__(self, type, value, traceback):
         logger.info('Ran for '+str(time.time()-self.start)+' seconds')
@@ -212,9 +358,14 @@ class AsyncRunManager():
         To be used with [async with].
         Afterwards, the run manager listens for signals without blocking.
         q_sig, q_comm are AsyncQueues
+
+        run_method is a coroutine function started as a task on run/resume
+        and cancelled on pause/quit, so it must not block the event loop.
+        Concurrent work should go through spawn, which bounds the number
+        of running tasks to workers and cancels them on pause/quit too.
     '''
 
-    def __init__(self, name, run_method, setup, q_sig, q_comm):
+    def __init__(self, name, run_method, setup, q_sig, q_comm, workers=8):
         self.run = False
         self.config = False
         self.run_method = run_method
@@ -225,26 +376,68 @@ class AsyncRunManager():
         self.loop = asyncio.get_event_loop()
         self.start = time.time()
 
+        self.task = None # running run_method
+        self.tasks = set() # tasks started with spawn
+        self.workers = asyncio.Semaphore(workers)
+
     async def __aenter__(self):
         while True:
             signal = await self.q_sig.get_async()
             if signal == Spike.run() or signal == Spike.resume():
                 if not self.run:
                     self.run = True
-                    asyncio.ensure_future(self.run_method(), loop=self.loop)
-                    print('Received run signal, begin running')
+                    self.task = self.loop.create_task(self._runTask())
+                    logger.warning('Received {} signal, begin running'.format(signal))
             elif signal == Spike.setup():
-                self.setup()
+                if asyncio.iscoroutinefunction(self.setup):
+                    await self.setup()
+                else:
+                    self.setup()
                 await self.q_comm.put_async([Spike.ready()])
             elif signal == Spike.quit():
                 logger.warning('Received quit signal, aborting')
-                self.loop.stop()
+                await self._stop()
                 break
             elif signal == Spike.pause():
                 logger.warning('Received pause signal, pending...')
-                while self.q_sig.get() != Spike.resume():  # Intentionally blocking
-                    time.sleep(1e-3)
+                await self._stop()
+        return self
 
     async def __aexit__(self, type, value, traceback):
+        await self._stop()
         logger.info('Ran for {} seconds'.format(time.time() - self.start))
         logger.warning('Exiting AsyncRunManager')
+
+    async def spawn(self, coro):
+        ''' Run coro as a task once one of the workers is free
+            Returns the task
+        '''
+        await self.workers.acquire()
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._finished)
+        return task
+
+    def _finished(self, task):
+        self.tasks.discard(task)
+        self.workers.release()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Actor '+self.module_name+' exception in task: {}'.format(task.exception()))
+
+    async def _runTask(self):
+        try:
+            await self.run_method()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error('Actor '+self.module_name+' exception during run: {}'.format(e))
+            print(traceback.format_exc())
+
+    async def _stop(self):
+        ''' Cancel run_method and spawned tasks and wait for them to finish
+        '''
+        self.run = False
+        pending = [t for t in [self.task, *self.tasks] if t is not None and not t.done()]
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -1,11 +1,10 @@
 import time
 import os
-import h5py
 import random
 import numpy as np
-from skimage.io import imread
 
-from improv.actor import Actor, RunManager
+from improv.actor import Actor, Spike, RunManager
+from improv import trace
 
 import logging; logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -16,7 +15,12 @@ class FileAcquirer(Actor):
     '''Class to import data from files and output
        frames in a buffer, or discrete.
     '''
-    def __init__(self, *args, filename=None, framerate=30, **kwargs):
+    def __init__(self, *args, filename=None, framerate=30, arena_slots=0, arena_subscribers=(), **kwargs):
+        ''' arena_slots: if > 0, write frames in place into a FrameArena
+                with this many slots instead of putting a new object per frame
+            arena_subscribers: actors that release each frame (client.releaseID)
+                before its slot may be reused
+        '''
         super().__init__(*args, **kwargs)
         self.frame_num = 0
         self.data = None
@@ -25,6 +29,9 @@ class FileAcquirer(Actor):
         self.saving = False
         self.filename = filename
         self.framerate = 1/framerate 
+        self.arena = None
+        self.arena_slots = arena_slots
+        self.arena_subscribers = arena_subscribers
 
     def setup(self):
         '''Get file names from config or user input
@@ -36,6 +43,7 @@ class FileAcquirer(Actor):
         if os.path.exists(self.filename):
             n, ext = os.path.splitext(self.filename)[:2]
             if ext == '.h5' or ext == '.hdf5':
+                import h5py
                 with h5py.File(self.filename, 'r') as file:
                     keys = list(file.keys())
                     self.data = file[keys[0]].value 
@@ -43,7 +51,12 @@ class FileAcquirer(Actor):
 
         else: raise FileNotFoundError
 
+        if self.arena_slots:
+            self.arena = self.client.createArena('acq_raw', self.data.shape[1:], self.data.dtype,
+                                                 slots=self.arena_slots, subscribers=self.arena_subscribers)
+
         if self.saving:
+            import h5py
             save_file = self.filename.split('.')[0]+'_backup'+'.h5'
             self.f = h5py.File(save_file, 'w', libver='latest')
             self.dset = self.f.create_dataset("default", (len(self.data),)) #TODO: need to set maxsize to none?
@@ -51,16 +64,14 @@ class FileAcquirer(Actor):
     def run(self):
         ''' Run indefinitely. Calls runAcquirer after checking for singals
         '''
-        self.total_times = []
-        self.timestamp = []
+        self.frame_time = self.metrics.histogram(self.name+'.frame_time')
+        self.frames = self.metrics.gauge(self.name+'.frame')
 
-        with RunManager(self.name, self.runAcquirer, self.setup, self.q_sig, self.q_comm) as rm:
+        with RunManager(self.name, self.runAcquirer, self.setup, self.q_sig, self.q_comm, metrics=self.metrics) as rm:
             print(rm)            
             
-        print('Done running Acquire, avg time per frame: ', np.mean(self.total_times))
+        print('Done running Acquire, avg time per frame: ', self.frame_time.mean())
         print('Acquire got through ', self.frame_num, ' frames')
-        np.savetxt('output/timing/acquire_frame_time.txt', np.array(self.total_times))
-        np.savetxt('output/timing/acquire_timestamp.txt', np.array(self.timestamp))
 
     def runAcquirer(self):
         '''While frames exist in location specified during setup,
@@ -75,8 +86,14 @@ class FileAcquirer(Actor):
             ## simulate frame-dropping
             # if self.frame_num > 1500 and self.frame_num < 1800:
             #     frame = None
-            id = self.client.put(frame, 'acq_raw'+str(self.frame_num))
-            self.timestamp.append([time.time(), self.frame_num])
+            if self.arena is not None:
+                id = self.client.putFrame(self.arena, frame)
+                if id is None: # every slot still in use downstream; retry this frame
+                    return
+            else:
+                id = self.client.put(frame, 'acq_raw'+str(self.frame_num))
+            self.frames.set(self.frame_num)
+            trace.begin(self.frame_num)
             try:
                 self.q_out.put([{str(self.frame_num):id}])
                 self.frame_num += 1
@@ -86,12 +103,12 @@ class FileAcquirer(Actor):
                 logger.error('Acquirer general exception: {}'.format(e))
 
             time.sleep(self.framerate) #pretend framerate
-            self.total_times.append(time.time()-t)
+            self.frame_time.record(time.time()-t)
 
         else: # simulating a done signal from the source (eg, camera)
             logger.error('Done with all available frames: {0}'.format(self.frame_num))
             self.data = None
-            self.q_comm.put(None)
+            self.q_comm.put([Spike.done()])
             self.done = True # stay awake in case we get e.g. a shutdown signal
             if self.saving:
                 self.f.close()
@@ -136,7 +153,7 @@ class StimAcquirer(Actor):
     def run(self):
         ''' Run continuously, waiting for input
         '''
-        with RunManager(self.name, self.getInput, self.setup, self.q_sig, self.q_comm) as rm:
+        with RunManager(self.name, self.getInput, self.setup, self.q_sig, self.q_comm, metrics=self.metrics) as rm:
             logger.info(rm)
 
     def getInput(self):
@@ -179,7 +196,7 @@ class BehaviorAcquirer(Actor):
     def run(self):
         ''' Run continuously, waiting for input
         '''
-        with RunManager(self.name, self.getInput, self.setup, self.q_sig, self.q_comm) as rm:
+        with RunManager(self.name, self.getInput, self.setup, self.q_sig, self.q_comm, metrics=self.metrics) as rm:
             logger.info(rm)
 
     def getInput(self):
@@ -213,10 +230,11 @@ class TiffAcquirer(Actor):
         self.t_per_frame = list()
 
     def setup(self):
+        from skimage.io import imread
         self.imgs = imread(self.filename)
 
     def run(self):
-        with RunManager(self.name, self.run_acquirer, self.setup, self.q_sig, self.q_comm) as rm:
+        with RunManager(self.name, self.run_acquirer, self.setup, self.q_sig, self.q_comm, metrics=self.metrics) as rm:
             print(rm)
 
     def run_acquirer(self):
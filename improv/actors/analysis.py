@@ -1,5 +1,4 @@
 import time
-import cv2
 import numpy as np
 from queue import Empty
 
@@ -9,16 +8,28 @@ from improv.store import ObjectNotFoundError
 import logging; logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+cv2 = None # slow to import, so only imported (by setup) in the process running the actor
+
 class MeanAnalysis(Actor):
     #TODO: Add additional error handling
-    def __init__(self, *args):
+    def __init__(self, *args, batch_size=None, batch_time=None, skip_batched=False):
+        ''' batch_size, batch_time: if either is set, take queued frames
+            in batches (see runBatch and RunManager)
+            skip_batched: analyse only the newest frame of each batch; the
+                others are counted in the <name>.skipped counter
+        '''
         super().__init__(*args)
+        self.batch_size = batch_size
+        self.batch_time = batch_time
+        self.skip_batched = skip_batched
 
     def setup(self, param_file=None):
         ''' Set custom parameters here
             Can also be done by e.g. loading them in from 
             a configuration file. #TODO
         '''
+        global cv2
+        import cv2
         np.seterr(divide='ignore')
 
         self.num_stim = 21 
@@ -40,26 +51,26 @@ class MeanAnalysis(Actor):
         self.recentStim = [0]*self.window
 
     def run(self):
-        self.total_times = []
-        self.puttime = []
-        self.colortime = []
-        self.stimtime = []
-        self.timestamp = []
-
-        with RunManager(self.name, self.runAvg, self.setup, self.q_sig, self.q_comm) as rm:
+        self.frame_time = self.metrics.histogram(self.name+'.frame_time')
+        self.put_time = self.metrics.histogram(self.name+'.put_time')
+        self.color_time = self.metrics.histogram(self.name+'.color_time')
+        self.stim_time = self.metrics.histogram(self.name+'.stim_time')
+        self.frames = self.metrics.gauge(self.name+'.frame')
+        self.skipped = self.metrics.counter(self.name+'.skipped')
+
+        links = [q for q in [self.q_in, self.links.get('input_stim_queue')] if q is not None]
+        batched = self.batch_size is not None or self.batch_time is not None
+        with RunManager(self.name, self.runAvg, self.setup, self.q_sig, self.q_comm, links=links,
+                        runBatch=self.runBatch if batched else None,
+                        batchSize=self.batch_size, batchTime=self.batch_time, metrics=self.metrics) as rm:
             logger.info(rm)
         
-        print('Analysis broke, avg time per frame: ', np.mean(self.total_times, axis=0))
-        print('Analysis broke, avg time per put analysis: ', np.mean(self.puttime))
-        print('Analysis broke, avg time per color frame: ', np.mean(self.colortime))
-        print('Analysis broke, avg time per stim avg: ', np.mean(self.stimtime))
+        print('Analysis broke, avg time per frame: ', self.frame_time.mean())
+        print('Analysis broke, avg time per put analysis: ', self.put_time.mean())
+        print('Analysis broke, avg time per color frame: ', self.color_time.mean())
+        print('Analysis broke, avg time per stim avg: ', self.stim_time.mean())
         print('Analysis got through ', self.frame, ' frames')
 
-        np.savetxt('output/timing/analysis_frame_time.txt', np.array(self.total_times))
-        np.savetxt('output/timing/analysisput_frame_time.txt', np.array(self.puttime))
-        np.savetxt('output/timing/analysiscolor_frame_time.txt', np.array(self.colortime))
-        np.savetxt('output/timing/analysis_timestamp.txt', np.array(self.timestamp))
-
         np.savetxt('output/final/analysis_tuning_curves.txt', np.array(self.polarAvg))
 
     def runAvg(self):
@@ -77,40 +88,13 @@ class MeanAnalysis(Actor):
             ids = self.q_in.get(timeout=0.0001)
             if ids is not None and ids[0]==1:
                 print('analysis: missing frame')
-                self.total_times.append(time.time()-t)
+                self.frame_time.record(time.time()-t)
                 self.q_out.put([1])
                 raise Empty
             # t = time.time()
-            self.frame = ids[-1]
-            (self.coordDict, self.image, self.S) = self.client.getList(ids[:-1])
-            self.C = self.S
-            self.coords = [o['coordinates'] for o in self.coordDict]
-            
-            # Compute tuning curves based on input stimulus
-            # Just do overall average activity for now
-            self.stimAvg_start()
-            
-            self.globalAvg = np.mean(self.estsAvg[:,:8], axis=0)
-            self.tune = [self.estsAvg[:,:8], self.globalAvg]
-
-            # Compute coloring of neurons for processed frame
-            # Also rotate and stack as needed for plotting
-            # TODO: move to viz, but we don't need to compute this 30 times/sec
-            self.color = self.plotColorFrame()
-
-            if self.frame >= self.window:
-                window = self.window
-            else:
-                window = self.frame
-
-            if self.C.shape[1]>0:
-                self.Cpop = np.nanmean(self.C, axis=0)
-                self.Cx = np.arange(0,self.Cpop.size)+(self.frame-window)
-                self.Call = self.C #already a windowed version #[:,self.frame-window:self.frame]
-            
-            self.putAnalysis()
-            self.timestamp.append([time.time(), self.frame])
-            self.total_times.append(time.time()-t)
+            self.analyzeFrame(ids)
+            self.frames.set(self.frame)
+            self.frame_time.record(time.time()-t)
         except ObjectNotFoundError:
             logger.error('Estimates unavailable from store, droppping')
         except Empty as e:
@@ -118,6 +102,71 @@ class MeanAnalysis(Actor):
         except Exception as e:
             logger.exception('Error in analysis: {}'.format(e))
 
+    def runBatch(self, items):
+        ''' Batch version of runAvg: items are the ID lists queued on q_in,
+            analysed in order (only the newest if skip_batched is set)
+        '''
+        stim_queue = self.links.get('input_stim_queue')
+        while stim_queue is not None:
+            try:
+                self.updateStim_start(stim_queue.get_nowait())
+            except Empty:
+                break #no change in input stimulus
+        items = [ids for ids in items if ids is not None]
+        if self.skip_batched:
+            frames = [i for i,ids in enumerate(items) if ids[0]!=1]
+            if len(frames) > 1:
+                self.skipped.inc(len(frames)-1)
+                skip = set(frames[:-1])
+                items = [ids for i,ids in enumerate(items) if i not in skip]
+        for ids in items:
+            t = time.time()
+            if ids[0]==1:
+                print('analysis: missing frame')
+                self.q_out.put([1])
+                continue
+            try:
+                self.analyzeFrame(ids)
+                self.frames.set(self.frame)
+                self.frame_time.record(time.time()-t)
+            except ObjectNotFoundError:
+                logger.error('Estimates unavailable from store, droppping')
+            except Exception as e:
+                logger.exception('Error in analysis: {}'.format(e))
+
+    def analyzeFrame(self, ids):
+        ''' Compute and put the analysis for the frame whose
+            store IDs (and frame number, last) are in ids
+        '''
+        self.frame = ids[-1]
+        (self.coordDict, self.image, self.S) = self.client.getList(ids[:-1])
+        self.C = self.S
+        self.coords = [o['coordinates'] for o in self.coordDict]
+        
+        # Compute tuning curves based on input stimulus
+        # Just do overall average activity for now
+        self.stimAvg_start()
+        
+        self.globalAvg = np.mean(self.estsAvg[:,:8], axis=0)
+        self.tune = [self.estsAvg[:,:8], self.globalAvg]
+
+        # Compute coloring of neurons for processed frame
+        # Also rotate and stack as needed for plotting
+        # TODO: move to viz, but we don't need to compute this 30 times/sec
+        self.color = self.plotColorFrame()
+
+        if self.frame >= self.window:
+            window = self.window
+        else:
+            window = self.frame
+
+        if self.C.shape[1]>0:
+            self.Cpop = np.nanmean(self.C, axis=0)
+            self.Cx = np.arange(0,self.Cpop.size)+(self.frame-window)
+            self.Call = self.C #already a windowed version #[:,self.frame-window:self.frame]
+        
+        self.putAnalysis()
+
     def updateStim(self, stim):
         ''' Recevied new signal from some Acquirer to change input stimulus
             [possibly other action items here...? Validation?]
@@ -164,17 +213,16 @@ class MeanAnalysis(Actor):
         ''' Throw things to DS and put IDs in queue for Visual
         '''
         t = time.time()
-        ids = []
-        ids.append(self.client.put(self.Cx, 'Cx'+str(self.frame)))
-        ids.append(self.client.put(self.Call, 'Call'+str(self.frame)))
-        ids.append(self.client.put(self.Cpop, 'Cpop'+str(self.frame)))
-        ids.append(self.client.put(self.tune, 'tune'+str(self.frame)))
-        ids.append(self.client.put(self.color, 'color'+str(self.frame)))
-        ids.append(self.client.put(self.coordDict, 'analys_coords'+str(self.frame)))
+        ids = self.client.putMany({'Cx'+str(self.frame): self.Cx,
+                                   'Call'+str(self.frame): self.Call,
+                                   'Cpop'+str(self.frame): self.Cpop,
+                                   'tune'+str(self.frame): self.tune,
+                                   'color'+str(self.frame): self.color,
+                                   'analys_coords'+str(self.frame): self.coordDict})
         ids.append(self.frame)
 
         self.q_out.put(ids)
-        self.puttime.append(time.time()-t)
+        self.put_time.record(time.time()-t)
 
     def stimAvg_start(self):
         ests = self.S #ests = self.C
@@ -231,7 +279,7 @@ class MeanAnalysis(Actor):
         self.estsAvg = np.abs(np.transpose(np.array(polarAvg)))
         self.estsAvg = np.where(np.isnan(self.estsAvg), 0, self.estsAvg)
         self.estsAvg[self.estsAvg == np.inf] = 0
-        self.stimtime.append(time.time()-t)
+        self.stim_time.record(time.time()-t)
 
     def stimAvg(self):
         ests = self.S #ests = self.C
@@ -315,7 +363,7 @@ class MeanAnalysis(Actor):
         self.estsAvg = np.where(np.isnan(self.estsAvg), 0, self.estsAvg)
         self.estsAvg[self.estsAvg == np.inf] = 0
         #self.estsAvg = np.clip(self.estsAvg*4, 0, 4)
-        self.stimtime.append(time.time()-t)
+        self.stim_time.record(time.time()-t)
 
     def plotColorFrame(self):
         ''' Computes colored nicer background+components frame
@@ -340,7 +388,7 @@ class MeanAnalysis(Actor):
         #     np.swapaxes(color,0,1)
         #TODO: user input for rotating frame? See Visual class
         #print('time plotColorFrame ', time.time()-t)
-        self.colortime.append(time.time()-t)
+        self.color_time.record(time.time()-t)
         return color
 
     def _tuningColor(self, ind, inten):
@@ -1,17 +1,9 @@
 import time
 import pickle
 import json
-import cv2
 import numpy as np
 import scipy.sparse
 from improv.store import Limbo, CannotGetObjectError, ObjectNotFoundError
-from caiman.source_extraction import cnmf
-from caiman.source_extraction.cnmf.utilities import detrend_df_f
-from caiman.source_extraction.cnmf.online_cnmf import OnACID
-from caiman.source_extraction.cnmf.params import CNMFParams
-from caiman.motion_correction import motion_correct_iteration_fast, tile_and_correct
-from caiman.utils.visualization import get_contours
-import caiman as cm
 from os.path import expanduser
 import os
 from queue import Empty
@@ -21,16 +13,38 @@ import traceback
 import logging; logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# caiman and cv2 take seconds to import, so they are only imported (by
+# _importCaiman, from setup) in the process running the actor
+OnACID = CNMFParams = None
+motion_correct_iteration_fast = tile_and_correct = get_contours = None
+cv2 = None
+
+def _importCaiman():
+    ''' Import what CaimanProcessor uses of caiman and cv2 into this module, once
+    '''
+    global OnACID, CNMFParams, motion_correct_iteration_fast, tile_and_correct, get_contours, cv2
+    if OnACID is None:
+        import cv2
+        from caiman.source_extraction.cnmf.online_cnmf import OnACID
+        from caiman.source_extraction.cnmf.params import CNMFParams
+        from caiman.motion_correction import motion_correct_iteration_fast, tile_and_correct
+        from caiman.utils.visualization import get_contours
+
 class CaimanProcessor(Actor):
     '''Wraps CaImAn/OnACID functionality to
        interface with our pipeline.
        Uses code from caiman/source_extraction/cnmf/online_cnmf.py
     '''
-    def __init__(self, *args, init_filename='data/tbif_ex.h5', config_file=None):
+    def __init__(self, *args, init_filename='data/tbif_ex.h5', config_file=None, checkpoint_every=None):
+        ''' checkpoint_every: if set, checkpoint the OnACID state every this
+                many frames, so that a restarted Processor resumes from it
+                instead of running initialize_online again
+        '''
         super().__init__(*args)
         print('initfile ', init_filename, 'config file ', config_file)
         self.param_file = config_file
         self.init_filename = init_filename
+        self.checkpoint_every = checkpoint_every
         self.frame_number = 0
 
     def setup(self):
@@ -50,42 +64,39 @@ class CaimanProcessor(Actor):
         # MUST include inital set of frames
         # TODO: Institute check here as requirement to Nexus
 
+        _importCaiman()
         self.opts = CNMFParams(params_dict=self.params)
-        self.onAc = OnACID(params = self.opts)
-        #TODO: Need to rewrite init online as well to receive individual frames.
-        self.onAc.initialize_online()
+        state = self.restore()
+        if state is not None:
+            self.onAc = state['onAc']
+            self.frame_number = state['frame_number']
+            logger.info('Restored OnACID state at frame {}'.format(self.frame_number))
+        else:
+            self.onAc = OnACID(params = self.opts)
+            #TODO: Need to rewrite init online as well to receive individual frames.
+            self.onAc.initialize_online()
         self.max_shifts_online = self.onAc.params.get('online', 'max_shifts_online')
 
     def run(self):
         '''Run the processor continually on input frames
         '''
-        self.fitframe_time = []
-        self.putAnalysis_time = []
-        self.procFrame_time = [] #aka t_motion
-        self.detect_time = []
-        self.shape_time = []
+        self.fitFrame_time = self.metrics.histogram(self.name+'.fitFrame_time')
+        self.putEstimates_time = self.metrics.histogram(self.name+'.putEstimates_time')
+        self.procFrame_time = self.metrics.histogram(self.name+'.procFrame_time') #aka t_motion
+        self.frame_time = self.metrics.histogram(self.name+'.frame_time')
+        self.frames = self.metrics.gauge(self.name+'.frame')
         self.flag = False
-        self.total_times = []
-        self.timestamp = []
         self.counter = 0
 
-        with RunManager(self.name, self.runProcess, self.setup, self.q_sig, self.q_comm) as rm:
+        with RunManager(self.name, self.runProcess, self.setup, self.q_sig, self.q_comm, links=[self.q_in], metrics=self.metrics) as rm:
             logger.info(rm)
 
-        print('Processor broke, avg time per frame: ', np.mean(self.total_times, axis=0))
+        print('Processor broke, avg time per frame: ', self.frame_time.mean())
         print('Processor got through ', self.frame_number, ' frames')
-        np.savetxt('output/timing/process_frame_time.txt', np.array(self.total_times))
-        np.savetxt('output/timing/process_timestamp.txt', np.array(self.timestamp))
-
-        self.shape_time = np.array(self.onAc.t_shapes)
-        self.detect_time = np.array(self.onAc.t_detect)
-
-        np.savetxt('output/timing/fitframe_time.txt', np.array(self.fitframe_time))
-        np.savetxt('output/timing/shape_time.txt', self.shape_time)
-        np.savetxt('output/timing/detect_time.txt', self.detect_time)
 
-        np.savetxt('output/timing/putAnalysis_time.txt', np.array(self.putAnalysis_time))
-        np.savetxt('output/timing/procFrame_time.txt', np.array(self.procFrame_time))
+        # kept by OnACID itself
+        np.savetxt('output/timing/shape_time.txt', np.array(self.onAc.t_shapes))
+        np.savetxt('output/timing/detect_time.txt', np.array(self.onAc.t_detect))
 
         # before = self.params['init_batch']
         # nb = self.onAc.params.get('init', 'nb')
@@ -135,14 +146,24 @@ class CaimanProcessor(Actor):
         if frame is not None:
             t = time.time()
             self.done = False
+            obj_id = None
             try:
-                self.frame = self.client.getID(frame[0][str(self.frame_number)])
+                number = int(next(iter(frame[0])))
+                if number > self.frame_number: # frames were lost, e.g. with a crashed Processor
+                    logger.warning('Processor: skipping from frame {} to {}'.format(self.frame_number, number))
+                    self.frame_number = number
+                obj_id = frame[0][str(self.frame_number)]
+                self.frame = self.client.getID(obj_id)
                 self.frame = self._processFrame(self.frame, self.frame_number+init)
+                self.client.releaseID(obj_id) # _processFrame made a copy
+                obj_id = None
                 t2 = time.time()
                 self._fitFrame(self.frame_number+init, self.frame.reshape(-1, order='F'))
-                self.fitframe_time.append([time.time()-t2])
+                self.fitFrame_time.record(time.time()-t2)
                 self.putEstimates()
-                self.timestamp.append([time.time(), self.frame_number])
+                self.frames.set(self.frame_number)
+                if self.checkpoint_every and (self.frame_number+1) % self.checkpoint_every == 0:
+                    self.checkpoint({'onAc': self.onAc, 'frame_number': self.frame_number+1})
             except ObjectNotFoundError:
                 logger.error('Processor: Frame {} unavailable from store, droppping'.format(self.frame_number))
                 self.dropped_frames.append(self.frame_number)
@@ -156,8 +177,10 @@ class CaimanProcessor(Actor):
                                                                                             e, self.frame_number))
                 print(traceback.format_exc())
                 self.dropped_frames.append(self.frame_number)
+            finally:
+                self.client.releaseID(obj_id) # in case processing failed
             self.frame_number += 1
-            self.total_times.append(time.time()-t)
+            self.frame_time.record(time.time()-t)
         else:
             pass
 
@@ -218,7 +241,6 @@ class CaimanProcessor(Actor):
         A = self.onAc.estimates.Ab[:, nb:]
         before = self.params['init_batch'] #self.frame_number-500 if self.frame_number > 500 else 0
         C = self.onAc.estimates.C_on[nb:self.onAc.M, before:self.frame_number+before] #.get_ordered()
-        t2 = time.time()
         if self.onAc.estimates.OASISinstances is not None:
             try:
                 # if self.dropped_frames and self.dropped_frames[-1] > before: #Need to pad with zeros due to dropped/missing frames
@@ -249,26 +271,21 @@ class CaimanProcessor(Actor):
                 print(before)
         else:
             S = np.zeros((self.onAc.estimates.C_on.shape[0], self.frame_number - before))
-        t3 = time.time()
 
         image = self.makeImage()
         if self.frame_number == 1:
             np.savetxt('output/image.txt', np.array(image))
-        t4 = time.time()
         dims = image.shape
         self._updateCoords(A,dims)
-        t5 = time.time()
 
-        ids = []
-        ids.append(self.client.put(self.coords, 'coords'+str(self.frame_number)))
-        ids.append(self.client.put(image, 'proc_image'+str(self.frame_number)))
-        ids.append(self.client.put(C, 'S'+str(self.frame_number)))
+        ids = self.client.putMany({'coords'+str(self.frame_number): self.coords,
+                                   'proc_image'+str(self.frame_number): image,
+                                   'S'+str(self.frame_number): C})
         ids.append(self.frame_number)
-        t6 = time.time()
         self.q_out.put(ids)
         #self.q_comm.put([self.frame_number])
 
-        self.putAnalysis_time.append([time.time()-t, t2-t, t3-t2, t4-t3, t5-t4, t6-t5])
+        self.putEstimates_time.record(time.time()-t)
 
 
     def _checkFrames(self):
@@ -322,7 +339,7 @@ class CaimanProcessor(Actor):
             frame_cor = frame
         if self.onAc.params.get('online', 'normalize'):
             frame_cor = frame_cor/self.onAc.img_norm
-        self.procFrame_time.append([time.time()-t])
+        self.procFrame_time.record(time.time()-t)
         return frame_cor
 
 
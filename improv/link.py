@@ -0,0 +1,485 @@
+import asyncio
+import heapq
+import itertools
+import os
+import pickle
+import secrets
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Lock, Pipe, Semaphore
+from queue import Empty, Full
+from improv.store import _openSegment, _unlinkSegment
+
+import logging; logger = logging.getLogger(__name__)
+
+
+class RingQueue():
+    ''' Queue backed by a ring of fixed-size slots in one shared memory
+        segment. Items are pickled straight into a slot, so a put/get
+        is a memcpy plus two semaphore operations instead of a round
+        trip through a Manager server process.
+
+        Supports the subset of the multiprocessing.Queue API that
+        Links use (put, get, put_nowait, get_nowait, qsize, empty, full).
+        Any number of producers and consumers may share a RingQueue.
+        Must be created in the Nexus process before actors are started.
+
+        Every put also writes a byte to a non-blocking pipe, so consumers
+        can wait for data with select/epoll (fileno) or an event loop
+        (get_async) instead of parking a thread in a blocking get.
+    '''
+
+    def __init__(self, slots=256, slot_size=4096):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.shm = _openSegment(RING_PREFIX+secrets.token_hex(8), create=True,
+                                size=RING_HEADER.size+slots*slot_size)
+        RING_HEADER.pack_into(self.shm.buf, 0, 0, 0)
+        self.items = Semaphore(0)
+        self.spaces = Semaphore(slots)
+        self.put_lock = Lock()
+        self.get_lock = Lock()
+        self.reader, self.writer = Pipe(duplex=False)
+        os.set_blocking(self.reader.fileno(), False)
+        os.set_blocking(self.writer.fileno(), False)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shm'] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = _openSegment(state['shm'])
+
+    def put(self, item, block=True, timeout=None):
+        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.slot_size-SLOT_LEN.size:
+            raise ValueError('Item of {} bytes does not fit in a {} byte slot'.format(len(data), self.slot_size))
+        if not self.spaces.acquire(block, timeout):
+            raise Full
+        with self.put_lock:
+            head, tail = RING_HEADER.unpack_from(self.shm.buf, 0)
+            offset = RING_HEADER.size + (tail % self.slots)*self.slot_size
+            SLOT_LEN.pack_into(self.shm.buf, offset, len(data))
+            self.shm.buf[offset+SLOT_LEN.size:offset+SLOT_LEN.size+len(data)] = data
+            struct.pack_into('<Q', self.shm.buf, 8, tail+1)
+        self.items.release()
+        self.notify()
+
+    def get(self, block=True, timeout=None):
+        if not self.items.acquire(block, timeout):
+            raise Empty
+        with self.get_lock:
+            head, tail = RING_HEADER.unpack_from(self.shm.buf, 0)
+            offset = RING_HEADER.size + (head % self.slots)*self.slot_size
+            n = SLOT_LEN.unpack_from(self.shm.buf, offset)[0]
+            data = bytes(self.shm.buf[offset+SLOT_LEN.size:offset+SLOT_LEN.size+n])
+            struct.pack_into('<Q', self.shm.buf, 0, head+1)
+        self.spaces.release()
+        if head+1 < tail:
+            self.notify() # another consumer may have drained the pipe for this one
+        return pickle.loads(data)
+
+    async def get_async(self):
+        ''' Wait for an item on the event loop without using a thread
+        '''
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                return self.get_nowait()
+            except Empty:
+                pass
+            ready = loop.create_future()
+            fd = self.fileno() # the pipe may be closed (destroy) before the wait is cancelled
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+            self.drain()
+
+    def fileno(self):
+        ''' Descriptor that becomes readable when items may be available
+        '''
+        return self.reader.fileno()
+
+    def notify(self):
+        try:
+            os.write(self.writer.fileno(), b'\0')
+        except BlockingIOError:
+            pass # pipe already full of wakeups
+
+    def drain(self):
+        ''' Consume pending wakeups; call before checking the queue again
+        '''
+        try:
+            while os.read(self.reader.fileno(), 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        head, tail = RING_HEADER.unpack_from(self.shm.buf, 0)
+        return tail-head
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.slots
+
+    def close(self):
+        self.shm.close()
+
+    def destroy(self):
+        ''' Unlink the segment. Only the Nexus should call this, at shutdown
+        '''
+        if self.shm.buf is None:
+            return # already destroyed
+        try:
+            _unlinkSegment(self.shm)
+            self.shm.close()
+        except FileNotFoundError:
+            pass
+        self.reader.close()
+        self.writer.close()
+
+
+class BroadcastRing():
+    ''' Producers and many consumers sharing a single ring of slots.
+        Each item is pickled and copied into shared memory once, whatever
+        the number of consumers; every consumer has its own read cursor
+        and gets its own BroadcastReader (see reader).
+
+        Lossless readers hold back the producers when they fall a full
+        ring behind. Readers created with skip=True never block the
+        producers: when more than their capacity of items is waiting
+        they skip ahead, keeping only that many of the newest items
+        (one for display consumers that only want the latest frame).
+    '''
+
+    def __init__(self, readers, slots=256, slot_size=4096, skip=(), capacity=None):
+        ''' readers: number of consumers
+            skip: indices of readers allowed to skip ahead
+            capacity: per reader, the number of newest items a skipping
+                reader keeps, at most slots (default)
+        '''
+        self.n_readers = readers
+        self.slots = slots
+        self.slot_size = slot_size
+        self.skip = [i in skip for i in range(readers)]
+        self.capacity = [min(c, slots) for c in capacity] if capacity is not None else [slots]*readers
+        self.header_size = 8*(1+2*readers) # tail, then one head per reader, then drops per reader
+        self.shm = _openSegment(RING_PREFIX+secrets.token_hex(8), create=True,
+                                size=self.header_size+slots*slot_size)
+        self.shm.buf[:self.header_size] = bytes(self.header_size)
+        for i in range(slots):
+            SLOT_HEAD.pack_into(self.shm.buf, self._offset(i), EMPTY_SEQ, 0)
+        self.items = [Semaphore(0) for i in range(readers)]
+        self.spaces = [None if lossy else Semaphore(slots) for lossy in self.skip]
+        self.put_lock = Lock() # replicas of an actor share its output ring
+        self.get_locks = [Lock() for i in range(readers)]
+        self.pipes = [Pipe(duplex=False) for i in range(readers)]
+        for reader, writer in self.pipes:
+            os.set_blocking(reader.fileno(), False)
+            os.set_blocking(writer.fileno(), False)
+
+    __getstate__ = RingQueue.__getstate__
+    __setstate__ = RingQueue.__setstate__
+
+    def reader(self, index):
+        return BroadcastReader(self, index)
+
+    def put(self, item, block=True, timeout=None):
+        data = pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.slot_size-SLOT_HEAD.size:
+            raise ValueError('Item of {} bytes does not fit in a {} byte slot'.format(len(data), self.slot_size))
+        acquired = []
+        for sem in self.spaces:
+            if sem is None:
+                continue
+            if not sem.acquire(block, timeout):
+                for s in acquired:
+                    s.release()
+                raise Full
+            acquired.append(sem)
+        with self.put_lock:
+            tail = self._tail()
+            offset = self._offset(tail)
+            SLOT_HEAD.pack_into(self.shm.buf, offset, BUSY_SEQ, len(data))
+            self.shm.buf[offset+SLOT_HEAD.size:offset+SLOT_HEAD.size+len(data)] = data
+            struct.pack_into('<Q', self.shm.buf, offset, tail)
+            struct.pack_into('<Q', self.shm.buf, 0, tail+1)
+        for i in range(self.n_readers):
+            self.items[i].release()
+            try:
+                os.write(self.pipes[i][1].fileno(), b'\0')
+            except BlockingIOError:
+                pass
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def _get(self, index, block=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic()+timeout
+        while True:
+            wait = None if deadline is None else max(0, deadline-time.monotonic())
+            if not self.items[index].acquire(block, wait):
+                raise Empty
+            with self.get_locks[index]:
+                head = self._head(index)
+                tail = self._tail()
+                if head >= tail:
+                    continue # wakeup for an item already skipped
+                if self.skip[index] and tail-head > self.capacity[index]:
+                    head = tail-self.capacity[index]
+                    skipped = head-self._head(index)
+                    for i in range(skipped):
+                        self.items[index].acquire(False)
+                    self._addDrops(index, skipped)
+                offset = self._offset(head)
+                seq, n = SLOT_HEAD.unpack_from(self.shm.buf, offset)
+                data = bytes(self.shm.buf[offset+SLOT_HEAD.size:offset+SLOT_HEAD.size+n])
+                if SLOT_HEAD.unpack_from(self.shm.buf, offset)[0] != head or seq != head:
+                    # overwritten while copying; only possible for readers that skip
+                    self._setHead(index, head+1)
+                    self._addDrops(index, 1)
+                    continue
+                self._setHead(index, head+1)
+            if self.spaces[index] is not None:
+                self.spaces[index].release()
+            if head+1 < tail:
+                self._notify(index)
+            return pickle.loads(data)
+
+    def _notify(self, index):
+        try:
+            os.write(self.pipes[index][1].fileno(), b'\0')
+        except BlockingIOError:
+            pass
+
+    def _offset(self, i):
+        return self.header_size + (i % self.slots)*self.slot_size
+
+    def _tail(self):
+        return struct.unpack_from('<Q', self.shm.buf, 0)[0]
+
+    def _head(self, index):
+        return struct.unpack_from('<Q', self.shm.buf, 8*(1+index))[0]
+
+    def _setHead(self, index, head):
+        struct.pack_into('<Q', self.shm.buf, 8*(1+index), head)
+
+    def _addDrops(self, index, n):
+        offset = 8*(1+self.n_readers+index) # only written by this reader, under its get lock
+        struct.pack_into('<Q', self.shm.buf, offset, struct.unpack_from('<Q', self.shm.buf, offset)[0]+n)
+
+    def dropped(self, index=None):
+        ''' Items skipped by reader index, or by all readers
+        '''
+        if index is None:
+            return sum(self.dropped(i) for i in range(self.n_readers))
+        return struct.unpack_from('<Q', self.shm.buf, 8*(1+self.n_readers+index))[0]
+
+    def qsize(self):
+        return max((self._tail()-self._head(i) for i in range(self.n_readers)), default=0)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.slots
+
+    def close(self):
+        self.shm.close()
+
+    def destroy(self):
+        ''' Unlink the segment. Only the Nexus should call this, at shutdown
+        '''
+        if self.shm.buf is None:
+            return # already destroyed
+        try:
+            _unlinkSegment(self.shm)
+            self.shm.close()
+        except FileNotFoundError:
+            pass
+        for reader, writer in self.pipes:
+            reader.close()
+            writer.close()
+
+
+class BroadcastReader():
+    ''' Consumer end of a BroadcastRing, with the same API as RingQueue
+    '''
+
+    def __init__(self, ring, index):
+        self.ring = ring
+        self.index = index
+
+    def get(self, block=True, timeout=None):
+        return self.ring._get(self.index, block, timeout)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    get_async = RingQueue.get_async
+    drain = RingQueue.drain
+
+    @property
+    def reader(self):
+        return self.ring.pipes[self.index][0]
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def dropped(self):
+        return self.ring.dropped(self.index)
+
+    def qsize(self):
+        return min(self.ring._tail()-self.ring._head(self.index), self.ring.capacity[self.index])
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.ring.capacity[self.index]
+
+    def close(self):
+        self.ring.close()
+
+
+# Ordering for replicated actors.
+#
+# A Link feeding an actor with replicas numbers each item as it is put
+# (Numbered). A replica taking a numbered item remembers its number as
+# current(), and puts on a Link out of the replicated actor are tagged
+# with it. The consumer of such a Link reads through a ReorderBuffer,
+# which hands items out in input order whichever replica finished first.
+
+_seq = None # number of the input item this process is working on
+
+def current():
+    return _seq
+
+def unnumber(item):
+    ''' Unwrap a Numbered item taken from a Link and make its number current
+    '''
+    global _seq
+    if not isinstance(item, Numbered):
+        return item
+    _seq = item.seq
+    return item.item
+
+
+class Numbered():
+    ''' An item on a Link together with its position in the input stream
+    '''
+    __slots__ = ('seq', 'item')
+
+    def __init__(self, seq, item):
+        self.seq = seq
+        self.item = item
+
+    def __getstate__(self):
+        return (self.seq, self.item)
+
+    def __setstate__(self, state):
+        self.seq, self.item = state
+
+
+class ReorderBuffer():
+    ''' Restores input order of Numbered items coming out of replicas.
+        An item is held until every lower number has been handed out.
+        A number that never comes (its input was dropped or the replica
+        put nothing for it) is given up on after holding more than window
+        items or waiting wait seconds for it. Untagged items pass through.
+    '''
+
+    def __init__(self, window=16, wait=1.0):
+        self.window = window
+        self.wait = wait
+        self.heap = []
+        self.next = 0 # lowest number not yet handed out
+        self.ties = itertools.count() # one input may give several outputs
+        self.gapSince = None
+
+    def get(self, take, block=True, timeout=None):
+        ''' Next item in order, using take(block, timeout) to read the Link
+        '''
+        deadline = None if timeout is None else time.monotonic()+timeout
+        while True:
+            now = time.monotonic()
+            if self.heap:
+                if self.heap[0][0] <= self.next or len(self.heap) > self.window:
+                    return self._pop()
+                if self.gapSince is None:
+                    self.gapSince = now
+                if now-self.gapSince >= self.wait:
+                    logger.warning('Gave up waiting for item {}'.format(self.next))
+                    return self._pop()
+            waits = [t for t in [None if deadline is None else deadline-now,
+                                 self.gapSince+self.wait-now if self.heap else None] if t is not None]
+            wait = max(0, min(waits)) if waits else None
+            try:
+                item = take(block, wait)
+            except Empty:
+                if not block or (deadline is not None and time.monotonic() >= deadline):
+                    raise
+                continue
+            if not isinstance(item, Numbered):
+                return item
+            heapq.heappush(self.heap, (item.seq, next(self.ties), item))
+
+    def timeout(self):
+        ''' Seconds until get hands out a held item even if nothing new
+            arrives (0: one can go now), or None if no item is held.
+            The wait for a missing item starts when it is first found missing.
+        '''
+        if not self.heap:
+            return None
+        if self.heap[0][0] <= self.next or len(self.heap) > self.window:
+            return 0
+        now = time.monotonic()
+        if self.gapSince is None:
+            self.gapSince = now
+        return max(0, self.gapSince+self.wait-now)
+
+    def _pop(self):
+        seq, _, item = heapq.heappop(self.heap)
+        self.next = max(self.next, seq+1)
+        self.gapSince = None
+        return item
+
+
+def sharedExecutor():
+    ''' Thread pool shared by every Link in this process, for queues
+        that can only be waited on with a blocking get (Manager queues).
+        Threads are only started as they are needed.
+    '''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix='improv_link')
+    return _executor
+
+def _resetExecutor():
+    global _executor
+    _executor = None # threads do not survive fork
+
+_executor = None
+os.register_at_fork(after_in_child=_resetExecutor)
+
+EXECUTOR_WORKERS = 64 # enough for one pending get per Manager Link polled by Nexus
+RING_PREFIX = 'improv_link_'
+RING_HEADER = struct.Struct('<QQ') # head (next to read), tail (next to write)
+SLOT_LEN = struct.Struct('<I')
+SLOT_HEAD = struct.Struct('<QI') # sequence number of the item in the slot, length
+BUSY_SEQ = 2**64-1
+EMPTY_SEQ = 2**64-2
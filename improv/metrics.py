@@ -0,0 +1,186 @@
+import csv
+import secrets
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from multiprocessing import Lock
+import numpy as np
+from improv import store # module, not names: improv.store imports improv.actor, which imports this
+from improv.trace import Histogram as _Summary
+
+import logging; logger = logging.getLogger(__name__)
+
+# Counters, gauges and latency histograms that actors update from their
+# hot paths and Nexus reads while they run. Nexus creates one shared
+# registry and hands it to every actor (Actor.setMetrics); an actor
+# running on its own gets a private registry instead.
+#
+# Each metric has a single writer (the actor that owns it), so updates
+# are plain numpy writes into preallocated shared memory, without locks.
+# Only registering a new metric takes the registry lock. Once the registry
+# is full, new metrics still work but are not recorded (a warning is
+# logged once), so an actor never fails for registering a metric.
+#
+# While running, Nexus appends a snapshot of every metric to a CSV file
+# (MetricsLog) every metrics_interval seconds, so the numbers survive an
+# actor crash and show how they evolved over the run.
+
+EDGES = list(_Summary.edges) # same log-spaced bins as the trace histograms
+KINDS = ('counter', 'gauge', 'histogram')
+METRIC = np.dtype([('name', 'S64'), ('kind', 'u1'), ('count', 'i8'), ('value', 'f8'),
+                   ('bins', 'i8', (len(EDGES)+1,))])
+
+
+class MetricsRegistry():
+    ''' Table of up to capacity metrics, in shared memory if shared
+        (must then be created before actor processes are started)
+    '''
+
+    def __init__(self, capacity=64, shared=False):
+        self.capacity = capacity
+        size = 8 + capacity*METRIC.itemsize
+        if shared:
+            self.shm = store._openSegment('improv_metrics_'+secrets.token_hex(8), create=True, size=size)
+            buf = self.shm.buf
+        else:
+            self.shm = None
+            buf = self.buf = bytearray(size)
+        self.lock = Lock()
+        self.warned = False # about being full, once per process
+        self._map(buf)
+        self.used[0] = 0
+
+    def _map(self, buf):
+        self.used = np.ndarray((1,), np.int64, buf, 0)
+        self.table = np.ndarray((self.capacity,), METRIC, buf, 8)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['used'], state['table']
+        if self.shm is not None:
+            state['shm'] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shm is None:
+            self._map(self.buf) # private registry travels as a copy
+        else:
+            self.shm = store._openSegment(state['shm'])
+            self._map(self.shm.buf)
+
+    def counter(self, name):
+        return Counter(self, self._register(name, 'counter'))
+
+    def gauge(self, name):
+        return Gauge(self, self._register(name, 'gauge'))
+
+    def histogram(self, name):
+        return LatencyHistogram(self, self._register(name, 'histogram'))
+
+    def _register(self, name, kind):
+        ''' Index of metric name, adding it if new;
+            None if it is new and the registry is full
+        '''
+        key = name.encode()[:METRIC['name'].itemsize]
+        with self.lock:
+            n = int(self.used[0])
+            for i in range(n):
+                if self.table['name'][i] == key:
+                    if KINDS[self.table['kind'][i]] != kind:
+                        raise TypeError('Metric {} is a {}, not a {}'.format(name, KINDS[self.table['kind'][i]], kind))
+                    return i
+            if n == self.capacity:
+                if not self.warned:
+                    logger.warning('Metrics registry is full ({} metrics); not recording {} or any later new metric'.format(
+                                   self.capacity, name))
+                    self.warned = True
+                return None
+            self.table[n] = (key, KINDS.index(kind), 0, 0.0, 0)
+            self.used[0] = n+1
+            return n
+
+    def snapshot(self):
+        ''' Current value of every metric, as a list of dicts with
+            name, kind, count, value and, for histograms, mean/p50/p90/p99
+        '''
+        rows = []
+        for rec in self.table[:int(self.used[0])].copy():
+            row = {'name': rec['name'].decode(), 'kind': KINDS[rec['kind']],
+                   'count': int(rec['count']), 'value': float(rec['value'])}
+            if row['kind'] == 'histogram':
+                s = _Summary(rec['bins'], rec['value']).summary()
+                row.update({k: s[k] for k in ['mean', 'p50', 'p90', 'p99']})
+            rows.append(row)
+        return rows
+
+    def destroy(self):
+        ''' Unlink the shared segment. Only the Nexus should call this, at shutdown
+        '''
+        if self.shm is not None:
+            del self.used, self.table # release views before closing
+            store._unlinkSegment(self.shm)
+            self.shm.close()
+            self.shm = None
+
+
+class _Metric():
+    def __init__(self, registry, index):
+        table = registry.table
+        if index is None: # registry full: update a row nothing reads
+            table, index = np.zeros(1, METRIC), 0
+        self.count = table['count'][index:index+1]
+        self.value = table['value'][index:index+1]
+        self.bins = table['bins'][index]
+
+
+class Counter(_Metric):
+    def inc(self, n=1):
+        self.count[0] += n
+
+
+class Gauge(_Metric):
+    def set(self, value):
+        self.value[0] = value
+        self.count[0] += 1
+
+
+class LatencyHistogram(_Metric):
+    ''' Durations in seconds; value holds their sum
+    '''
+    def record(self, seconds):
+        self.bins[bisect_left(EDGES, seconds)] += 1
+        self.count[0] += 1
+        self.value[0] += seconds
+
+    @contextmanager
+    def time(self):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(time.perf_counter()-t)
+
+    def mean(self):
+        return self.value[0]/self.count[0] if self.count[0] else None
+
+
+class MetricsLog():
+    ''' Appends registry snapshots to a CSV file, one row per metric
+        with the time of the snapshot
+    '''
+    columns = ['time', 'name', 'kind', 'count', 'value', 'mean', 'p50', 'p90', 'p99']
+
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.DictWriter(self.file, self.columns)
+        self.writer.writeheader()
+
+    def write(self, rows, t=None):
+        t = time.time() if t is None else t
+        for row in rows:
+            self.writer.writerow({'time': t, **row})
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
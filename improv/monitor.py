@@ -0,0 +1,44 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+import logging; logger = logging.getLogger(__name__)
+
+# Local stats endpoint for the pipeline health that Nexus samples while
+# running (Nexus.pollHealth). Any GET on http://127.0.0.1:<port>/ returns
+# the latest sample as JSON, e.g. curl localhost:<port> | python -m json.tool
+
+
+class StatsServer():
+    ''' Serves the latest stats dict from a daemon thread
+        port: 0 picks a free port; the one used is in self.port
+    '''
+
+    def __init__(self, port=0):
+        self.stats = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(server.stats).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass # keep requests out of the Nexus log
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.port = self.httpd.server_address[1]
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info('Serving pipeline stats on http://127.0.0.1:{}/'.format(self.port))
+
+    def update(self, stats):
+        self.stats = stats # replaced whole, so readers never see a partial sample
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,19 +1,20 @@
-import sys
 import os
 import time
+import argparse
+import yaml
 import subprocess
-from multiprocessing import Process, Queue, Manager, cpu_count, set_start_method
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-import numpy as np
-from PyQt5 import QtGui, QtWidgets
-import pyarrow.plasma as plasma
+from multiprocessing import Process, Queue, Manager, Value, set_start_method
 from importlib import import_module
-from improv import store
-from improv.tweak import Tweak
-from threading import Thread
+from improv import store, trace
+from improv.metrics import MetricsRegistry, MetricsLog
+from improv.monitor import StatsServer
+from improv import link as _link
+from improv.link import RingQueue, BroadcastRing, ReorderBuffer, sharedExecutor
+from improv.tweak import Tweak, InvalidPolicyError
+from improv.utils import scheduling
+from improv.utils.checks import consumers_first
 import asyncio
-import concurrent
-import functools
+import concurrent.futures
 import signal
 from improv.actor import Spike
 from queue import Empty, Full
@@ -46,11 +47,23 @@ class Nexus():
     def __str__(self):
         return self.name
 
-    def createNexus(self, file=None):
-        self._startStore(40000000000) #default size should be system-dependent; this is 40 GB
+    def createNexus(self, file=None, settings=None):
+        ''' settings: overrides of the config's settings, e.g. from the command line
+        '''
+        self.t0 = time.time()
+        self.startup = {} # name: {event: seconds since t0}, see logStartup
+
+        # Settings (e.g. which store backend to use) are needed before the store starts
+        self.tweak = Tweak(configFile = file)
+        self.tweak.createConfig()
+        if settings is not None:
+            self.tweak.settings.update(settings)
+        self.tweak.checkSettings()
+
+        self._startStore(self.tweak.settings['store_size']) #default size should be system-dependent; this is 40 GB
 
         #connect to store and subscribe to notifications
-        self.limbo = store.Limbo()
+        self.limbo = self.createStore('Nexus')
         self.limbo.subscribe()
 
         self.comm_queues = {}
@@ -59,29 +72,71 @@ class Nexus():
         self.actors = {}
         self.flags = {}
         self.processes = []
+        self.actorProcesses = {} # name: Process of each actor Nexus may restart
+        self.restarts = {} # name: number of times restarted
+        self.restarting = set() # restarted actors not yet ready
+        self.checkpoints = {} # name: store ID of the actor's last checkpoint
+        self.p_GUI = None
+
+        # End of a run, see acquirerDone
+        self.tRun = None # when the actors were told to run
+        self.tDone = None # when the last acquirer was done
+        self.finished = set() # acquirers that are done
+        self.finishing = None # finishRun task of a headless run
+        self.failure = None # (actor, error) of an actor that stopped before it was ready
 
         #self.startWatcher()
 
-        self.loadTweak(file=file)
+        # Hop records from traced data links, see improv.trace
+        self.traceLink = RingQueue(slots=4096, slot_size=512) if self.tweak.settings['trace'] else None
+        self.latency = trace.LatencyStats()
+
+        # Span rings of the actor processes, merged into a Chrome trace at quit
+        self.spanRings = {}
+
+        # name: instances of each replicated actor, see createReplicas
+        self.replicas = {}
+
+        # Metrics every actor updates in place, see improv.metrics
+        self.metrics = MetricsRegistry(capacity=self.metricsCapacity(), shared=True)
+        self.metricsLog = None
+        if self.tweak.settings['metrics_file'] is not None:
+            self.metricsLog = MetricsLog(self.tweak.settings['metrics_file'])
+
+        # Pipeline health sampled every monitor_interval seconds, see pollHealth
+        self.monitor = None
+        self._lastFrames = {}
+        if self.tweak.settings['monitor_interval'] is not None and self.tweak.settings['monitor_port'] is not None:
+            self.monitor = StatsServer(self.tweak.settings['monitor_port'])
+
+        self.loadTweak()
 
         self.flags.update({'quit':False, 'run':False, 'load':False})
         self.allowStart = False
 
+    def metricsCapacity(self):
+        ''' Size of the shared metrics registry: the metrics_capacity setting,
+            or else room for metrics_per_actor metrics per actor instance,
+            replicas and the GUI included, and as many for Nexus
+        '''
+        if self.tweak.settings['metrics_capacity'] is not None:
+            return self.tweak.settings['metrics_capacity']
+        instances = sum(a.replicas for a in self.tweak.actors.values()) + self.tweak.hasGUI + 1
+        return instances*self.tweak.settings['metrics_per_actor']
+
     def startNexus(self):
         ''' Puts all actors in separate processes and begins polling
             to listen to comm queues
         '''
-        for name,m in self.actors.items(): # m accesses the specific actor class instance
+        for name in self.startupOrder():
             if 'GUI' not in name: #GUI already started
-                p = Process(target=self.runActor, name=name, args=(m,))
-                if 'daemon' in self.tweak.actors[name].options: # e.g. suite2p creates child processes.
-                    p.daemon = self.tweak.actors[name].options['daemon']
-                    logger.info('Setting daemon to {} for {}'.format(p.daemon,name))
-                else: 
-                    p.daemon = True #default behavior
+                p = self.createProcess(name, self.actors[name])
                 self.processes.append(p)
+                self.actorProcesses[name] = p
 
         self.start()
+        if self.tweak.settings['headless']:
+            self.setup() # actors set up as soon as they have loaded
 
         loop = asyncio.get_event_loop()
 
@@ -92,6 +147,18 @@ class Nexus():
 
         loop.run_until_complete(self.pollQueues()) #TODO: in Link executor, complete all tasks
 
+    def createProcess(self, name, actor):
+        ''' Process running the actor, not yet started
+        '''
+        p = Process(target=self.runActor, name=name, args=(actor,))
+        options = self.tweak.actors[name.split('#')[0]].options # replicas share options
+        if 'daemon' in options: # e.g. suite2p creates child processes.
+            p.daemon = options['daemon']
+            logger.info('Setting daemon to {} for {}'.format(p.daemon,name))
+        else:
+            p.daemon = True #default behavior
+        return p
+
     def loadTweak(self, file=None):
         ''' For each connection:
             create a Link with a name (purpose), start, and end
@@ -103,16 +170,23 @@ class Nexus():
               for communication purposes.
             OR
             For each connection, create 2 Links. Nexus acts as intermediary.
+
+            If file is None, uses the Tweak already read in createNexus
         '''
         #TODO load from file or user input, as in dialogue through FrontEnd?
 
-        self.tweak = Tweak(configFile = file)
-        self.tweak.createConfig()
+        if file is not None:
+            self.tweak = Tweak(configFile = file)
+            self.tweak.createConfig()
+
+        self.unread = [] # sources of connections to the visual actor only, see dropVisual
+        if self.tweak.hasGUI and self.tweak.settings['headless']:
+            self.dropVisual()
 
         # create all data links requested from Tweak config
         self.createConnections()
 
-        if self.tweak.hasGUI:
+        if self.tweak.hasGUI and not self.tweak.settings['headless']:
             # Have to load GUI first (at least with Caiman)
             name = self.tweak.gui.name
             m = self.tweak.gui # m is TweakModule
@@ -130,7 +204,7 @@ class Nexus():
                 self.createActor(name, m)
                 self.actors[name].setup(visual=self.actors[visualClass])
 
-                self.p_GUI = Process(target=self.actors[name].run, name=name)
+                self.p_GUI = Process(target=self.runActor, name=name, args=(self.actors[name],))
                 self.p_GUI.daemon = True
                 self.p_GUI.start()
 
@@ -138,10 +212,12 @@ class Nexus():
                 logger.error('Exception in setting up GUI {}'.format(name)+': {}'.format(e))
 
         # First set up each class/actor
+        defer = self.tweak.settings['load_in_process']
         for name,actor in self.tweak.actors.items():
             if name not in self.actors.keys():
                 #Check for actors being instantiated twice
-                self.createActor(name, actor)
+                self.createActor(name, actor, defer)
+                self.createReplicas(name, actor, defer)
 
         # Second set up each connection b/t actors
         for name,link in self.data_queues.items():
@@ -149,27 +225,116 @@ class Nexus():
 
         #TODO: error handling for if a user tries to use q_in without defining it
 
-    def createActor(self, name, actor):
+    def dropVisual(self):
+        ''' Headless runs have no GUI to show the visual actor, so leave it
+            and the connections to and from it out of the Tweak.
+            A source that only fed the visual actor keeps a Link that
+            nothing reads (createConnections)
+        '''
+        visual = self.tweak.gui.options.get('visual')
+        self.tweak.actors.pop(visual, None)
+        for source, drain in list(self.tweak.connections.items()):
+            drain = [d for d in drain if d.split('.')[0] != visual]
+            if source.split('.')[0] == visual:
+                del self.tweak.connections[source]
+            elif not drain:
+                del self.tweak.connections[source]
+                self.unread.append(source)
+            else:
+                self.tweak.connections[source] = drain
+        logger.info('Headless: not running {}'.format(visual))
+
+    def createActor(self, name, actor, defer=False):
         ''' Function to instantiate actor, add signal and comm Links,
             and update self.actors dictionary
+            defer: leave importing and instantiating the class to the
+            actor's own process (see DeferredActor)
         '''
-        # Instantiate selected class
-        mod = import_module(actor.packagename)
-        clss = getattr(mod, actor.classname)
-        instance = clss(actor.name, **actor.options)
+        if defer:
+            instance = DeferredActor(name, actor)
+        else:
+            # Instantiate selected class
+            mod = import_module(actor.packagename)
+            clss = getattr(mod, actor.classname)
+            instance = clss(name, **actor.options)
 
         # Add link to Limbo store
-        instance.setStore(store.Limbo(actor.name))
+        instance.setStore(self.createStore(name))
+        instance.setMetrics(self.metrics)
+        if self.tweak.settings['timeline'] is not None:
+            self.spanRings[name] = trace.SpanRing(self.tweak.settings['timeline_slots'])
 
         # Add signal and communication links
-        q_comm = Link(actor.name+'_comm', actor.name, self.name)
-        q_sig = Link(actor.name+'_sig', self.name, actor.name)
+        q_comm = self.createLink(name+'_comm', name, self.name)
+        q_sig = self.createLink(name+'_sig', self.name, name)
         self.comm_queues.update({q_comm.name:q_comm})
         self.sig_queues.update({q_sig.name:q_sig})
         instance.setCommLinks(q_comm, q_sig)
 
         # Update information
         self.actors.update({name:instance})
+        self.markStartup(name, 'created')
+
+    def createReplicas(self, name, actor, defer=False):
+        ''' Instances name#1 .. name#(replicas-1) of a replicated actor,
+            each run in its own process next to name itself.
+            They get the same Links (assignLink), so they share the input
+            and their results are put back in input order (sequenceLinks).
+            Only suits actors whose items can be handled independently.
+        '''
+        self.replicas[name] = [name]
+        for i in range(1, actor.replicas):
+            self.createActor(name+'#'+str(i), actor, defer)
+            self.replicas[name].append(name+'#'+str(i))
+
+    def startupOrder(self):
+        ''' Actor names with every actor after the actors it sends to,
+            so that consumers are running before their producers start;
+            in config order if the connections form a loop
+        '''
+        order = consumers_first(self.tweak.connections) or []
+        names = [n for base in order for n in self.replicas.get(base, [base]) if n in self.actors]
+        return names + [n for n in self.actors.keys() if n not in names]
+
+    def markStartup(self, name, event):
+        self.startup.setdefault(name, {})[event] = time.time()-self.t0
+
+    def logStartup(self):
+        ''' Log when each actor was created, started, told to set up and
+            ready, and how long its process took to load it, in seconds
+            since Nexus started
+        '''
+        loaded = {row['name'][:-len('.load_time')]: row['value'] for row in self.metrics.snapshot()
+                  if row['name'].endswith('.load_time')}
+        logger.info('Startup timeline (s since Nexus start):')
+        for name in self.startupOrder():
+            events = ' '.join('{} {:.2f}'.format(e, t) for e,t in self.startup.get(name, {}).items())
+            load = ' (loaded in {:.2f})'.format(loaded[name]) if name in loaded else ''
+            logger.info('  {}: {}{}'.format(name, events, load))
+
+    def createStore(self, name):
+        ''' Create a client to the store backend chosen in the Tweak settings
+        '''
+        window = self.tweak.settings['store_window']
+        if self.tweak.settings['store'] == 'shm':
+            return store.SharedMemoryStore(name, window=window)
+        return store.Limbo(name, window=window)
+
+    def createLink(self, name, start, end, maxsize=0, policy='block', traceLink=None):
+        ''' Create a Link using the backend chosen in the Tweak settings
+        '''
+        return Link(name, start, end, backend=self.tweak.settings['links'],
+                    slots=self.tweak.settings['link_slots'],
+                    slot_size=self.tweak.settings['link_slot_size'],
+                    maxsize=maxsize, policy=policy, traceLink=traceLink)
+
+    def createMultiLink(self, name, start, end, maxsize=0, policy=None, traceLink=None):
+        ''' Create a MultiLink using the backend chosen in the Tweak settings
+        '''
+        return MultiLink(name, start, end, backend=self.tweak.settings['links'],
+                         slots=self.tweak.settings['link_slots'],
+                         slot_size=self.tweak.settings['link_slot_size'],
+                         maxsize=maxsize, policy=policy, traceLink=traceLink)
 
     def createConnections(self):
         ''' Assemble links (multi or other)
@@ -177,46 +342,90 @@ class Nexus():
         '''
         for source,drain in self.tweak.connections.items():
             name = source.split('.')[0]
+            options = self.tweak.connectionOptions.get(source, {})
+            maxsize = options.get('maxsize', 0)
+            policy = options.get('policy', {})
             #current assumption is connection goes from q_out to something(s) else
             if len(drain) > 1: #we need multiasyncqueue
-                link, endLinks = MultiLink(name+'_multi', source, drain)
+                link, endLinks = self.createMultiLink(name+'_multi', source, drain, maxsize, policy, self.traceLink)
                 self.data_queues.update({source:link})
                 for i,e in enumerate(endLinks):
                     self.data_queues.update({drain[i]:e})
             else: #single input, single output
                 d = drain[0]
                 d_name = d.split('.') #TODO: check if .anything, if not assume q_in
-                link = Link(name+'_'+d_name[0], source, d)
+                link = self.createLink(name+'_'+d_name[0], source, d, maxsize, policy.get(d, 'block'), self.traceLink)
                 self.data_queues.update({source:link})
                 self.data_queues.update({d:link})
+            self.sequenceLinks(source, drain)
+        for source in self.unread:
+            # Nothing takes from it, so it only keeps the latest item
+            link = self.createLink(source.split('.')[0]+'_unread', source, None, 1, 'latest')
+            self.data_queues.update({source:link})
+
+    def sequenceLinks(self, source, drain):
+        ''' Number the items put on the connection for drains that are
+            replicated actors; if instead the source is replicated,
+            reorder its items for each drain (see improv.link)
+        '''
+        link = self.data_queues[source]
+        shared = isinstance(link, MultiAsyncQueue) and isinstance(link.queue, BroadcastRing)
+        replicas = lambda endpoint: getattr(self.tweak.actors.get(endpoint.split('.')[0]), 'replicas', 1)
+        for d in drain:
+            end = self.data_queues[d]
+            put = link if shared else end # the queue whose put does the numbering
+            if replicas(d) > 1:
+                put.numbering = put.numbering or Value('Q', 0)
+            elif replicas(source) > 1:
+                end.reorder = ReorderBuffer(window=4*replicas(source), wait=self.tweak.settings['reorder_wait'])
+                put.reorder = put.reorder or end.reorder
 
     def assignLink(self, name, link):
         ''' Function to set up Links between actors
             for data location passing
             Actor must already be instantiated
 
-            #NOTE: Could use this for reassigning links if actors crash?
+            #NOTE: Restarted actors keep their Links, see restartActor
             #TODO: Adjust to use default q_out and q_in vs being specified
         '''
         #logger.info('Assigning link {}'.format(name))
         classname = name.split('.')[0]
         linktype = name.split('.')[1]
-        if linktype == 'q_out':
-            self.actors[classname].setLinkOut(link)
-        elif linktype == 'q_in':
-            self.actors[classname].setLinkIn(link)
-        else:
-            self.actors[classname].addLink(linktype, link)
+        for instance in self.replicas.get(classname, [classname]):
+            if linktype == 'q_out':
+                self.actors[instance].setLinkOut(link)
+            elif linktype == 'q_in':
+                self.actors[instance].setLinkIn(link)
+            else:
+                self.actors[instance].addLink(linktype, link)
+
+    def getDrops(self):
+        ''' Number of items each data link endpoint has lost to its
+            overflow policy, keyed by endpoint
+        '''
+        drops = {}
+        for drain in self.tweak.connections.values():
+            for d in drain:
+                drops[d] = self.data_queues[d].dropped()
+        return drops
 
     def runActor(self, actor):
         '''Run the actor continually; used for separate processes
             #TODO: hook into monitoring here?
         '''
+        trace.record(self.spanRings.get(actor.name))
+        base = actor.name.split('#')[0] # replicas share the scheduling options
+        module = self.tweak.actors.get(base, self.tweak.gui if self.tweak.hasGUI else None)
+        if module is not None and module.scheduling:
+            try:
+                scheduling.apply(actor.name, **module.scheduling)
+            except OSError as e:
+                logger.error('Cannot apply scheduling options to {}: {}'.format(actor.name, e))
         actor.run()
 
     def startWatcher(self):
-        self.watcher = store.Watcher('watcher', store.Limbo('watcher'))
-        q_sig = Link('watcher_sig', self.name, 'watcher')
+        self.watcher = store.Watcher('watcher', self.createStore('watcher'))
+        q_sig = self.createLink('watcher_sig', self.name, 'watcher')
         self.watcher.setLinks(q_sig)
         self.sig_queues.update({q_sig.name:q_sig})
 
@@ -230,16 +439,20 @@ class Nexus():
 
         for p in self.processes:
             p.start()
+            self.markStartup(p.name, 'started')
 
     def setup(self):
         for q in self.sig_queues.values():
             try:
                 q.put_nowait(Spike.setup())
+                self.markStartup(q.end, 'setup')
             except Full:
                 logger.warning('Signal queue'+q.name+'is full')
 
     def run(self):
         if self.allowStart:
+            self.flags['run'] = True
+            self.tRun = time.time()
             for q in self.sig_queues.values():
                 try:
                     q.put_nowait(Spike.run())
@@ -259,7 +472,8 @@ class Nexus():
             except Full as f:
                 logger.warning('Signal queue '+q.name+' full, cannot tell it to quit: {}'.format(f))
 
-        self.processes.append(self.p_GUI)
+        if self.p_GUI is not None:
+            self.processes.append(self.p_GUI)
         #self.processes.append(self.p_watch)
         
         for p in self.processes:
@@ -269,6 +483,20 @@ class Nexus():
 
         logger.warning('Done with available frames')
         print('total time ', time.time()-self.t)
+        for d,n in self.getDrops().items():
+            if n:
+                logger.warning('Link to {} dropped {} items'.format(d, n))
+        if self.traceLink is not None:
+            self.collectTraces()
+            logger.info('Frame latencies:')
+            self.latency.log()
+        if self.spanRings:
+            self.writeTimeline()
+        if self.metricsLog is not None:
+            self.metricsLog.write(self.metrics.snapshot())
+            self.metricsLog.close()
+        self.logMetrics()
+        self.logSummary()
 
         self.destroyNexus()
 
@@ -285,9 +513,21 @@ class Nexus():
         tasks = []
         for q in polling:
             tasks.append(asyncio.ensure_future(q.get_async()))
+        if self.traceLink is not None:
+            asyncio.ensure_future(self.pollTraces())
+        if self.metricsLog is not None:
+            asyncio.ensure_future(self.pollMetrics())
+        if self.tweak.settings['monitor_interval'] is not None:
+            asyncio.ensure_future(self.pollHealth())
+        visual = self.tweak.gui.options.get('visual') if self.tweak.hasGUI else None
+        for name in self.actorProcesses.keys():
+            if name != visual: # its readiness comes from the GUI
+                self.watchProcess(name)
+        self.failed = asyncio.get_event_loop().create_future() # set by actorFailed
 
         while not self.flags['quit']:
-            done, pending = await asyncio.wait(tasks, return_when=concurrent.futures.FIRST_COMPLETED)
+            waiting = tasks+[self.failed] if self.finishing is None else tasks+[self.failed, self.finishing]
+            done, pending = await asyncio.wait(waiting, return_when=concurrent.futures.FIRST_COMPLETED)
             #TODO: actually kill pending tasks
 
             for i,t in enumerate(tasks):
@@ -299,10 +539,153 @@ class Nexus():
                         self.processActorSignal(r, pollingNames[i])
                     tasks[i] = (asyncio.ensure_future(polling[i].get_async()))
 
+            if self.failed in done and not self.flags['quit']:
+                logger.error('Quitting: {} stopped before it was ready'.format(self.failure[0]))
+                self.flags['quit'] = True
+                self.quit()
+                raise ActorFailedError(*self.failure)
+
+            if self.finishing in done and not self.flags['quit']:
+                logger.info('Headless run finished')
+                self.flags['quit'] = True
+                self.quit()
+
             #self.listing.append(self.limbo.notify())
 
         logger.warning('Shutting down polling')
 
+    async def pollTraces(self):
+        ''' Aggregate hop records from traced links as they arrive
+        '''
+        while not self.flags['quit']:
+            self.latency.record(await self.traceLink.get_async())
+
+    def writeTimeline(self):
+        ''' Merge the actors' spans into the Chrome trace file
+        '''
+        for name, ring in self.spanRings.items():
+            if ring.overwritten():
+                logger.warning('Timeline of {} lost its {} oldest spans'.format(name, ring.overwritten()))
+        trace.writeChromeTrace(self.tweak.settings['timeline'], self.spanRings)
+        logger.info('Wrote timeline to '+self.tweak.settings['timeline'])
+
+    async def pollMetrics(self):
+        ''' Append a snapshot of the metrics to the metrics file
+            every metrics_interval seconds
+        '''
+        while not self.flags['quit']:
+            await asyncio.sleep(self.tweak.settings['metrics_interval'])
+            if not self.flags['quit']:
+                self.metricsLog.write(self.metrics.snapshot())
+
+    async def pollHealth(self):
+        ''' Sample pipeline health every monitor_interval seconds,
+            log it and hand it to the stats endpoint
+        '''
+        while not self.flags['quit']:
+            await asyncio.sleep(self.tweak.settings['monitor_interval'])
+            if self.flags['quit']:
+                break
+            stats = self.sampleHealth()
+            self.logHealth(stats)
+            if self.monitor is not None:
+                self.monitor.update(stats)
+
+    def sampleHealth(self):
+        ''' Current backlog of each data link endpoint, store usage and,
+            per actor, the last frame number, frame rate since the previous
+            sample (from its <actor>.frame gauge) and seconds since its
+            RunManager last dispatched (from its <actor>.heartbeat gauge)
+        '''
+        now = time.monotonic()
+        links = self.backlog()
+        objects = self.limbo.get_all()
+        storeUsage = {'objects': len(objects),
+                      'bytes': sum(o.get('data_size', 0) for o in objects.values())}
+        actors = {name: {} for name in self.actors.keys()}
+        for row in self.metrics.snapshot():
+            name, _, metric = row['name'].rpartition('.')
+            if name not in actors or row['count'] == 0:
+                continue
+            if metric == 'frame':
+                actors[name]['frame'] = int(row['value'])
+                last = self._lastFrames.get(name)
+                if last is not None:
+                    actors[name]['fps'] = (row['count']-last[0])/(now-last[1])
+                self._lastFrames[name] = (row['count'], now)
+            elif metric == 'heartbeat':
+                actors[name]['idle'] = now-row['value']
+        return {'time': time.time(), 'links': links, 'store': storeUsage, 'actors': actors}
+
+    def backlog(self):
+        ''' Number of items queued at each data link endpoint,
+            None where the platform cannot tell
+        '''
+        links = {}
+        for drain in self.tweak.connections.values():
+            for d in drain:
+                try:
+                    links[d] = self.data_queues[d].qsize()
+                except NotImplementedError: # Queue.qsize on macOS
+                    links[d] = None
+        return links
+
+    def logHealth(self, stats):
+        backlog = ' '.join('{}={}'.format(d, n) for d,n in stats['links'].items())
+        progress = ' '.join('{}@{}'.format(name, a['frame']) + (' {:.1f}fps'.format(a['fps']) if 'fps' in a else '')
+                            for name,a in stats['actors'].items() if 'frame' in a)
+        logger.info('Health: backlog {} | store {} objects {:.1f} MB | {}'.format(
+                    backlog, stats['store']['objects'], stats['store']['bytes']/1e6, progress))
+        for name,a in stats['actors'].items():
+            queued = sum(n or 0 for d,n in stats['links'].items() if d.split('.')[0] == name.split('#')[0])
+            if queued and a.get('idle', 0) > 10*self.tweak.settings['monitor_interval']:
+                logger.warning('{} has {} items queued but has not run for {:.1f} s'.format(name, queued, a['idle']))
+
+    def logMetrics(self):
+        ''' Log every metric; heartbeats (time.monotonic() of an actor's
+            last dispatch) as how long ago they were
+        '''
+        now = time.monotonic()
+        for row in self.metrics.snapshot():
+            if row['kind'] == 'histogram' and row['count']:
+                logger.info('{name}: n={count} mean={mean:.6f}s p50={p50:.6f}s p90={p90:.6f}s p99={p99:.6f}s'.format(**row))
+            elif row['kind'] == 'counter':
+                logger.info('{name}: {count}'.format(**row))
+            elif row['kind'] == 'gauge' and row['name'].endswith('.heartbeat'):
+                if row['count']:
+                    logger.info('{}: {:.3f} s ago'.format(row['name'], now-row['value']))
+            elif row['kind'] == 'gauge':
+                logger.info('{name}: {value}'.format(**row))
+
+    def logSummary(self):
+        ''' Log how long the run took and how many frames each actor
+            handled (the updates of its <actor>.frame gauge)
+        '''
+        if self.tRun is None:
+            logger.info('Run summary: the actors were never run')
+            return
+        elapsed = time.time()-self.tRun
+        ready = [e['ready'] for e in self.startup.values() if 'ready' in e]
+        summary = 'Run summary: ran {:.2f} s'.format(elapsed)
+        if self.tDone is not None:
+            summary += ', acquirers done after {:.2f} s'.format(self.tDone-self.tRun)
+        if ready:
+            summary += ', actors ready {:.2f} s after Nexus started'.format(max(ready))
+        logger.info(summary)
+        for row in self.metrics.snapshot():
+            name, _, metric = row['name'].rpartition('.')
+            if metric == 'frame' and row['count']:
+                logger.info('  {}: {} frames, {:.1f} per s'.format(name, row['count'], row['count']/elapsed))
+
+    def collectTraces(self):
+        ''' Aggregate the hop records still queued
+        '''
+        while True:
+            try:
+                self.latency.record(self.traceLink.get_nowait())
+            except Empty:
+                break
+
     def processGuiSignal(self, flag, name):
         '''Receive flags from the Front End as user input
             TODO: Not all needed
@@ -336,30 +719,189 @@ class Nexus():
     def processActorSignal(self, sig, name):
         if sig is not None:
             logger.info('Received signal '+str(sig[0])+' from '+name)
-            if sig[0]==Spike.ready():
+            if sig[0]==Spike.checkpoint():
+                self.updateCheckpoint(name.split('_')[0], sig[1])
+            elif sig[0]==Spike.done():
+                self.acquirerDone(name.split('_')[0])
+            elif sig[0]==Spike.failed():
+                self.actorFailed(name.split('_')[0], sig[1])
+            elif sig[0]==Spike.ready() and name.split('_')[0] in self.restarting:
+                self.resumeActor(name.split('_')[0])
+            elif sig[0]==Spike.ready():
                 self.actorStates[name.split('_')[0]] = sig[0]
+                self.markStartup(name.split('_')[0], 'ready')
                 if all(val==Spike.ready() for val in self.actorStates.values()):
                     self.allowStart = True      #TODO: replace with q_sig to FE/Visual
                     logger.info('Allowing start')
+                    self.logStartup()
+                    if self.tweak.settings['headless']:
+                        logger.info('Begin run!')
+                        self.run()
+
+    def acquirers(self):
+        ''' Instances of the actors in the acquirers setting, the ones
+            that send a done signal once out of data
+        '''
+        names = self.tweak.settings['acquirers'] or []
+        return {i for n in names for i in self.replicas.get(n, [n])}
+
+    def acquirerDone(self, name):
+        ''' Once every acquirer is done, a headless run finishes (finishRun)
+        '''
+        logger.info('{} is done'.format(name))
+        self.finished.add(name)
+        if self.tDone is None and self.acquirers() and self.acquirers() <= self.finished:
+            self.tDone = time.time()
+            logger.info('All acquirers are done')
+            if self.tweak.settings['headless']:
+                self.finishing = asyncio.ensure_future(self.finishRun())
+
+    async def finishRun(self):
+        ''' Wait for the actors to take what is left on the data links,
+            at most drain_timeout seconds; pollQueues then quits.
+            The links must be found empty twice in a row, so that items
+            in flight from one actor to the next are not missed.
+            Links whose consumer is no longer running are not waited for.
+        '''
+        deadline = time.time()+self.tweak.settings['drain_timeout']
+        empty = 0
+        while empty < 2 and time.time() < deadline:
+            await asyncio.sleep(0.1)
+            empty = empty+1 if not self.undrained() else 0
+        if empty < 2:
+            logger.warning('Data links not empty after {} s: {}'.format(
+                           self.tweak.settings['drain_timeout'], self.undrained()))
+
+    def undrained(self):
+        ''' Items left on each data link endpoint with a running consumer
+        '''
+        return {d: n for d,n in self.backlog().items() if n and self.consuming(d)}
+
+    def consuming(self, endpoint):
+        ''' Whether any instance of the actor taking from endpoint is running
+        '''
+        base = endpoint.split('.')[0]
+        return any(self.actorProcesses[i].is_alive() for i in self.replicas.get(base, [base])
+                   if i in self.actorProcesses)
 
-                    #TODO: Maybe have flag for auto-start, else require explict command
-                    # if not self.tweak.hasGUI:
-                    #     self.run()
+    def watchProcess(self, name):
+        ''' Call processExited once the actor's process ends
+        '''
+        p = self.actorProcesses[name]
+        asyncio.get_event_loop().add_reader(p.sentinel, self.processExited, name, p)
+
+    def processExited(self, name, p):
+        ''' Stop the pipeline if the actor died before it was ready (actorFailed);
+            restart it if it died later while the pipeline was still up,
+            at most restart_limit times. An actor that exits with code 0
+            has finished, e.g. its run() returned, and is left alone.
+        '''
+        asyncio.get_event_loop().remove_reader(p.sentinel)
+        if self.flags['quit']:
+            return
+        p.join()
+        if p.exitcode == 0:
+            logger.info('Actor {} finished'.format(name))
+            return
+        logger.error('Actor {} died with exit code {}'.format(name, p.exitcode))
+        if self.actorStates.get(name) != Spike.ready() and name not in self.restarting:
+            # Died loading or setting up; let the error it sent on q_comm arrive first
+            asyncio.get_event_loop().call_later(1.0, self.actorFailed, name)
+            return
+        if self.restarts.get(name, 0) >= self.tweak.settings['restart_limit']:
+            logger.error('Not restarting {} (restart_limit is {})'.format(name, self.tweak.settings['restart_limit']))
+            return
+        self.restartActor(name)
+
+    def actorFailed(self, name, error=None):
+        ''' Stop the pipeline because the actor cannot run, e.g. its class
+            failed to import or instantiate in its process (DeferredActor)
+            or its process died during setup; pollQueues quits and raises
+            ActorFailedError
+        '''
+        if self.failure is not None:
+            return
+        if self.actorStates.get(name) == Spike.ready() or name in self.restarting:
+            return # it got ready after all, or is being restarted
+        if error is None:
+            error = 'exit code {}'.format(self.actorProcesses[name].exitcode)
+        logger.error('{} cannot run: {}'.format(name, error))
+        self.failure = (name, error)
+        self.failed.set_result(None)
+
+    def restartActor(self, name):
+        ''' Start a new process for the actor with the same Links,
+            a fresh store client and its last checkpoint, and set it up;
+            it is told to run once ready if the pipeline is running (resumeActor).
+            Another actor blocked on a shm Link whose lock the dead process
+            held cannot be recovered this way.
+        '''
+        self.restarts[name] = self.restarts.get(name, 0)+1
+        logger.warning('Restarting {} (restart {})'.format(name, self.restarts[name]))
+        actor = self.actors[name]
+        actor.setStore(self.createStore(name))
+        actor.checkpoint_id = self.checkpoints.get(name)
+
+        old = self.actorProcesses[name]
+        p = self.createProcess(name, actor)
+        self.processes[self.processes.index(old)] = p
+        self.actorProcesses[name] = p
+        p.start()
+        self.watchProcess(name)
+
+        self.restarting.add(name)
+        self.sig_queues[name+'_sig'].put_nowait(Spike.setup())
+
+    def resumeActor(self, name):
+        self.restarting.discard(name)
+        logger.info('Restarted {} is ready'.format(name))
+        if self.flags['run']:
+            self.sig_queues[name+'_sig'].put_nowait(Spike.run())
+
+    def updateCheckpoint(self, name, obj_id):
+        ''' Keep obj_id as the actor's checkpoint and delete the previous one
+        '''
+        old = self.checkpoints.get(name)
+        self.checkpoints[name] = obj_id
+        if old is not None:
+            try:
+                self.limbo.client.delete([old])
+            except Exception as e:
+                logger.warning('Cannot delete old checkpoint of {}: {}'.format(name, e))
 
     def destroyNexus(self):
         ''' Method that calls the internal method
             to kill the process running the store (plasma server)
+            or to unlink the shared memory segments
         '''
         logger.warning('Destroying Nexus')
         self._closeStore()
         logger.warning('Killed the central store')
+        self._closeLinks()
+        self.metrics.destroy()
+        if self.monitor is not None:
+            self.monitor.close()
+
+    def _closeLinks(self):
+        ''' Internal method to unlink shared memory backing the Links
+        '''
+        for q in [*self.comm_queues.values(), *self.sig_queues.values(), *self.data_queues.values()]:
+            q.destroy()
+        if self.traceLink is not None:
+            self.traceLink.destroy()
 
     def _closeStore(self):
         ''' Internal method to kill the subprocess
             running the store (plasma sever)
         '''
+        if self.p_Limbo is None:
+            self.limbo.client.destroy()
+            logger.info('Store segments unlinked')
+            return
         try:
             self.p_Limbo.kill()
+            client = store.SharedMemoryClient(self.limbo.store_loc)
+            client.destroy() # frame arenas live outside plasma
             logger.info('Store closed successfully')
         except Exception as e:
             logger.exception('Cannot close store {0}'.format(e))
@@ -371,6 +913,10 @@ class Nexus():
         '''
         if size is None:
             raise RuntimeError('Server size needs to be specified')
+        if self.tweak.settings['store'] == 'shm':
+            # Shared memory segments are created by the clients themselves
+            self.p_Limbo = None
+            return
         try:
             self.p_Limbo = subprocess.Popen(['plasma_store',
                               '-s', '/tmp/store',
@@ -398,25 +944,104 @@ class Nexus():
         logging.info('Shutdown complete.')
 
 
-def Link(name, start, end):
+class DeferredActor():
+    ''' Stands in for an actor until its process runs it: records what Nexus
+        hands the actor, then imports and instantiates its class in the
+        actor's own process, so that actors with heavy imports (caiman, cv2)
+        load in parallel instead of one after the other in Nexus.
+        The time taken is kept in the actor's <name>.load_time gauge.
+    '''
+    setters = ('setStore', 'setMetrics', 'setCommLinks', 'setLinkIn', 'setLinkOut', 'addLink')
+
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module # TweakModule
+        self.calls = []
+        self.checkpoint_id = None
+
+    def __getattr__(self, name):
+        if name in DeferredActor.setters:
+            return lambda *args: self.calls.append((name, args))
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                                (self.__class__.__name__, name))
+
+    def instance(self):
+        t = time.time()
+        mod = import_module(self.module.packagename)
+        clss = getattr(mod, self.module.classname)
+        instance = clss(self.name, **self.module.options)
+        for name, args in self.calls:
+            getattr(instance, name)(*args)
+        instance.checkpoint_id = self.checkpoint_id
+        instance.metrics.gauge(self.name+'.load_time').set(time.time()-t)
+        return instance
+
+    def run(self):
+        try:
+            actor = self.instance()
+        except Exception as e:
+            # Tell Nexus why, or it would wait for a ready signal that never comes
+            logger.exception('Cannot load {}'.format(self.name))
+            q_comm = next(args[0] for name, args in self.calls if name == 'setCommLinks')
+            q_comm.put([Spike.failed(), '{}: {}'.format(type(e).__name__, e)])
+            raise
+        actor.run()
+
+
+class ActorFailedError(Exception):
+    def __init__(self, actor, error):
+
+        super().__init__()
+        self.name = 'ActorFailedError'
+        self.actor = actor
+
+        self.message = 'Actor {} stopped before it was ready: {}'.format(actor, error)
+
+    def __str__(self):
+        return self.message
+
+
+def Link(name, start, end, backend='manager', slots=256, slot_size=4096, maxsize=0, policy='block', traceLink=None):
     ''' Abstract constructor for a queue that Nexus uses for
     inter-process/actor signaling and information passing
 
     A Link has an internal queue that can be synchronous (put, get)
     as inherited from multiprocessing.Manager.Queue
     or asynchronous (put_async, get_async) using async executors
+
+    backend: 'manager' (Manager().Queue, one server process per Link)
+        or 'shm' (RingQueue of slots, each holding up to slot_size pickled bytes)
+    maxsize: capacity; 0 means unbounded for 'manager' and slots for 'shm'
+    policy: what put does when the Link is full, see tweak.POLICIES
+    traceLink: if given, items carry their trace context and hop
+        records are sent there when they are taken (see improv.trace)
     '''
 
-    m = Manager()
-    q = AsyncQueue(m.Queue(maxsize=0), name, start, end)
+    maxsize = _capacity(maxsize, policy)
+    if backend == 'shm':
+        q = AsyncQueue(RingQueue(maxsize or slots, slot_size), name, start, end, policy, traceLink)
+    else:
+        m = Manager()
+        q = AsyncQueue(m.Queue(maxsize=maxsize), name, start, end, policy, traceLink)
     return q
 
+def _capacity(maxsize, policy):
+    return 1 if policy == 'latest' else maxsize
+
 class AsyncQueue(object):
-    def __init__(self,q, name, start, end):
+    def __init__(self,q, name, start, end, policy='block', traceLink=None):
         self.queue = q
-        self.real_executor = None
         self.cancelled_join = False
 
+        # Overflow policy and number of items it discarded
+        self.policy = policy
+        self.drops = Value('L', 0)
+        self.traceLink = traceLink
+
+        # Ordering for replicated actors, see improv.link and Nexus.sequenceLinks
+        self.numbering = None # shared counter numbering puts, if this feeds replicas
+        self.reorder = None # ReorderBuffer of the consumer, if this comes out of replicas
+
         # Notate what this queue is and from where to where
         # is it passing information
         self.name = name
@@ -433,18 +1058,11 @@ class AsyncQueue(object):
 
     @property
     def _executor(self):
-        if not self.real_executor:
-            self.real_executor = ThreadPoolExecutor(max_workers=cpu_count())
-        return self.real_executor
-
-    def __getstate__(self):
-        self_dict = self.__dict__
-        self_dict['_real_executor'] = None
-        return self_dict
+        return sharedExecutor()
 
     def __getattr__(self, name):
-        if name in ['qsize', 'empty', 'full', 'put', 'put_nowait',
-                    'get', 'get_nowait', 'close']:
+        if name in ['qsize', 'full',
+                    'close', 'fileno', 'drain']:
             return getattr(self.queue, name)
         else:
             raise AttributeError("'%s' object has no attribute '%s'" %
@@ -454,6 +1072,85 @@ class AsyncQueue(object):
         #return str(self.__class__) + ": " + str(self.__dict__)
         return 'Link '+self.name #+' From: '+self.start+' To: '+self.end
 
+    def get(self, block=True, timeout=None):
+        with trace.span(self.name, 'link.get'):
+            if self.reorder is not None:
+                item = self.reorder.get(self.queue.get, block, timeout)
+            else:
+                item = self.queue.get(block, timeout)
+        item = _link.unnumber(item)
+        if self.traceLink is not None:
+            return self._received(item)
+        return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self):
+        if self.reorder is not None and self.reorder.timeout() == 0:
+            return False # a held item can be handed out
+        return self.queue.empty()
+
+    def _received(self, item):
+        item, record = trace.unwrap(item, self)
+        if record is not None:
+            try:
+                self.traceLink.put_nowait(record)
+            except Full:
+                pass # Nexus is behind; losing a record is better than stalling the pipeline
+        return item
+
+    def put(self, item, block=True, timeout=None):
+        if self.traceLink is not None:
+            item = trace.wrap(item)
+        item = self._number(item)
+        if self.policy == 'block':
+            with trace.span(self.name, 'link.put'):
+                return self.queue.put(item, block, timeout)
+        if self.policy == 'drop-newest':
+            try:
+                self.queue.put_nowait(item)
+            except Full:
+                self._dropped()
+            return
+        # drop-oldest and latest: make room by discarding from the front
+        while True:
+            try:
+                return self.queue.put_nowait(item)
+            except Full:
+                try:
+                    self.queue.get_nowait()
+                    self._dropped()
+                except Empty:
+                    pass
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def _number(self, item):
+        ''' Number items fed to replicas, and tag their results with the
+            number of the input they came from
+        '''
+        if self.numbering is not None:
+            with self.numbering.get_lock():
+                seq = self.numbering.value
+                self.numbering.value += 1
+            return _link.Numbered(seq, item)
+        if self.reorder is not None and _link.current() is not None:
+            return _link.Numbered(_link.current(), item)
+        return item
+
+    def _dropped(self):
+        with self.drops.get_lock():
+            self.drops.value += 1
+
+    def dropped(self):
+        ''' Number of items lost to the overflow policy
+        '''
+        if hasattr(self.queue, 'dropped'): # consumer of a BroadcastRing counts its own
+            return self.queue.dropped()
+        return self.drops.value
+
     async def put_async(self, item):
         loop = asyncio.get_event_loop()
         res = await loop.run_in_executor(self._executor, self.put, item)
@@ -463,7 +1160,12 @@ class AsyncQueue(object):
         loop = asyncio.get_event_loop()
         self.status = 'pending'
         try:
-            self.result = await loop.run_in_executor(self._executor, self.get)
+            if hasattr(self.queue, 'get_async') and self.reorder is None:
+                self.result = _link.unnumber(await self.queue.get_async())
+                if self.traceLink is not None:
+                    self.result = self._received(self.result)
+            else:
+                self.result = await loop.run_in_executor(self._executor, self.get)
             self.status = 'done'
             return self.result
         except Exception as e:
@@ -476,23 +1178,44 @@ class AsyncQueue(object):
 
     def join_thread(self):
         self._queue.join_thread()
-        if self._real_executor and not self._cancelled_join:
-            self._real_executor.shutdown()
+
+    def destroy(self):
+        if hasattr(self.queue, 'destroy'): # shared memory backends
+            self.queue.destroy()
 
 
-def MultiLink(name, start, end):
+def MultiLink(name, start, end, backend='manager', slots=256, slot_size=4096, maxsize=0, policy=None, traceLink=None):
     ''' End is a list
 
         Return a MultiAsyncQueue as q (for producer) and list of AsyncQueues as q_out (for consumers)
+        backend, slots, slot_size, maxsize, traceLink: see Link
+        policy: dict of endpoint to overflow policy, 'block' if missing
+        With the 'shm' backend all consumers read from one BroadcastRing;
+        drop-oldest and latest consumers skip ahead to their maxsize (or 1)
+        newest items when they fall behind instead of holding back the
+        producer. drop-newest is not supported there: on a shared ring a
+        consumer that stops reading would lose its oldest items instead.
     '''
+    policy = {e: (policy or {}).get(e, 'block') for e in end}
+    if backend == 'shm':
+        for e in end:
+            if policy[e] == 'drop-newest':
+                raise InvalidPolicyError(name, policy[e], 'is not supported for several targets with links: shm')
+        skip = [i for i,e in enumerate(end) if policy[e] != 'block']
+        capacity = [_capacity(maxsize, policy[e]) or slots for e in end]
+        q_in = BroadcastRing(len(end), maxsize or slots, slot_size, skip=skip, capacity=capacity)
+        q_out = [AsyncQueue(q_in.reader(i), name, start, e, policy[e], traceLink) for i,e in enumerate(end)]
+        return MultiAsyncQueue(q_in, q_out, name, start, end, traceLink), q_out
+
     m = Manager()
+    q_in = m.Queue(maxsize=0)
 
     q_out = []
     for endpoint in end:
-        q = AsyncQueue(m.Queue(maxsize=0), name, start, endpoint)
+        q = AsyncQueue(m.Queue(maxsize=_capacity(maxsize, policy[endpoint])), name, start, endpoint, policy[endpoint], traceLink)
         q_out.append(q)
 
-    q = MultiAsyncQueue(m.Queue(maxsize=0), q_out, name, start, end)
+    q = MultiAsyncQueue(q_in, q_out, name, start, end)
 
     return q, q_out
 
@@ -503,12 +1226,16 @@ class MultiAsyncQueue(AsyncQueue):
 
         #TODO: test the async nature of this group of queues
     '''
-    def __init__(self, q_in, q_out, name, start, end):
+    def __init__(self, q_in, q_out, name, start, end, traceLink=None):
         self.queue = q_in
         self.output = q_out
 
-        self.real_executor = None
         self.cancelled_join = False
+        self.policy = 'block'
+        self.drops = Value('L', 0)
+        self.traceLink = traceLink
+        self.numbering = None
+        self.reorder = None
 
         self.name = name
         self.start = start
@@ -530,11 +1257,19 @@ class MultiAsyncQueue(AsyncQueue):
             raise AttributeError("'%s' object has no attribute '%s'" %
                                     (self.__class__.__name__, name))
 
-    def put(self, item):
+    def put(self, item, block=True, timeout=None):
+        if isinstance(self.queue, BroadcastRing):
+            if self.traceLink is not None:
+                item = trace.wrap(item)
+            item = self._number(item)
+            with trace.span(self.name, 'link.put'):
+                return self.queue.put(item, block, timeout) # one copy shared by all consumers
         for q in self.output:
-            q.put(item)
+            q.put(item, block, timeout)
 
     def put_nowait(self, item):
+        if isinstance(self.queue, BroadcastRing):
+            return self.put(item, block=False)
         for q in self.output:
             q.put_nowait(item)
 
@@ -543,14 +1278,25 @@ class MultiAsyncQueue(AsyncQueue):
 if __name__ == '__main__':
     # set_start_method('fork')
 
-    if len(sys.argv)>1:
-        print('File is ', sys.argv[1])
-        #TODO: Standard error handling for files
-        # Also, run the DAG checker on the file before loading
-        #   it into Nexus
-        loadFile = sys.argv[1]
-    else: loadFile = 'basic_demo.yaml'
+    parser = argparse.ArgumentParser(description='Run the pipeline in a config file')
+    parser.add_argument('config', nargs='?', default='basic_demo.yaml')
+    parser.add_argument('--headless', action='store_true',
+                        help='no GUI: set up, run until the acquirers are done, then quit')
+    parser.add_argument('--set', action='append', default=[], metavar='SETTING=VALUE',
+                        help='override a setting of the config, e.g. --set store=shm')
+    args = parser.parse_args()
+    #TODO: Standard error handling for files
+    # Also, run the DAG checker on the file before loading
+    #   it into Nexus
+    print('File is ', args.config)
+
+    settings = {}
+    for option in args.set:
+        key, _, value = option.partition('=')
+        settings[key] = yaml.safe_load(value) # so numbers, booleans and lists keep their type
+    if args.headless:
+        settings['headless'] = True
 
     nexus = Nexus('Nexus')
-    nexus.createNexus(file=loadFile)
+    nexus.createNexus(file=args.config, settings=settings)
     nexus.startNexus()
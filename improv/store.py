@@ -1,22 +1,57 @@
+import asyncio
 import datetime
 import os
 import pickle
+import re
+import secrets
+import struct
 import time
 import numpy as np
-import pyarrow as arrow
-import pyarrow.plasma as plasma
-from pyarrow import PlasmaObjectExists
-from pyarrow.lib import ArrowIOError
-from pyarrow.plasma import ObjectNotAvailable
-from scipy.sparse import csc_matrix
-from improv.actor import Spike
-from queue import Empty
+from inspect import signature
+from multiprocessing import shared_memory, resource_tracker, util
+from collections import deque
+from scipy.sparse import csc_matrix, csr_matrix, issparse
+from improv import actor # module, not names: improv.actor imports the store through improv.metrics
+from improv import metrics as _metrics # module, not names: improv.metrics imports this
+from improv import trace
+from queue import Empty, Full, Queue
+from threading import Thread
 
 import logging; logger=logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# pyarrow.plasma takes a large share of import time, so it is only imported
+# (by _importPlasma) when a Limbo connects to a plasma store. Until then, and
+# for good if pyarrow has no plasma (it was removed from recent releases),
+# these stand-ins are used
+plasma = None
+ArrowIOError = OSError
+
+class PlasmaObjectExists(Exception):
+    pass
+
+class ObjectNotAvailable():
+    pass
+
+def _importPlasma():
+    ''' Import pyarrow.plasma and its exceptions into this module, once
+        Raises ImportError if pyarrow has no plasma
+    '''
+    global plasma, PlasmaObjectExists, ArrowIOError, ObjectNotAvailable
+    if plasma is None:
+        import pyarrow.plasma
+        from pyarrow import PlasmaObjectExists
+        from pyarrow.lib import ArrowIOError
+        from pyarrow.plasma import ObjectNotAvailable
+        plasma = pyarrow.plasma
+
 #TODO: Use Apache Arrow for better memory usage with the Plasma store
 
+# Key marking store payloads that Limbo encoded itself (sparse matrices, pickles)
+# so that plain dicts and raw bytes are returned untouched
+TYPE_TAG = '__improv_type__'
+SPARSE_FORMATS = ('csc', 'csr')
+
 class StoreInterface():
     '''General interface for a store
     '''
@@ -46,29 +81,38 @@ class Limbo(StoreInterface):
 
     def __init__(self, name='default', store_loc='/tmp/store',
                  hdd_loc='output/', use_hdd=False, hdd_maxstore=1e12,
-                 flush_immediately=False, commit_freq=20):
+                 flush_immediately=False, commit_freq=20, window=None):
         # TODO TODO TODO: Refactor to use local hdd settings instead of put and get
         ''' Constructor for Limbo
             store_loc: Apache Arrow Plasma client location, default is /tmp/store
+                For SharedMemoryStore this only namespaces the segments
             hdd_loc: Path to LMDB folder if used
             use_hdd: flag to also write data to disk using the LMDB
             hdd_maxstore: Maximum size database may grow to; used to size the memory mapping. see LMDBStore
                 TODO: NO errors raised without being handled or suggested resolution
             flush_immediately: Save objects to disk immediately
             commit_freq: If not flush_immediately, flush data to disk every N puts
+            window: Keep only the last N frames of each per-frame object
+              (names ending in a frame number, e.g. acq_raw12); older ones
+              are deleted from the store on put. None keeps everything.
         '''
 
         self.name = name
         self.store_loc = store_loc
         self.client = self.connectStore(store_loc)
         self.stored = {}
+        self.arenas = {}
+
+        # Eviction of per-frame objects
+        self.window = window
+        self.history = {}
 
         # Offline db
         self.use_hdd = use_hdd
         self.flush_immediately = flush_immediately
 
         if use_hdd:
-            self.lmdb_store = LMDBStore(max_size=hdd_maxstore, path=hdd_path, flush_immediately=flush_immediately,
+            self.lmdb_store = LMDBStore(max_size=hdd_maxstore, path=hdd_loc, flush_immediately=flush_immediately,
                                         commit_freq=commit_freq, from_limbo=True)
 
     def connectStore(self, store_loc):
@@ -78,6 +122,7 @@ class Limbo(StoreInterface):
             Updates the client internal
         '''
         try:
+            _importPlasma()
             #self.client = plasma.connect(store_loc)
             self.client: plasma.PlasmaClient = plasma.connect(store_loc, '', 0)
             logger.info('Successfully connected to store')
@@ -86,17 +131,14 @@ class Limbo(StoreInterface):
             raise CannotConnectToStoreError(store_loc)
         return self.client
 
+    @trace.traced('store')
     def put(self, object, object_name, save=False):
         ''' Put a single object referenced by its string name
             into the store
         '''
         object_id = None
         try:
-            # Need to pickle if object is csc_matrix
-            if isinstance(object, csc_matrix):
-                object_id = self.client.put(pickle.dumps(object, protocol=pickle.HIGHEST_PROTOCOL))
-            else:
-                object_id = self.client.put(object)
+            object_id = self.client.put(self._encode(object))
             self.updateStored(object_name, object_id)
             if self.use_hdd:
                 self.lmdb_store.put(object, object_name, obj_id=object_id, save=save)
@@ -110,6 +152,59 @@ class Limbo(StoreInterface):
             logger.error('Could not store object '+object_name+': {} {}'.format(type(e).__name__, e))
         return object_id
 
+    @trace.traced('store')
+    def putMany(self, objects, save=False):
+        ''' Put several objects, given as a dict {object_name: object},
+            in one pass with a single round of error handling and
+            bookkeeping. Returns the object IDs in the same order;
+            if storing fails, the IDs of objects not stored are None.
+        '''
+        object_ids = []
+        try:
+            for object in objects.values():
+                object_ids.append(self.client.put(self._encode(object)))
+        except PlasmaObjectExists:
+            logger.error('Object already exists. Meant to call replace?')
+        except ArrowIOError as e:
+            logger.error('Could not store objects {}: {} {}'.format(list(objects.keys()), type(e).__name__, e))
+            logger.info('Refreshing connection and continuing')
+            self.reset()
+        except Exception as e:
+            logger.error('Could not store objects {}: {} {}'.format(list(objects.keys()), type(e).__name__, e))
+
+        for object_name, object_id in zip(objects.keys(), object_ids):
+            self.updateStored(object_name, object_id)
+        if self.use_hdd:
+            for (object_name, object), object_id in zip(objects.items(), object_ids):
+                self.lmdb_store.put(object, object_name, obj_id=object_id, save=save)
+
+        return object_ids + [None]*(len(objects)-len(object_ids))
+
+    def _encode(self, object):
+        ''' Convert object into something the store client can put
+            csc/csr matrices are stored as their component arrays and other
+            sparse formats are pickled, each tagged with TYPE_TAG
+        '''
+        if issparse(object):
+            if object.format in SPARSE_FORMATS:
+                return {TYPE_TAG: object.format, 'data': object.data, 'indices': object.indices,
+                        'indptr': object.indptr, 'shape': object.shape}
+            return {TYPE_TAG: 'pickle', 'data': pickle.dumps(object, protocol=pickle.HIGHEST_PROTOCOL)}
+        return object
+
+    def _decode(self, res):
+        ''' Rebuild objects tagged by _encode
+            Sparse matrices are views on the stored component arrays
+        '''
+        if isinstance(res, dict) and TYPE_TAG in res:
+            if res[TYPE_TAG] in SPARSE_FORMATS:
+                matrix = csc_matrix if res[TYPE_TAG] == 'csc' else csr_matrix
+                return matrix((res['data'], res['indices'], res['indptr']), shape=res['shape'], copy=False)
+            elif res[TYPE_TAG] == 'pickle':
+                return pickle.loads(res['data'])
+        return res
+
+    @trace.traced('store')
     def get(self, object_name):
         ''' Get a single object from the store
             Checks to see if it knows the object first
@@ -125,20 +220,20 @@ class Limbo(StoreInterface):
         else:
             return self._get(object_name)
 
+    @trace.traced('store')
     def getID(self, obj_id, hdd_only=False):
         ''' Preferred mechanism for getting. TODO: Rename
         '''
+        if isinstance(obj_id, ArenaSlot):
+            return self._getSlot(obj_id)
+
         # Check in RAM
         if not hdd_only:
             res = self.client.get(obj_id,0)
             if isinstance(res, type):
                 logger.warning('Object {} cannot be found.'.format(obj_id))
                 raise ObjectNotFoundError(obj_id_or_name = obj_id)
-            # Deal with pickled objects.
-            elif isinstance(res, bytes): #TODO don't use generic bytes
-                return pickle.loads(res)
-            else:
-                return res
+            return self._decode(res)
 
         # Check in disk TODO: rework logic for faster gets
         if self.use_hdd:
@@ -146,23 +241,94 @@ class Limbo(StoreInterface):
             if res is not None:
                 return res
 
+    async def getID_async(self, obj_id, hdd_only=False):
+        ''' getID without blocking the event loop of an async actor
+        '''
+        return await self._inExecutor(self.getID, obj_id, hdd_only)
+
+    async def getList_async(self, ids):
+        return await self._inExecutor(self.getList, ids)
+
+    async def put_async(self, object, object_name, save=False):
+        return await self._inExecutor(self.put, object, object_name, save)
+
+    def _inExecutor(self, method, *args):
+        from improv.link import sharedExecutor # improv.link imports this module
+        return asyncio.get_event_loop().run_in_executor(sharedExecutor(), method, *args)
+
+    @trace.traced('store')
     def getList(self, ids):
         ''' Get multiple objects from the store
         '''
-        return self.client.get(ids)
+        return [self._decode(res) for res in self.client.get(ids)]
 
     def get_all(self):
         ''' Get a listing of all objects in the store
         '''
         return self.client.list()
 
+    def createArena(self, arena_name, shape, dtype, slots=8, subscribers=()):
+        ''' Create a FrameArena of preallocated frames owned by this client
+            subscribers: names of the actors that must releaseID a frame
+              before its slot can be reused
+        '''
+        arena = FrameArena(_segmentPrefix(self.store_loc)+'arena_'+arena_name,
+                           shape, dtype, slots=slots, subscribers=subscribers, create=True)
+        self.arenas.update({arena.name:arena})
+        return arena
+
+    @trace.traced('store')
+    def putFrame(self, arena, frame):
+        ''' Copy frame into the next free slot of arena
+            Returns the ArenaSlot reference, or None if every slot
+            is still held by a subscriber
+        '''
+        slot = arena.acquire()
+        if slot is None:
+            return None
+        arena.frame(slot)[...] = frame
+        return arena.commit(slot)
+
+    def releaseID(self, obj_id):
+        ''' Tell the store this client is done with obj_id
+            Frees arena slots once every subscriber released them;
+            no-op for regular store objects
+        '''
+        if isinstance(obj_id, ArenaSlot):
+            self._attachArena(obj_id.arena).release(obj_id, self.name)
+
+    def _getSlot(self, ref):
+        ''' Read-only view of an arena frame
+            Raises ObjectNotFoundError if the slot has since been reused
+        '''
+        arena = self._attachArena(ref.arena)
+        if arena.generation(ref.slot) != ref.generation:
+            logger.warning('Frame {} was overwritten before it was read'.format(ref))
+            raise ObjectNotFoundError(obj_id_or_name = ref)
+        return arena.view(ref.slot)
+
+    def _attachArena(self, arena_name):
+        arena = self.arenas.get(arena_name)
+        if arena is None:
+            arena = FrameArena(arena_name)
+            self.arenas.update({arena_name:arena})
+        return arena
+
     def reset(self):
         ''' Reset client connection
         '''
         self.client = self.connectStore(self.store_loc)
         logger.debug('Reset local connection to store')
 
+    def setMetrics(self, registry):
+        ''' Report the LMDB writer's counters in registry (see LMDBStore.setMetrics)
+        '''
+        if self.use_hdd:
+            self.lmdb_store.setMetrics(registry, self.name)
+
     def release(self):
+        if self.use_hdd:
+            self.lmdb_store.flush()
         self.client.disconnect()
 
     def subscribe(self):
@@ -197,9 +363,30 @@ class Limbo(StoreInterface):
         ''' Update local dict with info we need locally
             Report to Nexus that we updated the store
                 (did a put or delete/replace)
+            Evicts the oldest frame of this object type if
+              it falls outside the window
         '''
         self.stored.update({object_name:object_id})
 
+        if self.window is not None:
+            prefix, frame = splitName(object_name)
+            if frame is not None:
+                history = self.history.setdefault(prefix, deque())
+                history.append((object_name, object_id))
+                if len(history) > self.window:
+                    self.evict(*history.popleft())
+
+    def evict(self, object_name, object_id):
+        ''' Delete an object we stored and forget its name
+            Readers still holding it keep their reference until they drop it
+        '''
+        if self.stored.get(object_name) == object_id:
+            self.stored.pop(object_name)
+        try:
+            self.client.delete([object_id])
+        except Exception as e:
+            logger.error('Could not evict object {}: {}'.format(object_name, e))
+
     def getStored(self):
         ''' returns its info about what it has stored
         '''
@@ -271,10 +458,389 @@ class Limbo(StoreInterface):
         raise NotImplementedError
 
 
+class SharedMemoryStore(Limbo):
+    ''' Limbo backed by multiprocessing.shared_memory instead of plasma
+        No store server is needed: each object lives in its own
+        shared memory segment that any process can attach by name.
+        NumPy arrays are laid out raw, so getID returns a read-only
+        view into shared memory without copying or deserializing.
+    '''
+
+    def connectStore(self, store_loc):
+        ''' Create the client for the segments namespaced by store_loc
+            Raises exception if shared memory is not usable
+        '''
+        try:
+            self.client = SharedMemoryClient(store_loc)
+            logger.info('Successfully connected to store')
+        except Exception as e:
+            logger.exception('Cannot connect to store: {0}'.format(e))
+            raise CannotConnectToStoreError(store_loc)
+        return self.client
+
+    def random_ObjectID(self, number=1):
+        return [self.client.newID() for i in range(number)]
+
+
+class SharedMemoryClient():
+    ''' Plasma-like client over multiprocessing.shared_memory
+        Implements the subset of the PlasmaClient API that Limbo uses.
+        Segment layout: 8-byte header length, pickled header
+          (kind, [(dtype, shape, order, offset) per array], meta),
+          then the 64-byte aligned arrays or pickle payload.
+        Segments are named {prefix}{random hex}; the prefix comes from
+        store_loc so Nexus can list and unlink everything it owns.
+    '''
+    ALIGN = 64
+
+    def __init__(self, store_loc):
+        self.prefix = _segmentPrefix(store_loc)
+        self.segments = {} # attached segments, kept open while views may exist
+        self.unlinked = [] # deleted segments still viewed by arrays, closed once they are not
+        self.max_attached = 128
+
+    def newID(self):
+        return self.prefix + secrets.token_hex(8)
+
+    def put(self, obj, object_id=None):
+        ''' Write obj into a new segment and return its ID
+        '''
+        if object_id is None:
+            object_id = self.newID()
+        if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+            kind, arrays, meta = 'ndarray', [obj], None
+        elif isinstance(obj, dict) and obj.get(TYPE_TAG) in SPARSE_FORMATS:
+            # Sparse matrix components laid out as raw arrays, see Limbo._encode
+            kind, arrays = 'sparse', [obj['data'], obj['indices'], obj['indptr']]
+            meta = {TYPE_TAG: obj[TYPE_TAG], 'shape': obj['shape']}
+        else:
+            kind, arrays = 'pickle', []
+            meta = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+        specs = []
+        size = len(meta) if kind == 'pickle' else 0
+        for arr in arrays:
+            order = 'F' if arr.flags.f_contiguous and not arr.flags.c_contiguous else 'C'
+            specs.append((arr.dtype.str, arr.shape, order, size))
+            size = self._align(size + arr.nbytes)
+        header = (kind, specs, None if kind == 'pickle' else meta)
+        head = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+        offset = self._align(8+len(head))
+
+        shm = _openSegment(object_id, create=True, size=max(offset+size, 1))
+        try:
+            shm.buf[:8] = struct.pack('<Q', len(head))
+            shm.buf[8:8+len(head)] = head
+            if kind == 'pickle':
+                shm.buf[offset:offset+len(meta)] = meta
+            for arr, (dtype, shape, order, start) in zip(arrays, specs):
+                dest = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset+start, order=order)
+                dest[...] = arr
+                del dest
+        finally:
+            shm.close()
+        return object_id
+
+    def get(self, object_ids, timeout_ms=None):
+        ''' Get one object, or a list of objects if given a list of IDs
+            Missing objects are returned as ObjectNotAvailable, like plasma
+        '''
+        if isinstance(object_ids, list):
+            return [self._get(object_id) for object_id in object_ids]
+        return self._get(object_ids)
+
+    def _get(self, object_id):
+        shm = self.segments.get(object_id)
+        if shm is None:
+            try:
+                shm = _openSegment(object_id)
+            except (FileNotFoundError, ValueError, TypeError):
+                return ObjectNotAvailable
+        head_len = struct.unpack('<Q', shm.buf[:8])[0]
+        kind, specs, meta = pickle.loads(shm.buf[8:8+head_len])
+        offset = self._align(8+head_len)
+
+        if kind == 'pickle':
+            with shm.buf[offset:] as payload:
+                res = pickle.loads(payload)
+            if object_id not in self.segments:
+                shm.close()
+            return res
+
+        arrays = []
+        for dtype, shape, order, start in specs:
+            # frombuffer keeps the buffer exported while the array lives, so closing
+            # shm raises BufferError instead of unmapping under it (np.ndarray does not)
+            count = int(np.prod(shape))
+            arr = np.frombuffer(shm.buf, dtype, count, offset+start).reshape(shape, order=order)
+            arr.flags.writeable = False
+            arrays.append(arr)
+        self.segments[object_id] = shm
+        if len(self.segments) > 2*self.max_attached:
+            self._detach()
+
+        if kind == 'sparse':
+            res = dict(meta)
+            res.update(zip(('data', 'indices', 'indptr'), arrays))
+            return res
+        return arrays[0]
+
+    def _detach(self):
+        ''' Close the oldest attached segments no longer viewed by any array,
+            down to max_attached. Mappings of evicted objects are freed here.
+        '''
+        for object_id in list(self.segments.keys()):
+            if len(self.segments) <= self.max_attached:
+                break
+            try:
+                self.segments[object_id].close()
+                del self.segments[object_id]
+            except BufferError:
+                pass # still in use
+        self._closeUnlinked()
+
+    def _closeUnlinked(self):
+        ''' Close the deleted segments whose views have since been dropped
+        '''
+        for shm in list(self.unlinked):
+            try:
+                shm.close()
+                self.unlinked.remove(shm)
+            except BufferError:
+                pass
+
+    def contains(self, object_id):
+        return object_id in self.segments or object_id in self.list()
+
+    def list(self):
+        ''' Listing of all segments under this prefix
+            Only Linux exposes shared memory in the filesystem;
+            elsewhere only locally attached segments are known.
+        '''
+        if os.path.isdir('/dev/shm'):
+            return {f: {'data_size': os.path.getsize('/dev/shm/'+f)}
+                        for f in os.listdir('/dev/shm') if f.startswith(self.prefix)}
+        return {object_id: {'data_size': shm.size} for object_id, shm in self.segments.items()}
+
+    def delete(self, object_ids):
+        ''' Unlink segments. Processes holding views keep their
+            mapping until they drop it; this client closes its own
+            then (_closeUnlinked).
+        '''
+        for object_id in object_ids:
+            shm = self.segments.pop(object_id, None)
+            if shm is None:
+                try:
+                    shm = _openSegment(object_id)
+                except FileNotFoundError:
+                    continue
+            try:
+                _unlinkSegment(shm)
+            except FileNotFoundError:
+                pass # already unlinked by another client
+            try:
+                shm.close()
+            except BufferError:
+                self.unlinked.append(shm) # views still exported
+        self._closeUnlinked()
+
+    def destroy(self):
+        ''' Unlink every segment under this prefix
+        '''
+        self.delete(list(self.list().keys()))
+
+    def disconnect(self):
+        for object_id in list(self.segments.keys()):
+            try:
+                self.segments.pop(object_id).close()
+            except BufferError:
+                pass
+        self._closeUnlinked()
+
+    def subscribe(self):
+        pass # No notification channel without a server
+
+    def get_next_notification(self):
+        raise OSError('Notifications are not supported by the shared memory store')
+
+    def _align(self, n):
+        return -(-n // self.ALIGN) * self.ALIGN
+
+
+class ArenaSlot():
+    ''' Reference to one frame in a FrameArena, passed through
+        Links in place of a store object ID
+    '''
+    __slots__ = ('arena', 'slot', 'generation')
+
+    def __init__(self, arena, slot, generation):
+        self.arena = arena
+        self.slot = slot
+        self.generation = generation
+
+    def __getstate__(self):
+        return (self.arena, self.slot, self.generation)
+
+    def __setstate__(self, state):
+        self.arena, self.slot, self.generation = state
+
+    def __repr__(self):
+        return 'ArenaSlot {}[{}] gen {}'.format(self.arena, self.slot, self.generation)
+
+
+class FrameArena():
+    ''' Ring of preallocated frames of fixed shape and dtype in a single
+        shared memory segment. The producer writes frames in place
+        and consumers read them as read-only views, so no per-frame
+        allocation or serialization happens.
+
+        Each slot has a generation number, set by the producer on commit,
+        and one released-generation entry per subscriber. Every entry has
+        a single writer, so no lock is needed: a slot is free again once
+        all subscribers have released its current generation.
+    '''
+    ALIGN = 64
+
+    def __init__(self, name, shape=None, dtype=None, slots=8, subscribers=(), create=False):
+        self.name = name
+        if create:
+            info = {'shape': tuple(shape), 'dtype': np.dtype(dtype).str,
+                    'slots': slots, 'subscribers': list(subscribers)}
+            head = pickle.dumps(info, protocol=pickle.HIGHEST_PROTOCOL)
+            size = self._layout(info, len(head))
+            try:
+                self.shm = _openSegment(name, create=True, size=size)
+            except FileExistsError: # left over from a previous run
+                _unlinkSegment(_openSegment(name))
+                self.shm = _openSegment(name, create=True, size=size)
+            self.shm.buf[:8] = struct.pack('<Q', len(head))
+            self.shm.buf[8:8+len(head)] = head
+        else:
+            self.shm = _openSegment(name)
+            head_len = struct.unpack('<Q', self.shm.buf[:8])[0]
+            info = pickle.loads(self.shm.buf[8:8+head_len])
+            self._layout(info, head_len)
+
+        self.shape = info['shape']
+        self.dtype = np.dtype(info['dtype'])
+        self.slots = info['slots']
+        self.subscribers = info['subscribers']
+
+        self.generations = np.ndarray((self.slots,), dtype=np.int64, buffer=self.shm.buf, offset=self._gen_offset)
+        self.released = np.ndarray((self.slots, max(len(self.subscribers), 1)), dtype=np.int64,
+                                   buffer=self.shm.buf, offset=self._rel_offset)
+        self.frames = np.ndarray((self.slots,)+self.shape, dtype=self.dtype,
+                                 buffer=self.shm.buf, offset=self._frame_offset)
+        if create:
+            self.generations[:] = 0
+            self.released[:] = 0
+
+        self.next = 0 # producer side only
+
+    def _layout(self, info, head_len):
+        ''' Compute offsets of the control arrays and frames; returns total size
+        '''
+        align = lambda n: -(-n // self.ALIGN) * self.ALIGN
+        slots = info['slots']
+        self._gen_offset = align(8+head_len)
+        self._rel_offset = align(self._gen_offset + 8*slots)
+        self._frame_offset = align(self._rel_offset + 8*slots*max(len(info['subscribers']), 1))
+        frame_size = int(np.prod(info['shape'])) * np.dtype(info['dtype']).itemsize
+        return self._frame_offset + frame_size*slots
+
+    def isFree(self, slot):
+        return bool(np.all(self.released[slot, :len(self.subscribers)] >= self.generations[slot]))
+
+    def acquire(self):
+        ''' Producer: index of the next slot in the ring,
+            or None if a subscriber still holds it
+        '''
+        slot = self.next
+        if not self.isFree(slot):
+            return None
+        self.next = (slot+1) % self.slots
+        return slot
+
+    def frame(self, slot):
+        ''' Producer: writable view of a slot
+        '''
+        return self.frames[slot]
+
+    def commit(self, slot):
+        ''' Producer: publish the frame written in slot
+        '''
+        generation = int(self.generations.max()) + 1
+        self.generations[slot] = generation
+        return ArenaSlot(self.name, slot, generation)
+
+    def generation(self, slot):
+        return int(self.generations[slot])
+
+    def view(self, slot):
+        ''' Consumer: read-only view of a slot
+        '''
+        res = self.frames[slot]
+        res.flags.writeable = False
+        return res
+
+    def release(self, ref, subscriber):
+        ''' Consumer: mark ref as consumed by subscriber (an actor name)
+            Replicas (Processor#1) release for their base actor; each frame
+            goes to a single replica, so they never contend for a slot
+        '''
+        subscriber = subscriber.split('#')[0]
+        if subscriber in self.subscribers:
+            i = self.subscribers.index(subscriber)
+            self.released[ref.slot, i] = max(self.released[ref.slot, i], ref.generation)
+
+    def close(self):
+        del self.generations, self.released, self.frames
+        self.shm.close()
+
+
+def splitName(object_name):
+    ''' Split a per-frame object name into its type and frame number
+        e.g. 'acq_raw12' -> ('acq_raw', 12); 'params_dict' -> ('params_dict', None)
+    '''
+    match = _NAME_FRAME.match(object_name)
+    if match is None:
+        return object_name, None
+    return match.group(1), int(match.group(2))
+
+_NAME_FRAME = re.compile(r'^(.*?\D)(\d+)$')
+
+def _segmentPrefix(store_loc):
+    return 'improv_{}_'.format(os.path.basename(store_loc.rstrip('/')) or 'store')
+
+def _openSegment(name, create=False, size=0):
+    ''' Open a shared memory segment without handing it to the
+        resource tracker, which would unlink it when the creating
+        (or merely attaching) process exits. Lifetime is managed by
+        the store instead.
+    '''
+    if _TRACK_ARG:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def _unlinkSegment(shm):
+    ''' Unlink a segment opened with _openSegment
+        Before Python 3.13 unlink() always unregisters from the
+        resource tracker, so register it back first to keep it balanced.
+    '''
+    if not _TRACK_ARG:
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+_TRACK_ARG = 'track' in signature(shared_memory.SharedMemory).parameters
+
+
 class LMDBStore(StoreInterface):
 
     def __init__(self, path='output/', name=None, max_size=1e12,
-                 flush_immediately=False, commit_freq=20, from_limbo=False):
+                 flush_immediately=False, commit_freq=20, from_limbo=False,
+                 queue_size=1000, commit_bytes=64*2**20, commit_interval=1.0):
         '''
         Constructor for LMDB store
         path: Path to LMDB folder.
@@ -286,6 +852,16 @@ class LMDBStore(StoreInterface):
         flush_immediately: Save objects to disk immediately
         commit_freq: If not flush_immediately, flush data to disk every _ puts.
         from_limbo: If instantiated from Limbo. Enables object ID functionality.
+        queue_size: Number of objects waiting for the writer before puts are dropped
+        commit_bytes: Commit once this many pickled bytes are pending
+        commit_interval: Commit pending objects at least every _ seconds
+
+        Objects are pickled in put and written by a background thread, so put
+        never waits on the disk. If the writer falls behind and its queue is
+        full, puts are dropped and counted (see stats) instead of blocking.
+
+        Keys are fixed width and sort by (type id, frame number, timestamp),
+        see encodeKey, so all frames of a type are one contiguous range.
         '''
 
         import lmdb
@@ -300,18 +876,33 @@ class LMDBStore(StoreInterface):
             raise FileExistsError('LMDB of the same name already exists.')
 
         self.flush_immediately = flush_immediately
-        self.lmdb_env = lmdb.open(path + name, map_size=max_size, sync=flush_immediately)
+        self.lmdb_env = lmdb.open(path + name, map_size=int(max_size), sync=flush_immediately, max_dbs=3)
+        # data: key -> pickled object; types: object type name -> type id;
+        # frames: frame number -> keys of that frame (secondary index)
+        self.lmdb_data = self.lmdb_env.open_db(b'data')
+        self.lmdb_types = self.lmdb_env.open_db(b'types')
+        self.lmdb_frames = self.lmdb_env.open_db(b'frames', dupsort=True)
+        self.type_ids = {}
         self.lmdb_commit_freq = commit_freq
+        self.lmdb_commit_bytes = commit_bytes
+        self.lmdb_commit_interval = commit_interval
         self.lmdb_obj_id_to_key = {}  # Can be name or key, depending on from_limbo
-        self.lmdb_put_cache = {}
         self.from_limbo = from_limbo
 
+        self.lmdb_queue = Queue(maxsize=queue_size)
+        self.setMetrics(_metrics.MetricsRegistry(capacity=4), 'lmdb') # private until setMetrics
+        self.lmdb_writer = Thread(target=self._write, name='lmdb_writer', daemon=True)
+        self.lmdb_writer.start()
+        # Actor processes end without running atexit handlers, but run these
+        self.closed = False
+        util.Finalize(self, self.flush, exitpriority=10)
+
     def get(self, obj_name_or_id):
         ''' Get object from object name (!from_limbo) or ID (from_limbo).
-            Return None if object is not found.
+            Return None if object is not found or not yet written.
         '''
 
-        with self.lmdb_env.begin() as txn:
+        with self.lmdb_env.begin(db=self.lmdb_data) as txn:
             get_key = self.lmdb_obj_id_to_key[obj_name_or_id]
             r = txn.get(get_key)
             if r is not None:
@@ -321,51 +912,153 @@ class LMDBStore(StoreInterface):
 
     def put(self, obj, obj_name, obj_id=None, save=False):
         '''
-        Put object ID / object pair into LMDB.
-        obj: Object to be saved
-        save: For storage of critical objects.
+        Queue object ID / object pair for writing into LMDB.
+        obj: Object to be saved. It is pickled here, so the caller may
+            change it as soon as put returns.
+        save: For storage of critical objects. Waits for room in the
+            queue instead of dropping, and syncs to disk once written.
         '''
 
-        put_key: bytes = b''.join([obj_name.encode(), pickle.dumps(time.time())])
+        type_name, frame = splitName(obj_name)
+        type_id = self.type_ids.get(type_name)
+        if type_id is None:
+            type_id = len(self.type_ids)
+            self.type_ids[type_name] = type_id
+        put_key = LMDBStore.encodeKey(type_id, frame, time.time())
 
         if self.from_limbo:
             self.lmdb_obj_id_to_key[obj_id] = put_key
         else:
             self.lmdb_obj_id_to_key[obj_name] = put_key
 
-        self.lmdb_put_cache[put_key] = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        value = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            if save:
+                self.lmdb_queue.put((put_key, type_name, value, save))
+            else:
+                self.lmdb_queue.put_nowait((put_key, type_name, value, save))
+        except Full:
+            self.dropped.inc()
+            dropped = int(self.dropped.count[0])
+            if dropped == 1 or dropped % 100 == 0:
+                logger.warning('LMDB writer is behind, dropped {} objects so far'.format(dropped))
+
+    def setMetrics(self, registry, name):
+        ''' Keep the writer's counters as metrics <name>.lmdb_queued (gauge of
+            the queue depth), .lmdb_written, .lmdb_commits and .lmdb_dropped
+            in registry, e.g. the registry shared with Nexus, which logs them
+        '''
+        self.queued = registry.gauge(name+'.lmdb_queued')
+        self.written = registry.counter(name+'.lmdb_written')
+        self.commits = registry.counter(name+'.lmdb_commits')
+        self.dropped = registry.counter(name+'.lmdb_dropped')
+
+    def stats(self):
+        ''' Backpressure and throughput counters of the writer
+        '''
+        return {'queued': self.lmdb_queue.qsize(), 'written': int(self.written.count[0]),
+                'commits': int(self.commits.count[0]), 'dropped': int(self.dropped.count[0])}
+
+    @staticmethod
+    def encodeKey(type_id, frame, timestamp):
+        ''' Fixed-width, byte-sortable key: big-endian type id (2 bytes),
+            frame number (8 bytes, NO_FRAME if the name has none),
+            time in microseconds (8 bytes)
+        '''
+        return LMDB_KEY.pack(type_id, NO_FRAME if frame is None else frame, int(timestamp*1e6))
 
-        if len(self.lmdb_put_cache) > self.lmdb_commit_freq or (self.flush_immediately or save):
-            with self.lmdb_env.begin(write=True) as txn:
-                for key, value in self.lmdb_put_cache.items():
-                    txn.put(key, value, overwrite=True)
+    @staticmethod
+    def decodeKey(key):
+        ''' Returns (type id, frame number or None, time in seconds)
+        '''
+        type_id, frame, timestamp = LMDB_KEY.unpack(key)
+        return type_id, None if frame == NO_FRAME else frame, timestamp/1e6
 
-            self.lmdb_put_cache = {}
+    def _write(self):
+        ''' Writer thread: commit queued pickled objects in groups,
+            bounded by count, bytes and time since the first pending object
+        '''
+        batch = []
+        batch_bytes = 0
+        batch_start = None
+        sync = False
+        stop = False
 
-            if save:
-                self.lmdb_env.sync()
+        while not stop:
+            try:
+                item = self.lmdb_queue.get(timeout=self.lmdb_commit_interval)
+            except Empty:
+                item = None
+            self.queued.set(self.lmdb_queue.qsize())
+            if item is _STOP:
+                stop = True
+            elif item is not None:
+                key, type_name, value, save = item
+                batch.append((key, type_name, value))
+                batch_bytes += len(value)
+                sync = sync or save
+                if batch_start is None:
+                    batch_start = time.time()
+
+            if batch and (stop or sync or self.flush_immediately
+                          or len(batch) > self.lmdb_commit_freq
+                          or batch_bytes >= self.lmdb_commit_bytes
+                          or time.time() - batch_start >= self.lmdb_commit_interval):
+                try:
+                    with self.lmdb_env.begin(write=True) as txn:
+                        for key, type_name, value in batch:
+                            txn.put(key, value, overwrite=True, db=self.lmdb_data)
+                            txn.put(type_name.encode(), key[:2], overwrite=False, db=self.lmdb_types)
+                            if key[2:10] != LMDB_NO_FRAME:
+                                txn.put(key[2:10], key, dupdata=True, db=self.lmdb_frames)
+                    if sync:
+                        self.lmdb_env.sync()
+                    self.written.inc(len(batch))
+                    self.commits.inc()
+                except Exception as e:
+                    logger.error('LMDB writer could not commit {} objects: {}'.format(len(batch), e))
+                batch = []
+                batch_bytes = 0
+                batch_start = None
+                sync = False
 
     def delete(self, obj_id):
         ''' Delete object from LMDB.
         '''
+        key = self.lmdb_obj_id_to_key[obj_id]
         with self.lmdb_env.begin(write=True) as txn:
-            out = txn.pop(self.lmdb_obj_id_to_key[obj_id])
+            out = txn.pop(key, db=self.lmdb_data)
+            txn.delete(key[2:10], key, db=self.lmdb_frames)
         if out is None:
             raise ObjectNotFoundError(obj_id_or_name = obj_id)
 
     def flush(self):
-        ''' Must run before exiting.
-            Flushes buffer to disk.
+        ''' Writes everything still queued, flushes buffer to disk and closes
+            the LMDB. Runs on Limbo.release and at the latest when the process
+            exits; later calls do nothing.
         '''
+        if self.closed:
+            return
+        self.closed = True
+        self.lmdb_queue.put(_STOP)
+        self.lmdb_writer.join()
         self.lmdb_env.sync()
         self.lmdb_env.close()
         print('Flushed!')
+        if self.dropped.count[0]:
+            logger.warning('LMDB writer dropped {} objects'.format(int(self.dropped.count[0])))
 
     def replace(self): pass #TODO
 
     def subscribe(self): pass #TODO
 
 
+_STOP = object() # sentinel telling the LMDB writer thread to finish
+
+LMDB_KEY = struct.Struct('>HQQ')
+NO_FRAME = 2**64-1
+LMDB_NO_FRAME = struct.pack('>Q', NO_FRAME)
+
 def saveObj(obj, name):
     with open('/media/hawkwings/Ext Hard Drive/dump/dump'+str(name)+'.pkl', 'wb') as output:
         pickle.dump(obj, output)
@@ -439,16 +1132,16 @@ class Watcher():
                     #break
             try:
                 signal = self.q_sig.get(timeout=0.005)
-                if signal == Spike.run():
+                if signal == actor.Spike.run():
                     self.flag = True
                     logger.warning('Received run signal, begin running')
-                elif signal == Spike.quit():
+                elif signal == actor.Spike.quit():
                     logger.warning('Received quit signal, aborting')
                     break
-                elif signal == Spike.pause():
+                elif signal == actor.Spike.pause():
                     logger.warning('Received pause signal, pending...')
                     self.flag = False
-                elif signal == Spike.resume(): #currently treat as same as run
+                elif signal == actor.Spike.resume(): #currently treat as same as run
                     logger.warning('Received resume signal, resuming')
                     self.flag = True
             except Empty as e:
@@ -0,0 +1,267 @@
+import functools
+import itertools
+import json
+import threading
+import time
+from contextlib import nullcontext
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+
+import logging; logger = logging.getLogger(__name__)
+
+# Per-frame latency tracing.
+#
+# A source actor calls begin(frame) when a frame enters the pipeline.
+# While tracing is on, a Link wraps every item put by an actor holding a
+# trace context in an Envelope carrying that context. The receiving Link
+# unwraps it, makes it the receiving process' current context and sends
+# a hop record to Nexus, so the context follows the frame downstream
+# through every actor that forwards results after a get.
+#
+# Times are time.monotonic(), which is system-wide on Linux and so
+# comparable between actor processes.
+
+_current = None # context of the frame this process is working on
+
+# Timeline of actor activity.
+#
+# With the 'timeline' setting Nexus creates a SpanRing per actor and
+# installs it in the actor's process with record(). span() and traced()
+# then store when RunManager dispatches, store puts/gets and Link waits
+# begin and end, overwriting the oldest spans once the ring is full.
+# At shutdown Nexus merges the rings into one Chrome trace JSON file
+# (writeChromeTrace) that chrome://tracing or Perfetto can open.
+
+_spans = None # SpanRing of this process, if recording
+_nospan = nullcontext()
+
+def begin(frame):
+    ''' Start tracing a new frame from this (source) process
+    '''
+    global _current
+    _current = TraceContext(frame, time.monotonic(), None)
+
+def current():
+    return _current
+
+def wrap(item):
+    ''' Wrap item with the current context, if any, before it is put on a Link
+    '''
+    if _current is None:
+        return item
+    return Envelope(item, _current, time.monotonic())
+
+def unwrap(item, link):
+    ''' Unwrap an item taken from link and adopt its context
+        Returns the item and the hop record (None if item was not traced)
+    '''
+    global _current
+    if not isinstance(item, Envelope):
+        return item, None
+    received = time.monotonic()
+    ctx = item.ctx
+    _current = TraceContext(ctx.frame, ctx.origin, received)
+    return item.item, (ctx.frame, link.name, link.start, link.end, ctx.origin, ctx.received, item.sent, received)
+
+def record(ring):
+    ''' Record spans of this process into ring (None to stop)
+    '''
+    global _spans
+    _spans = ring
+
+def span(name, cat):
+    ''' Context manager recording a span, if this process records any
+    '''
+    if _spans is None:
+        return _nospan
+    return _Span(_spans, name, cat)
+
+def traced(cat):
+    ''' Decorator recording each call of a function as a span of category cat
+    '''
+    def decorate(method):
+        name = method.__qualname__
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if _spans is None:
+                return method(*args, **kwargs)
+            with _Span(_spans, name, cat):
+                return method(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+class TraceContext():
+    ''' frame: frame number
+        origin: time the frame entered the pipeline
+        received: time this process got it (None at the source)
+    '''
+    __slots__ = ('frame', 'origin', 'received')
+
+    def __init__(self, frame, origin, received):
+        self.frame = frame
+        self.origin = origin
+        self.received = received
+
+    def __getstate__(self):
+        return (self.frame, self.origin, self.received)
+
+    def __setstate__(self, state):
+        self.frame, self.origin, self.received = state
+
+
+class Envelope():
+    ''' An item on a Link together with its trace context and send time
+    '''
+    __slots__ = ('item', 'ctx', 'sent')
+
+    def __init__(self, item, ctx, sent):
+        self.item = item
+        self.ctx = ctx
+        self.sent = sent
+
+    def __getstate__(self):
+        return (self.item, self.ctx, self.sent)
+
+    def __setstate__(self, state):
+        self.item, self.ctx, self.sent = state
+
+
+class Histogram():
+    ''' Latency histogram with log-spaced bins from 1 us to 100 s
+    '''
+    edges = np.logspace(-6, 2, 161)
+
+    def __init__(self, counts=None, total=0.0):
+        ''' counts, total: existing bin counts (len(edges)+1) and sum to summarize
+        '''
+        self.counts = np.zeros(len(self.edges)+1, dtype=np.int64) if counts is None else counts
+        self.total = total
+
+    def record(self, seconds):
+        self.counts[np.searchsorted(self.edges, seconds)] += 1
+        self.total += seconds
+
+    def count(self):
+        return int(self.counts.sum())
+
+    def percentile(self, q):
+        ''' Upper edge of the bin holding the q-th percentile
+        '''
+        n = self.count()
+        if n == 0:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.counts), q/100*n))
+        return float(self.edges[min(i, len(self.edges)-1)])
+
+    def summary(self):
+        n = self.count()
+        return {'count': n,
+                'mean': self.total/n if n else None,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+
+class LatencyStats():
+    ''' Aggregates hop records into histograms of
+        transit: from put to get, per Link
+        process: from getting a frame to putting the result, per actor
+        e2e: from the frame's origin to its arrival, per receiving actor
+    '''
+
+    def __init__(self):
+        self.histograms = {}
+
+    def record(self, record):
+        frame, link, start, end, origin, sender_received, sent, received = record
+        self._histogram('transit', link).record(received-sent)
+        if sender_received is not None:
+            self._histogram('process', start.split('.')[0]).record(sent-sender_received)
+        self._histogram('e2e', end.split('.')[0]).record(received-origin)
+
+    def _histogram(self, kind, name):
+        if (kind, name) not in self.histograms:
+            self.histograms[(kind, name)] = Histogram()
+        return self.histograms[(kind, name)]
+
+    def summary(self):
+        return {'{} {}'.format(*key): h.summary() for key,h in sorted(self.histograms.items())}
+
+    def log(self):
+        for key, s in self.summary().items():
+            logger.info('{}: n={count} mean={mean:.6f}s p50={p50:.6f}s p90={p90:.6f}s p99={p99:.6f}s'.format(key, **s))
+
+
+class _Span():
+    __slots__ = ('ring', 'name', 'cat', 'start')
+
+    def __init__(self, ring, name, cat):
+        self.ring = ring
+        self.name = name
+        self.cat = cat
+
+    def __enter__(self):
+        self.start = time.monotonic()
+
+    def __exit__(self, type, value, traceback):
+        self.ring.add(self.name, self.cat, self.start, time.monotonic())
+
+
+SPAN = np.dtype([('name', 'S48'), ('cat', 'S16'), ('tid', 'u8'), ('start', 'f8'), ('end', 'f8')])
+
+class SpanRing():
+    ''' The last slots spans of one process, in memory shared with Nexus
+        (must be created before the process is started)
+    '''
+
+    def __init__(self, slots=65536):
+        self.slots = slots
+        self.buf = RawArray('b', 8+slots*SPAN.itemsize)
+        self._map()
+
+    def _map(self):
+        self.head = np.frombuffer(self.buf, np.int64, 1, 0)
+        self.table = np.frombuffer(self.buf, SPAN, self.slots, 8)
+        self.next = itertools.count(int(self.head[0])) # atomic, so executor threads can add too
+
+    def __getstate__(self):
+        return {'slots': self.slots, 'buf': self.buf}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._map()
+
+    def add(self, name, cat, start, end):
+        i = next(self.next)
+        self.table[i % self.slots] = (name.encode()[:48], cat.encode()[:16], threading.get_native_id(), start, end)
+        self.head[0] = i+1
+
+    def overwritten(self):
+        ''' Number of spans lost to the ring wrapping around
+        '''
+        return max(0, int(self.head[0])-self.slots)
+
+    def spans(self):
+        ''' Recorded spans, oldest first
+        '''
+        spans = self.table[self.table['end'] > 0]
+        return spans[np.argsort(spans['start'])]
+
+
+def writeChromeTrace(path, rings):
+    ''' Merge the spans of rings, a dict of process name to SpanRing,
+        into a Chrome trace JSON file, one trace process per ring
+    '''
+    spans = {name: ring.spans() for name, ring in rings.items()}
+    starts = [s['start'][0] for s in spans.values() if len(s)]
+    t0 = min(starts) if starts else 0.0
+    events = []
+    for pid, (name, s) in enumerate(spans.items()):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}})
+        for rec in s:
+            events.append({'name': rec['name'].decode(), 'cat': rec['cat'].decode(), 'ph': 'X',
+                           'pid': pid, 'tid': int(rec['tid']),
+                           'ts': (rec['start']-t0)*1e6, 'dur': (rec['end']-rec['start'])*1e6})
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -1,11 +1,26 @@
 import os
+import sys
+import json
+import hashlib
 import yaml
 import io
 from inspect import signature
 from importlib import import_module
+from importlib.util import find_spec
+from improv.utils import scheduling
 
 import logging; logger = logging.getLogger(__name__)
 
+# Actor classes whose signature was checked against their options, with the
+# file and modification time of every module defining the class or one of
+# its bases then, so createConfig only imports an actor's module (caiman,
+# cv2 and the like) when it, its options or its base classes have changed
+CACHE_FILE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                          'improv', 'validated.json')
+
+# Default size of the plasma store in bytes (store_size setting)
+STORE_SIZE = 40000000000
+
 #TODO: Write a save function for Tweak objects output as YAML configFile but using TweakModule objects
 
 class Tweak():
@@ -24,7 +39,64 @@ class Tweak():
         
         self.actors = {}
         self.connections = {}
+        # Per-connection link options from the dict form of a connection:
+        #   Acquirer.q_out:
+        #     targets: [Processor.q_in, Visual.raw_frame_queue]
+        #     maxsize: 50
+        #     policy: {Visual.raw_frame_queue: latest}   # or one policy for all targets
+        self.connectionOptions = {}
         self.hasGUI = False
+        self.cacheFile = CACHE_FILE # None to always import actor modules
+
+        # Nexus-wide options, overridden by an optional 'settings' section
+        # store: 'plasma' (external plasma_store server) or 'shm' (shared memory, no server)
+        # store_size: bytes of the plasma store; the 'shm' store has no fixed size
+        # store_window: number of frames of each per-frame object kept in the store
+        # links: 'manager' (Manager().Queue) or 'shm' (shared memory ring of
+        #   link_slots slots of link_slot_size bytes, no server process)
+        # trace: carry per-frame trace contexts on data links and report latencies at quit
+        # timeline: Chrome trace JSON file that actor activity is written to at quit, or None
+        # timeline_slots: number of most recent spans kept per actor
+        # monitor_interval: seconds between samples of link backlogs, store usage and
+        #   actor progress, logged and served on monitor_port; None to not monitor
+        # monitor_port: localhost HTTP port serving the latest sample as JSON
+        #   (0 for any free port), or None for no endpoint
+        # reorder_wait: seconds the output of replicated actors waits for a missing item
+        # load_in_process: import and instantiate each actor in its own process, in
+        #   parallel, rather than in Nexus before starting them (GUI and Visual excepted)
+        # restart_limit: times Nexus restarts an actor whose process died (0: never)
+        # metrics_capacity: number of metrics the shared registry can hold (see improv.metrics);
+        #   None for metrics_per_actor for each actor instance (replicas included) and Nexus
+        # metrics_per_actor: metrics each actor instance is expected to register
+        # metrics_file: CSV file that metric snapshots are appended to while running, or None
+        # metrics_interval: seconds between snapshots
+        # headless: no GUI; Nexus sets the actors up as soon as they start, runs them
+        #   once all are ready and quits once every acquirer is done and the data
+        #   links are empty (see Nexus.finishRun)
+        # acquirers: actors whose done signal (e.g. FileAcquirer at the end of its
+        #   file) ends a headless run; required when headless
+        # drain_timeout: seconds a headless run waits for the data links to empty
+        self.settings = {'store': 'plasma',
+                         'store_size': STORE_SIZE,
+                         'store_window': None,
+                         'links': 'manager',
+                         'link_slots': 256,
+                         'link_slot_size': 4096,
+                         'trace': False,
+                         'timeline': None,
+                         'timeline_slots': 65536,
+                         'metrics_capacity': None,
+                         'metrics_per_actor': 32,
+                         'metrics_file': None,
+                         'metrics_interval': 1.0,
+                         'monitor_interval': None,
+                         'monitor_port': None,
+                         'restart_limit': 0,
+                         'load_in_process': True,
+                         'reorder_wait': 1.0,
+                         'headless': False,
+                         'acquirers': None,
+                         'drain_timeout': 60.0}
         
     def createConfig(self):
         ''' Read yaml config file and create config for Nexus
@@ -32,6 +104,8 @@ class Tweak():
         '''
         with open(self.configFile, 'r') as ymlfile:
             cfg = yaml.safe_load(ymlfile)
+        validated = self.loadValidated()
+        before = dict(validated)
 
         for name,actor in cfg['actors'].items(): 
             # put import/name info in TweakModule object TODO: make ordered?
@@ -41,28 +115,14 @@ class Tweak():
 
             packagename = actor.pop('package')
             classname = actor.pop('class')
+            replicas = actor.pop('replicas', 1)
+            if not isinstance(replicas, int) or replicas < 1:
+                raise InvalidReplicasError(name, replicas)
+            sched = {key: actor.pop(key) for key in scheduling.OPTIONS if key in actor}
+            self.checkScheduling(name, sched)
             
-            try:
-                __import__(packagename, fromlist=[classname])
-
-            except ModuleNotFoundError:
-                logger.error('Error: Packagename not valid')
-
-            except ImportError:
-                logger.error('Error: Classname not valid within package')
-
-            mod = import_module(packagename)
-            clss = getattr(mod, classname)
-            sig= signature(clss)
-            tweakModule = TweakModule(name, packagename, classname, options=actor)
-            try:
-                sig.bind(tweakModule.options)
-            except TypeError as e:
-                logger.error('Error: Invalid arguments passed')
-                params= ''
-                for parameter in sig.parameters:
-                    params = params + ' ' + parameter.name
-                logger.warning('Expected Parameters:' + params)
+            tweakModule = TweakModule(name, packagename, classname, options=actor, replicas=replicas, scheduling=sched)
+            self.checkActor(tweakModule, validated)
             if "GUI" in name:
                 self.hasGUI = True
                 self.gui = tweakModule
@@ -75,8 +135,122 @@ class Tweak():
             if name in self.connections.keys():
                 raise RepeatedConnectionsError(name)
 
+            if isinstance(conn, dict):
+                targets = conn['targets']
+                policy = conn.get('policy', 'block')
+                if isinstance(policy, str):
+                    policy = dict.fromkeys(targets, policy)
+                policy = {t: policy.get(t, 'block') for t in targets}
+                for p in policy.values():
+                    if p not in POLICIES:
+                        raise InvalidPolicyError(name, p)
+                self.connectionOptions.update({name:{'maxsize': conn.get('maxsize', 0), 'policy': policy}})
+                conn = targets
+
             self.connections.update({name:conn}) #conn should be a list
-        
+
+        if cfg.get('settings'):
+            self.settings.update(cfg['settings'])
+
+        if validated != before:
+            self.saveValidated(validated)
+
+    def checkActor(self, tweakModule, validated):
+        ''' Check that the actor's class exists and accepts its options
+            Skipped if validated records the same options, and the modules
+            of the class and its bases unchanged, since the last check
+        '''
+        options = json.dumps(tweakModule.options, sort_keys=True, default=str)
+        key = ':'.join([tweakModule.packagename, tweakModule.classname, hashlib.sha1(options.encode()).hexdigest()])
+        stamp = moduleStamp(tweakModule.packagename)
+        stamps = validated.get(key)
+        if stamp is not None and stamps and stamps[0] == stamp and all(fileStamp(f) == [f, m] for f, m in stamps[1:]):
+            return
+
+        packagename, classname = tweakModule.packagename, tweakModule.classname
+        try:
+            __import__(packagename, fromlist=[classname])
+
+        except ModuleNotFoundError:
+            logger.error('Error: Packagename not valid')
+
+        except ImportError:
+            logger.error('Error: Classname not valid within package')
+
+        mod = import_module(packagename)
+        clss = getattr(mod, classname)
+        sig= signature(clss)
+        try:
+            sig.bind(tweakModule.name, **tweakModule.options) # as Nexus.createActor instantiates it
+        except TypeError as e:
+            logger.error('Error: Invalid arguments passed')
+            params= ''
+            for parameter in sig.parameters:
+                params = params + ' ' + parameter.name
+            logger.warning('Expected Parameters:' + params)
+        else:
+            if stamp is not None:
+                bases = {sys.modules[c.__module__].__file__ for c in clss.__mro__[1:]
+                         if getattr(sys.modules.get(c.__module__), '__file__', None)}
+                bases.discard(stamp[0])
+                validated[key] = [stamp]+[s for s in map(fileStamp, sorted(bases)) if s is not None]
+
+    def loadValidated(self):
+        ''' Actor classes checked by earlier runs,
+            {package:class:options hash: [[file, mtime] of the class's module, then of its bases' modules]}
+        '''
+        if self.cacheFile is None:
+            return {}
+        try:
+            with open(self.cacheFile) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def saveValidated(self, validated):
+        if self.cacheFile is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cacheFile), exist_ok=True)
+            tmp = self.cacheFile+'.{}'.format(os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(validated, f)
+            os.replace(tmp, self.cacheFile) # concurrent runs never see a partial file
+        except OSError as e:
+            logger.warning('Cannot cache validated actors in {}: {}'.format(self.cacheFile, e))
+
+
+    def checkScheduling(self, name, sched):
+        ''' Raise InvalidSchedulingError if sched are not valid scheduling options
+        '''
+        if 'cpu_affinity' in sched and not (isinstance(sched['cpu_affinity'], list)
+                                            and sched['cpu_affinity']
+                                            and all(isinstance(c, int) for c in sched['cpu_affinity'])):
+            raise InvalidSchedulingError(name, 'cpu_affinity must be a list of CPU numbers')
+        if 'numa_node' in sched and not isinstance(sched['numa_node'], int):
+            raise InvalidSchedulingError(name, 'numa_node must be a node number')
+        if sched.get('sched', 'other') not in scheduling.POLICIES:
+            raise InvalidSchedulingError(name, 'sched must be one of '+', '.join(scheduling.POLICIES))
+        if sched.get('sched', 'other') != 'other' and sched.get('priority') not in range(1, 100):
+            raise InvalidSchedulingError(name, 'real-time sched needs a priority from 1 to 99')
+
+    def checkSettings(self):
+        ''' Raise InvalidSettingError if the settings, including any
+            overrides made after createConfig, cannot be used together
+        '''
+        if self.settings['store'] == 'shm' and self.settings['store_size'] != STORE_SIZE:
+            raise InvalidSettingError('store_size', 'cannot be enforced with store: shm, whose segments are '
+                                      'limited only by the size of /dev/shm; remove it or use store: plasma')
+        acquirers = self.settings['acquirers']
+        if acquirers is None:
+            if self.settings['headless']:
+                raise InvalidSettingError('acquirers', 'a headless run needs the actors whose done signal ends it')
+            return
+        if not isinstance(acquirers, list) or not acquirers:
+            raise InvalidSettingError('acquirers', 'must be a list of actor names')
+        for name in acquirers:
+            if name not in self.actors:
+                raise InvalidSettingError('acquirers', 'no actor is named "{}"'.format(name))
 
     def addParams(self, type, param):
         ''' Function to add paramter param of type type
@@ -87,12 +261,43 @@ class Tweak():
         cfg = self.actors
         yaml.safe_dump(cfg)
 
+def moduleStamp(packagename):
+    ''' [file, modification time] of the module packagename, found without
+        importing it, or None if it cannot be found
+    '''
+    try:
+        spec = find_spec(packagename)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.has_location:
+        return None
+    return fileStamp(spec.origin)
+
+def fileStamp(path):
+    ''' [path, modification time], or None if the file is gone
+    '''
+    try:
+        return [path, os.path.getmtime(path)]
+    except OSError:
+        return None
+
+# What a Link does when a put finds it full
+#   block: wait for space; drop-newest: discard the new item;
+#   drop-oldest: discard the oldest queued item; latest: keep only the newest item
+POLICIES = ('block', 'drop-newest', 'drop-oldest', 'latest')
+
 class TweakModule():
-    def __init__(self, name, packagename, classname, options=None):
+    ''' replicas: number of processes running the actor; they share its input
+        links, and their outputs are put back in input order (see Nexus.createReplicas)
+        scheduling: CPU placement options applied to the actor's process(es)
+    '''
+    def __init__(self, name, packagename, classname, options=None, replicas=1, scheduling=None):
         self.name = name
         self.packagename = packagename
         self.classname = classname
         self.options = options
+        self.replicas = replicas
+        self.scheduling = scheduling or {} # see improv.utils.scheduling
 
 
 class RepeatedActorError(Exception):
@@ -109,6 +314,60 @@ class RepeatedActorError(Exception):
         return self.message
 
 
+class InvalidPolicyError(Exception):
+    def __init__(self, connection, policy, reason=None):
+
+        super().__init__()
+        self.name = 'InvalidPolicyError'
+        self.connection = connection
+
+        if reason is None:
+            reason = 'is not one of {}'.format(', '.join(POLICIES))
+        self.message = 'Overflow policy "{}" of connection "{}" {}'.format(policy, connection, reason)
+
+    def __str__(self):
+        return self.message
+
+
+class InvalidReplicasError(Exception):
+    def __init__(self, actor, replicas):
+
+        super().__init__()
+        self.name = 'InvalidReplicasError'
+        self.actor = actor
+
+        self.message = 'Replicas of actor "{}" must be a positive integer, not "{}"'.format(actor, replicas)
+
+    def __str__(self):
+        return self.message
+
+
+class InvalidSchedulingError(Exception):
+    def __init__(self, actor, problem):
+
+        super().__init__()
+        self.name = 'InvalidSchedulingError'
+        self.actor = actor
+
+        self.message = 'Scheduling options of actor "{}": {}'.format(actor, problem)
+
+    def __str__(self):
+        return self.message
+
+
+class InvalidSettingError(Exception):
+    def __init__(self, setting, problem):
+
+        super().__init__()
+        self.name = 'InvalidSettingError'
+        self.setting = setting
+
+        self.message = 'Setting "{}": {}'.format(setting, problem)
+
+    def __str__(self):
+        return self.message
+
+
 class RepeatedConnectionsError(Exception):
     def __init__(self, repeat):
 
@@ -17,9 +17,55 @@ Example usage:
 
 import sys
 
-import networkx as nx
 import yaml
 
+# networkx is imported where it is used: it is slow to import and
+# improv.nexus imports this module
+
+
+def connection_graph(connections):
+    """
+    Build the graph of actors that the connections link together.
+
+    :param connections: Connections as in the YAML file, e.g.
+        {'Acquirer.q_out': ['Processor.q_in']}; a connection may also be
+        a dict with the targets under 'targets'.
+    :type connections: dict
+
+    :return: Graph with an edge from each source actor to its targets.
+    :rtype: networkx.DiGraph
+
+    """
+    import networkx as nx
+
+    g = nx.DiGraph()
+    for key, values in connections.items():
+        if isinstance(values, dict):  # connection with link options
+            values = values['targets']
+        # Need to keep only module names
+        g.add_edges_from((key.split('.')[0], value.split('.')[0]) for value in values)
+    return g
+
+
+def consumers_first(connections):
+    """
+    Order the connected actors so that every actor comes after the actors
+    it sends to.
+
+    :param connections: Connections, see connection_graph.
+    :type connections: dict
+
+    :return: Actor names, or None if the connections form a loop.
+    :rtype: list
+
+    """
+    import networkx as nx
+
+    g = connection_graph(connections)
+    if not nx.is_directed_acyclic_graph(g):
+        return None
+    return list(reversed(list(nx.topological_sort(g))))
+
 
 def check_if_connections_acyclic(path_to_yaml):
     """
@@ -35,17 +81,12 @@ def check_if_connections_acyclic(path_to_yaml):
     :rtype: bool
 
     """
+    import networkx as nx
+
     with open(path_to_yaml) as f:
         raw = yaml.safe_load(f)['connections']
 
-    # Need to keep only module names
-    connections = {}
-    for key, values in raw.items():
-        new_key = key.split('.')[0]
-        new_values = [value.split('.')[0] for value in values]
-        connections[new_key] = new_values
-
-    g = nx.DiGraph(connections)
+    g = connection_graph(raw)
     dag = nx.is_directed_acyclic_graph(g)
 
     if dag:
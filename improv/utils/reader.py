@@ -1,10 +1,9 @@
-import numbers
 import os
 import pickle
+import struct
 from contextlib import contextmanager
-from typing import Dict, Set
 import lmdb
-from .utils import get_num_length_from_key
+from improv.store import LMDBStore
 
 
 class LMDBReader():
@@ -20,73 +19,162 @@ class LMDBReader():
         ''' Load all data from LMDB into a dictionary
             Make sure that the LMDB is small enough to fit in RAM
         '''
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            return {LMDBReader._decode_key(key): pickle.loads(value) for key, value in cur.iternext()}
+        with LMDBReader._lmdb_txn(self.path) as (txn, dbs, names):
+            cur = txn.cursor(db=dbs['data'])
+            return {LMDBReader._decode_key(key, names): pickle.loads(value) for key, value in cur.iternext()}
 
     def get_data_types(self):
         ''' Return all data types defined as {object_name}, but without number.
         '''
-        num_idx = get_num_length_from_key()
-
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            return {key[:-12 - num_idx.send(key)] for key in cur.iternext(values=False)}
+        with LMDBReader._lmdb_txn(self.path) as (txn, dbs, names):
+            return set(names.values())
 
     def get_data_by_number(self, t):
         ''' Return data at a specific frame number t
+            Looks up the keys of frame t in the frame index
         '''
-        num_idx = get_num_length_from_key()
-
-        def check_if_key_equals_t(key):
-            try:
-                return True if int(key[-12 - num_idx.send(key): -12]) == t else False
-            except ValueError:
-                return False
-
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            keys = (key for key in cur.iternext(values=False) if check_if_key_equals_t(key))
-            return {LMDBReader._decode_key(key): pickle.loads(cur.get(key)) for key in keys}
+        with LMDBReader._lmdb_txn(self.path) as (txn, dbs, names):
+            cur = txn.cursor(db=dbs['frames'])
+            if not cur.set_key(struct.pack('>Q', t)):
+                return {}
+            keys = list(cur.iternext_dup())
+            return {LMDBReader._decode_key(key, names): pickle.loads(txn.get(key, db=dbs['data'])) for key in keys}
 
     def get_data_by_type(self, t):
-        ''' Return data with key that starts with t
+        ''' Return data of type t (object name without frame number)
+            Keys sort by type first, so this is a single range scan
+        '''
+        with LMDBReader._lmdb_txn(self.path) as (txn, dbs, names):
+            prefix = txn.get(t.encode(), db=dbs['types'])
+            if prefix is None:
+                return {}
+            cur = txn.cursor(db=dbs['data'])
+            out = {}
+            if cur.set_range(prefix):
+                for key, value in cur.iternext():
+                    if not key.startswith(prefix):
+                        break
+                    out[LMDBReader._decode_key(key, names)] = pickle.loads(value)
+            return out
+
+    def iter_data(self, types=None):
+        ''' Yield (frame, name, object) in key order, i.e. grouped by type
+            and sorted by frame within a type. Only one object is
+            unpickled at a time, so memory use is bounded.
+            types: object names (without number) to restrict to
         '''
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            keys = (key for key in cur.iternext(values=False) if key.startswith(t.encode()))
-            return {LMDBReader._decode_key(key): pickle.loads(cur.get(key)) for key in keys}
+        with LMDBReader._lmdb_txn(self.path) as (txn, dbs, names):
+            if types is None:
+                ranges = [b'']
+            else:
+                ranges = [txn.get(t.encode(), db=dbs['types']) for t in types]
+            cur = txn.cursor(db=dbs['data'])
+            for prefix in ranges:
+                if prefix is None or not cur.set_range(prefix):
+                    continue
+                for key, value in cur.iternext():
+                    if not key.startswith(prefix):
+                        break
+                    type_id, frame, _ = LMDBStore.decodeKey(key)
+                    yield frame, names[type_id], pickle.loads(value)
+
+    def iter_frames(self, start=0, stop=None):
+        ''' Yield (frame, name, object) for frames start <= frame < stop
+            in frame order, using the frame index
+        '''
+        with LMDBReader._lmdb_txn(self.path) as (txn, dbs, names):
+            cur = txn.cursor(db=dbs['frames'])
+            if not cur.set_range(struct.pack('>Q', start)):
+                return
+            for frame_key, key in cur.iternext():
+                frame = struct.unpack('>Q', frame_key)[0]
+                if stop is not None and frame >= stop:
+                    break
+                type_id = LMDBStore.decodeKey(key)[0]
+                yield frame, names[type_id], pickle.loads(txn.get(key, db=dbs['data']))
+
+    def export_hdf5(self, filename, types=None, chunk_frames=64, compression='gzip'):
+        ''' Write per-frame arrays into a chunked HDF5 file, streaming
+            from the LMDB so the session never has to fit in RAM.
+            Each type becomes a group with:
+              data: frames stacked along the first axis (N, *shape)
+              frames: frame number of each row of data
+              ragged/{frame}: frames whose shape differs from the first one
+            Objects that are not numeric arrays are skipped.
+            Returns dict of type to number of frames exported.
+        '''
+        import h5py
+        import numpy as np
+
+        if types is None:
+            types = self.get_data_types()
+        counts = {}
+
+        with h5py.File(filename, 'w') as f:
+            for t in types:
+                group = None
+                for frame, name, obj in self.iter_data(types=[t]):
+                    if frame is None:
+                        continue
+                    arr = np.asarray(obj)
+                    if arr.dtype.hasobject:
+                        continue
+                    if group is None:
+                        group = f.create_group(t)
+                        data = group.create_dataset('data', shape=(0,)+arr.shape, maxshape=(None,)+arr.shape,
+                                                    dtype=arr.dtype, chunks=(chunk_frames,)+arr.shape,
+                                                    compression=compression)
+                        frames = group.create_dataset('frames', shape=(0,), maxshape=(None,), dtype='i8',
+                                                      chunks=(max(chunk_frames, 1024),))
+                    if arr.shape == data.shape[1:]:
+                        n = data.shape[0]
+                        data.resize(n+1, axis=0)
+                        frames.resize(n+1, axis=0)
+                        data[n] = arr
+                        frames[n] = frame
+                    else:
+                        group.create_dataset('ragged/{}'.format(frame), data=arr, compression=compression)
+                    counts[t] = counts.get(t, 0) + 1
+
+        return counts
 
     def get_params(self):
         ''' Return parameters in a dictionary
         '''
-        with LMDBReader._lmdb_cur(self.path) as cur:
-            keys = [key for key in cur.iternext(values=False) if key.startswith(b'params_dict')]
-            return pickle.loads(cur.get(keys[-1]))
+        params = self.get_data_by_type('params_dict')
+        return list(params.values())[-1] if params else None # latest in key order
 
     @staticmethod
-    def _decode_key(key):
+    def _decode_key(key, names):
         ''' Helper method to convert key from byte to str
 
         Example:
-            >>> LMDBReader._decode_key(b'Call0\x80\x03GA\xd7Ky\x06\x9c\xddi.')
-            'Call0_1563288602.4510138'
+            >>> LMDBReader._decode_key(b'\x00\x03' + (0).to_bytes(8, 'big') + (1563288602451013).to_bytes(8, 'big'), {3: 'Call'})
+            'Call0_1563288602.451013'
 
-        key: Encoded key. The last 12 bytes are pickled time.time(). 
-            The remaining are encoded object name.
+        key: Encoded key, see LMDBStore.encodeKey
+        names: dict of type id to object name
         '''
-
-        return f'{key[:-12].decode()}_{pickle.loads(key[-12:])}'
+        type_id, frame, timestamp = LMDBStore.decodeKey(key)
+        return f'{names[type_id]}{"" if frame is None else frame}_{timestamp}'
 
     @staticmethod
     @contextmanager
-    def _lmdb_cur(path):
+    def _lmdb_txn(path):
         ''' Helper context manager to open and ensure proper closure of LMDB
+            Yields the read transaction, the sub-databases and
+            the type id to object name mapping
         '''
 
-        env = lmdb.open(path)
+        env = lmdb.open(path, readonly=True, lock=False, max_dbs=3)
+        dbs = {name: env.open_db(name.encode(), create=False, dupsort=(name == 'frames'))
+               for name in ['data', 'types', 'frames']}
         txn = env.begin()
-        cur = txn.cursor()
         try:
-            yield cur
+            names = {struct.unpack('>H', type_id)[0]: name.decode()
+                     for name, type_id in txn.cursor(db=dbs['types']).iternext()}
+            yield txn, dbs, names
 
         finally:
-            cur.__exit__()
             txn.commit()
             env.close()
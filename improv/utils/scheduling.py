@@ -0,0 +1,82 @@
+import ctypes
+import os
+import platform
+
+import logging; logger = logging.getLogger(__name__)
+
+# Per-actor CPU placement, applied by Nexus in each actor's process
+# before it runs (Nexus.runActor). Options come from the actor's entry
+# in the Tweak config:
+#   cpu_affinity: list of CPUs the actor may run on
+#   numa_node: run on this node's CPUs (within cpu_affinity, if also
+#     given) and prefer allocating memory there
+#   sched: 'other' (default), 'fifo' or 'rr' real-time scheduling
+#   priority: real-time priority 1-99 for 'fifo' and 'rr'
+# Real-time scheduling needs root or CAP_SYS_NICE; failures are logged
+# and the actor runs with the default scheduling instead. Platforms
+# without these system calls (macOS, Windows) only log a warning.
+
+OPTIONS = ('cpu_affinity', 'numa_node', 'sched', 'priority')
+POLICIES = {'other': getattr(os, 'SCHED_OTHER', None),
+            'fifo': getattr(os, 'SCHED_FIFO', None),
+            'rr': getattr(os, 'SCHED_RR', None)}
+
+MPOL_PREFERRED = 1
+SYS_SET_MEMPOLICY = {'x86_64': 238, 'aarch64': 237, 'ppc64le': 261}
+
+
+def apply(name, cpu_affinity=None, numa_node=None, sched=None, priority=None):
+    ''' Apply the scheduling options to the calling process
+    '''
+    cpus = None if cpu_affinity is None else set(cpu_affinity)
+    if numa_node is not None:
+        node = nodeCPUs(numa_node)
+        if cpus is not None and not cpus & node:
+            logger.error('{}: none of CPUs {} is on NUMA node {}'.format(name, sorted(cpus), numa_node))
+            cpus = None
+        cpus = node if cpus is None else cpus & node
+        _preferNode(name, numa_node)
+    if cpus is not None:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+            logger.info('{} runs on CPUs {}'.format(name, sorted(cpus)))
+        else:
+            logger.warning('{}: CPU affinity is not supported on {}'.format(name, platform.system()))
+    if sched is not None:
+        if not hasattr(os, 'sched_setscheduler'):
+            logger.warning('{}: {} scheduling is not supported on {}'.format(name, sched, platform.system()))
+            return
+        try:
+            os.sched_setscheduler(0, POLICIES[sched], os.sched_param(priority or 0))
+            logger.info('{} scheduled {} with priority {}'.format(name, sched, priority or 0))
+        except PermissionError:
+            logger.warning('{}: not permitted to set {} scheduling (needs CAP_SYS_NICE)'.format(name, sched))
+
+def nodeCPUs(node):
+    ''' Set of CPUs on NUMA node
+    '''
+    with open('/sys/devices/system/node/node{}/cpulist'.format(node)) as f:
+        return parseCPUList(f.read())
+
+def parseCPUList(text):
+    ''' Parse a kernel CPU list such as 0-3,8-11
+    '''
+    cpus = set()
+    for part in text.strip().split(','):
+        if part:
+            first, _, last = part.partition('-')
+            cpus.update(range(int(first), int(last or first)+1))
+    return cpus
+
+def _preferNode(name, node):
+    ''' Prefer allocating this process' memory on node (set_mempolicy)
+        The standard library has no wrapper, so call the syscall directly
+    '''
+    number = SYS_SET_MEMPOLICY.get(platform.machine())
+    if number is None:
+        logger.warning('{}: memory not bound to NUMA node {} on {}'.format(name, node, platform.machine()))
+        return
+    mask = ctypes.c_ulong(1 << node)
+    libc = ctypes.CDLL(None, use_errno=True)
+    if libc.syscall(number, MPOL_PREFERRED, ctypes.byref(mask), ctypes.sizeof(mask)*8+1) != 0:
+        logger.warning('{}: cannot prefer NUMA node {}: {}'.format(name, node, os.strerror(ctypes.get_errno())))
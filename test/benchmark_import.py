@@ -0,0 +1,65 @@
+import re
+import subprocess
+import sys
+
+# Import-time budget for Nexus and the core actors, measured with
+# python -X importtime in a fresh interpreter per module.
+# Run from the repository root: python test/benchmark_import.py
+# Exits nonzero if a module takes longer than its budget or pulls in
+# a library that should only be imported where it is used (GUI actors,
+# actor setup, plasma stores)
+
+# Cumulative import time allowed per module, in ms
+BUDGETS = {'improv.tweak': 300,
+           'improv.nexus': 1500,
+           'improv.actors.acquire': 1500,
+           'improv.actors.process': 1500,
+           'improv.actors.analysis': 1500}
+
+DEFERRED = ('PyQt5', 'caiman', 'cv2', 'h5py', 'skimage', 'pyarrow.plasma', 'networkx')
+
+LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+runs = 3
+top = 10
+
+
+def importTimes(module):
+    ''' {imported package: cumulative us} for importing module in a new interpreter
+    '''
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import '+module],
+                         stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+    times = {}
+    for line in out.splitlines():
+        m = LINE.match(line)
+        if m:
+            times[m.group(4)] = int(m.group(2))
+    return times
+
+def measure(module):
+    ''' Best of runs, so a cold file cache does not count against the budget
+    '''
+    best = None
+    for i in range(runs):
+        times = importTimes(module)
+        if best is None or times[module] < best[module]:
+            best = times
+    return best
+
+
+if __name__ == '__main__':
+    failed = []
+    for module, budget in BUDGETS.items():
+        times = measure(module)
+        total = times[module]/1000
+        print('{}: {:.1f} ms (budget {} ms)'.format(module, total, budget))
+        for name, us in sorted(times.items(), key=lambda kv: -kv[1])[1:top+1]:
+            print('    {:8.1f} ms  {}'.format(us/1000, name))
+        if total > budget:
+            failed.append('{} took {:.1f} ms'.format(module, total))
+        for name in DEFERRED:
+            if name in times:
+                failed.append('{} imports {}'.format(module, name))
+
+    for f in failed:
+        print('Over budget:', f)
+    sys.exit(1 if failed else 0)
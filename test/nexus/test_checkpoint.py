@@ -0,0 +1,44 @@
+from unittest import TestCase
+from queue import Queue
+from improv.actor import Actor, Spike
+
+
+class _Client():
+    ''' Store client keeping objects in a dict
+    '''
+    def __init__(self):
+        self.objects = {}
+
+    def put(self, obj, name):
+        obj_id = len(self.objects)
+        self.objects[obj_id] = obj
+        return obj_id
+
+    def getID(self, obj_id):
+        return self.objects[obj_id]
+
+
+class Actor_Checkpoint(TestCase):
+
+    def setUp(self):
+        self.actor = Actor('Processor')
+        self.actor.setStore(_Client())
+        self.actor.setCommLinks(Queue(), Queue())
+
+    def test_notRestarted(self):
+        self.assertIsNone(self.actor.restore())
+
+    def test_restore(self):
+        self.actor.checkpoint({'frame_number': 20000})
+        sig = self.actor.q_comm.get_nowait()
+        self.assertEqual(sig[0], Spike.checkpoint())
+
+        # Nexus hands the ID to the replacement instance
+        replacement = Actor('Processor')
+        replacement.setStore(self.actor.client)
+        replacement.checkpoint_id = sig[1]
+        self.assertEqual(replacement.restore(), {'frame_number': 20000})
+
+    def test_missing(self):
+        self.actor.checkpoint_id = 5
+        self.assertIsNone(self.actor.restore())
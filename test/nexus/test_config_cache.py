@@ -0,0 +1,80 @@
+from unittest import TestCase
+import os
+import shutil
+import sys
+import tempfile
+from improv.tweak import Tweak
+
+CONFIG = '''
+actors:
+  Acquirer:
+    package: cached_actor
+    class: CachedActor
+    filename: data.h5
+connections:
+  Acquirer.q_out: []
+'''
+
+
+class Tweak_ValidatedCache(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.module = os.path.join(self.dir, 'cached_actor.py')
+        self.base = os.path.join(self.dir, 'cached_base.py')
+        with open(self.base, 'w') as f:
+            f.write('class Base():\n    def __init__(self, *args, **kwargs):\n        pass\n')
+        with open(self.module, 'w') as f:
+            f.write('from cached_base import Base\n\nclass CachedActor(Base):\n    pass\n')
+        self.writeConfig(CONFIG)
+        sys.path.insert(0, self.dir)
+
+    def writeConfig(self, config):
+        with open(os.path.join(self.dir, 'cache.yaml'), 'w') as f:
+            f.write(config)
+
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        sys.modules.pop('cached_actor', None)
+        sys.modules.pop('cached_base', None)
+        shutil.rmtree(self.dir)
+
+    def createConfig(self):
+        tweak = Tweak()
+        tweak.configFile = os.path.join(self.dir, 'cache.yaml')
+        tweak.cacheFile = os.path.join(self.dir, 'validated.json')
+        tweak.createConfig()
+        return tweak
+
+    def test_skipsImport(self):
+        self.createConfig()
+        self.assertIn('cached_actor', sys.modules)
+        sys.modules.pop('cached_actor')
+        tweak = self.createConfig()
+        self.assertNotIn('cached_actor', sys.modules)
+        self.assertEqual(tweak.actors['Acquirer'].options, {'filename': 'data.h5'})
+
+    def touch(self, path):
+        mtime = os.path.getmtime(path)
+        os.utime(path, (mtime+10, mtime+10))
+
+    def test_changedModule(self):
+        self.createConfig()
+        sys.modules.pop('cached_actor')
+        self.touch(self.module)
+        self.createConfig()
+        self.assertIn('cached_actor', sys.modules)
+
+    def test_changedBase(self):
+        self.createConfig()
+        sys.modules.pop('cached_actor')
+        self.touch(self.base)
+        self.createConfig()
+        self.assertIn('cached_actor', sys.modules)
+
+    def test_changedOptions(self):
+        self.createConfig()
+        sys.modules.pop('cached_actor')
+        self.writeConfig(CONFIG.replace('filename: data.h5', 'filename: other.h5'))
+        self.createConfig()
+        self.assertIn('cached_actor', sys.modules)
@@ -0,0 +1,188 @@
+from unittest import TestCase
+import asyncio
+import csv
+import os
+import tempfile
+import time
+from queue import Empty
+from improv.actor import Actor, Spike, RunManager
+from improv.nexus import Nexus
+from improv.tweak import Tweak, TweakModule, InvalidSettingError
+
+
+class _Source(Actor):
+    def __init__(self, *args, frames=10):
+        super().__init__(*args)
+        self.frames = frames
+        self.frame_num = 0
+
+    def run(self):
+        with RunManager(self.name, self.runStep, lambda: None, self.q_sig, self.q_comm):
+            pass
+
+    def runStep(self):
+        if self.frame_num < self.frames:
+            self.q_out.put([{str(self.frame_num): self.client.put(self.frame_num, 'raw'+str(self.frame_num))}])
+            self.frame_num += 1
+        elif self.frame_num == self.frames:
+            self.q_comm.put([Spike.done()])
+            self.frame_num += 1
+
+
+class _Sink(Actor):
+    def run(self):
+        self.frame = self.metrics.gauge(self.name+'.frame')
+        with RunManager(self.name, self.runStep, lambda: None, self.q_sig, self.q_comm):
+            pass
+
+    def runStep(self):
+        try:
+            item = self.q_in.get(timeout=0.001)
+        except Empty:
+            return
+        self.frame.set(int(next(iter(item[0]))))
+        self.q_out.put(item)
+
+
+class _Visual(Actor):
+    def run(self):
+        pass # shown by the GUI, like BasicCaimanVisual
+
+
+class _GUI(Actor):
+    def __init__(self, *args, visual=None):
+        super().__init__(*args)
+
+
+class _Queue():
+    def __init__(self, size=0):
+        self.size = size
+
+    def qsize(self):
+        return self.size
+
+
+class _Process():
+    def __init__(self, alive=True):
+        self.alive = alive
+
+    def is_alive(self):
+        return self.alive
+
+
+class Headless_Finish(TestCase):
+
+    def setUp(self):
+        self.nexus = Nexus('Nexus')
+        self.nexus.tweak = Tweak()
+        self.nexus.tweak.connections = {'Acquirer.q_out': ['Processor.q_in'],
+                                        'InputStim.q_out': ['Analysis.input_stim_queue'],
+                                        'Processor.q_out': ['Analysis.q_in']}
+        self.nexus.data_queues = {'Processor.q_in': _Queue(), 'Analysis.input_stim_queue': _Queue(),
+                                  'Analysis.q_in': _Queue()}
+        self.nexus.replicas = {'Acquirer': ['Acquirer', 'Acquirer#1']}
+        self.nexus.actorProcesses = {'Processor': _Process(), 'Analysis': _Process()}
+        self.nexus.finished = set()
+        self.nexus.tDone = None
+        self.nexus.finishing = None
+
+    def test_acquirers(self):
+        self.assertEqual(self.nexus.acquirers(), set())
+        self.nexus.tweak.settings['acquirers'] = ['Acquirer']
+        self.assertEqual(self.nexus.acquirers(), {'Acquirer', 'Acquirer#1'})
+
+    def test_checkSettings(self):
+        tweak = Tweak()
+        tweak.actors = {'Acquirer': None, 'InputStim': None}
+        tweak.checkSettings()
+        tweak.settings['headless'] = True
+        with self.assertRaises(InvalidSettingError):
+            tweak.checkSettings() # nothing would end the run
+        tweak.settings['acquirers'] = ['Acquirer']
+        tweak.checkSettings()
+        tweak.settings['acquirers'] = ['Acquirers']
+        with self.assertRaises(InvalidSettingError):
+            tweak.checkSettings()
+
+    def test_done(self):
+        self.nexus.tweak.settings['acquirers'] = ['Acquirer']
+        self.nexus.acquirerDone('Acquirer')
+        self.assertIsNone(self.nexus.tDone)
+        self.nexus.acquirerDone('Acquirer#1')
+        self.assertIsNotNone(self.nexus.tDone)
+        self.assertIsNone(self.nexus.finishing) # not headless
+
+    def test_drain(self):
+        self.nexus.tweak.settings.update({'headless': True, 'acquirers': ['InputStim'], 'drain_timeout': 5})
+        self.nexus.data_queues['Analysis.q_in'].size = 3
+
+        async def finish():
+            self.nexus.acquirerDone('InputStim')
+            await asyncio.sleep(0.3)
+            self.assertFalse(self.nexus.finishing.done()) # still items queued
+            self.nexus.data_queues['Analysis.q_in'].size = 0
+            await asyncio.wait_for(self.nexus.finishing, timeout=2)
+
+        asyncio.run(finish())
+
+    def test_noConsumer(self):
+        self.nexus.tweak.settings.update({'headless': True, 'acquirers': ['InputStim'], 'drain_timeout': 5})
+        self.nexus.data_queues['Analysis.q_in'].size = 3
+        self.nexus.actorProcesses['Analysis'].alive = False
+
+        async def finish():
+            self.nexus.acquirerDone('InputStim')
+            await asyncio.wait_for(self.nexus.finishing, timeout=1) # not held for drain_timeout
+
+        asyncio.run(finish())
+
+
+class Headless_Visual(TestCase):
+
+    def test_dropVisual(self):
+        nexus = Nexus('Nexus')
+        nexus.tweak = Tweak()
+        nexus.tweak.hasGUI = True
+        nexus.tweak.gui = TweakModule('GUI', 'actors.visual', 'BasicVisual', options={'visual': 'Visual'})
+        nexus.tweak.actors = {name: None for name in ['Acquirer', 'Processor', 'Analysis', 'Visual']}
+        nexus.tweak.connections = {'Acquirer.q_out': ['Processor.q_in', 'Visual.raw_frame_queue'],
+                                   'Processor.q_out': ['Analysis.q_in'],
+                                   'Analysis.q_out': ['Visual.q_in']}
+        nexus.unread = []
+        nexus.dropVisual()
+        self.assertEqual(list(nexus.tweak.actors), ['Acquirer', 'Processor', 'Analysis'])
+        self.assertEqual(nexus.tweak.connections, {'Acquirer.q_out': ['Processor.q_in'],
+                                                   'Processor.q_out': ['Analysis.q_in']})
+        self.assertEqual(nexus.unread, ['Analysis.q_out'])
+
+
+class Headless_Run(TestCase):
+    ''' A whole headless run of a config with a GUI and its visual actor
+    '''
+
+    def test_run(self):
+        metrics = os.path.join(tempfile.mkdtemp(), 'metrics.csv')
+        asyncio.set_event_loop(asyncio.new_event_loop()) # asyncio.run in other tests leaves none
+        nexus = Nexus('Nexus')
+        nexus.createNexus(file='test/configs/headless.yaml',
+                          settings={'headless': True, 'metrics_file': metrics})
+        self.assertNotIn('Visual', nexus.actors)
+        t = time.time()
+        nexus.startNexus()
+        self.assertLess(time.time()-t, 20) # not held for drain_timeout
+        self.closeLoop()
+        self.assertIsNone(nexus.failure)
+        self.assertIsNotNone(nexus.tDone)
+        with open(metrics) as f:
+            frames = [row for row in csv.DictReader(f) if row['name'] == 'Processor.frame']
+        self.assertEqual(int(frames[-1]['count']), 20)
+
+    def closeLoop(self):
+        ''' Cancel what Nexus left waiting on its event loop
+        '''
+        loop = asyncio.get_event_loop()
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
@@ -0,0 +1,137 @@
+from unittest import TestCase
+import asyncio
+import select
+import threading
+from multiprocessing import Process
+from queue import Empty, Full
+from improv.link import RingQueue, BroadcastRing, sharedExecutor
+
+
+def _produce(q, n):
+    for i in range(n):
+        q.put([{str(i): i}])
+
+
+def _putRange(q, first, last):
+    for i in range(first, last):
+        q.put(i)
+
+
+class RingQueue_PutGet(TestCase):
+
+    def setUp(self):
+        self.q = RingQueue(slots=4, slot_size=256)
+
+    def test_fifo(self):
+        for i in range(3):
+            self.q.put([i])
+        self.assertEqual(self.q.qsize(), 3)
+        self.assertEqual([self.q.get() for i in range(3)], [[0], [1], [2]])
+        self.assertTrue(self.q.empty())
+
+    def test_wrapAround(self):
+        for i in range(10):
+            self.q.put_nowait(i)
+            self.assertEqual(self.q.get_nowait(), i)
+
+    def test_fullEmpty(self):
+        with self.assertRaises(Empty):
+            self.q.get(timeout=0.01)
+        for i in range(4):
+            self.q.put_nowait(i)
+        self.assertTrue(self.q.full())
+        with self.assertRaises(Full):
+            self.q.put_nowait(4)
+
+    def test_tooLarge(self):
+        with self.assertRaises(ValueError):
+            self.q.put(bytes(256))
+
+    def test_otherProcess(self):
+        p = Process(target=_produce, args=(self.q, 20))
+        p.start()
+        res = [self.q.get(timeout=5) for i in range(20)]
+        p.join()
+        self.assertEqual(res[19], [{'19': 19}])
+
+    def tearDown(self):
+        self.q.destroy()
+
+
+class RingQueue_Notify(TestCase):
+
+    def setUp(self):
+        self.q = RingQueue(slots=4, slot_size=256)
+
+    def test_fileno(self):
+        self.assertEqual(select.select([self.q], [], [], 0)[0], [])
+        self.q.put(1)
+        self.assertEqual(select.select([self.q], [], [], 0)[0], [self.q])
+        self.q.drain()
+        self.assertEqual(self.q.get_nowait(), 1)
+
+    def test_getAsync(self):
+        timer = threading.Timer(0.05, self.q.put, args=('late',))
+        timer.start()
+        res = asyncio.run(asyncio.wait_for(self.q.get_async(), 5))
+        self.assertEqual(res, 'late')
+
+    def test_sharedExecutor(self):
+        self.assertIs(sharedExecutor(), sharedExecutor())
+
+    def tearDown(self):
+        self.q.destroy()
+
+
+class BroadcastRing_FanOut(TestCase):
+
+    def setUp(self):
+        self.ring = BroadcastRing(2, slots=4, slot_size=256, skip=[1], capacity=[4, 1])
+        self.proc, self.visual = self.ring.reader(0), self.ring.reader(1)
+
+    def test_everyReader(self):
+        self.ring.put([{'0': 'id0'}])
+        self.assertEqual(self.proc.get(timeout=1), [{'0': 'id0'}])
+        self.assertEqual(self.visual.get(timeout=1), [{'0': 'id0'}])
+        self.assertTrue(self.proc.empty())
+
+    def test_losslessBlocks(self):
+        for i in range(4):
+            self.ring.put_nowait(i)
+        with self.assertRaises(Full):
+            self.ring.put_nowait(4)
+        self.assertEqual(self.proc.get_nowait(), 0)
+        self.ring.put_nowait(4)
+
+    def test_skipAhead(self):
+        for i in range(8):
+            self.ring.put(i)
+            self.assertEqual(self.proc.get_nowait(), i)
+        self.assertEqual(self.visual.get_nowait(), 7)
+        self.assertEqual(self.visual.dropped(), 7)
+        with self.assertRaises(Empty):
+            self.visual.get_nowait()
+
+    def test_skipKeepsCapacity(self):
+        ring = BroadcastRing(1, slots=4, slot_size=256, skip=[0], capacity=[2])
+        try:
+            for i in range(5):
+                ring.put(i)
+            reader = ring.reader(0)
+            self.assertEqual(reader.qsize(), 2)
+            self.assertEqual([reader.get_nowait(), reader.get_nowait()], [3, 4])
+            self.assertEqual(reader.dropped(), 3)
+        finally:
+            ring.destroy()
+
+    def test_producers(self):
+        procs = [Process(target=_putRange, args=(self.ring, i*100, i*100+50)) for i in range(2)]
+        for p in procs:
+            p.start()
+        items = [self.proc.get(timeout=5) for i in range(100)]
+        for p in procs:
+            p.join()
+        self.assertEqual(sorted(items), list(range(50))+list(range(100, 150)))
+
+    def tearDown(self):
+        self.ring.destroy()
@@ -0,0 +1,72 @@
+from unittest import TestCase
+from queue import Full
+from improv.nexus import Link, MultiLink
+from improv.tweak import InvalidPolicyError
+
+
+class Link_Policy(TestCase):
+
+    def make(self, policy, backend):
+        q = Link('test', 'Acquirer', 'Processor', backend=backend, maxsize=2, policy=policy)
+        self.links.append(q)
+        for i in range(4):
+            q.put_nowait(i)
+        return q
+
+    def setUp(self):
+        self.links = []
+
+    def test_block(self):
+        for backend in ['manager', 'shm']:
+            with self.assertRaises(Full):
+                self.make('block', backend)
+
+    def test_dropNewest(self):
+        for backend in ['manager', 'shm']:
+            q = self.make('drop-newest', backend)
+            self.assertEqual([q.get_nowait(), q.get_nowait()], [0, 1])
+            self.assertEqual(q.dropped(), 2)
+
+    def test_dropOldest(self):
+        for backend in ['manager', 'shm']:
+            q = self.make('drop-oldest', backend)
+            self.assertEqual([q.get_nowait(), q.get_nowait()], [2, 3])
+            self.assertEqual(q.dropped(), 2)
+
+    def test_latest(self):
+        for backend in ['manager', 'shm']:
+            q = self.make('latest', backend)
+            self.assertEqual(q.qsize(), 1)
+            self.assertEqual(q.get_nowait(), 3)
+
+    def test_multiLink(self):
+        q, (proc, vis) = MultiLink('test', 'Acquirer.q_out', ['Processor.q_in', 'Visual.raw_frame_queue'],
+                                   maxsize=2, policy={'Visual.raw_frame_queue': 'latest'})
+        for i in range(2):
+            q.put(i)
+        self.assertEqual(proc.qsize(), 2)
+        self.assertEqual(vis.get_nowait(), 1)
+        self.assertEqual(vis.dropped(), 1)
+
+    def test_multiLinkShm(self):
+        q, (proc, vis, old) = MultiLink('test', 'Acquirer.q_out', ['Processor.q_in', 'Visual.raw_frame_queue', 'Store.q_in'],
+                                        backend='shm', maxsize=8,
+                                        policy={'Visual.raw_frame_queue': 'latest', 'Store.q_in': 'drop-oldest'})
+        self.links.append(q)
+        for i in range(5):
+            q.put(i)
+        self.assertEqual(proc.qsize(), 5)
+        self.assertEqual(vis.qsize(), 1)
+        self.assertEqual(vis.get_nowait(), 4)
+        self.assertEqual(vis.dropped(), 4)
+        self.assertEqual(old.get_nowait(), 0) # within its maxsize, nothing dropped
+        self.assertEqual(old.dropped(), 0)
+
+    def test_multiLinkShmDropNewest(self):
+        with self.assertRaises(InvalidPolicyError):
+            MultiLink('test', 'Acquirer.q_out', ['Processor.q_in', 'Visual.raw_frame_queue'],
+                      backend='shm', policy={'Visual.raw_frame_queue': 'drop-newest'})
+
+    def tearDown(self):
+        for q in self.links:
+            q.destroy()
@@ -0,0 +1,137 @@
+import shutil
+import tempfile
+import time
+import unittest
+from multiprocessing import Process
+
+import numpy as np
+
+from improv.metrics import MetricsRegistry
+from improv.store import LMDBStore
+from improv.utils.reader import LMDBReader
+
+
+def _putAndExit(path):
+    lmdb_store = LMDBStore(path=path, name='/exit', commit_freq=1000, commit_interval=60)
+    for i in range(3):
+        lmdb_store.put(i, 'frame' + str(i))
+
+
+class TestLMDBWriter(unittest.TestCase):
+    """
+    Test the background writer of improv.store.LMDBStore
+
+    """
+
+    def setUp(self) -> None:
+        self.path = tempfile.mkdtemp()
+
+    def test_put_get(self):
+        lmdb_store = LMDBStore(path=self.path, name='/writer', commit_interval=0.05)
+        lmdb_store.put(np.arange(5), 'acq_raw0')
+        lmdb_store.flush()
+        self.assertEqual(lmdb_store.stats()['written'], 1)
+
+    def test_group_commit(self):
+        lmdb_store = LMDBStore(path=self.path, name='/writer', commit_freq=1000, commit_interval=0.05)
+        for i in range(10):
+            lmdb_store.put(i, 'frame' + str(i))
+        time.sleep(0.3)
+        self.assertEqual(lmdb_store.get('frame3'), 3)
+        self.assertEqual(lmdb_store.stats()['commits'], 1)
+        lmdb_store.flush()
+
+    def test_modified_after_put(self):
+        lmdb_store = LMDBStore(path=self.path, name='/writer', commit_interval=0.05)
+        coords = [1, 2]
+        lmdb_store.put(coords, 'coords0')
+        coords.append(3)
+        lmdb_store.flush()
+        self.assertEqual([obj for frame, name, obj in LMDBReader(self.path + '/writer').iter_data()], [[1, 2]])
+
+    def test_metrics(self):
+        registry = MetricsRegistry()
+        lmdb_store = LMDBStore(path=self.path, name='/writer', queue_size=1, commit_interval=0.05)
+        lmdb_store.setMetrics(registry, 'Processor')
+        for i in range(50):
+            lmdb_store.put(np.arange(1000), 'acq_raw' + str(i))
+        lmdb_store.flush()
+        rows = {r['name']: r for r in registry.snapshot()}
+        stats = lmdb_store.stats()
+        self.assertEqual(rows['Processor.lmdb_dropped']['count'], stats['dropped'])
+        self.assertEqual(rows['Processor.lmdb_written']['count'], 50-stats['dropped'])
+        self.assertIn('Processor.lmdb_queued', rows)
+
+    def test_flush_at_exit(self):
+        p = Process(target=_putAndExit, args=(self.path,))
+        p.start()
+        p.join()
+        self.assertEqual([obj for frame, name, obj in LMDBReader(self.path + '/exit').iter_data()], [0, 1, 2])
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class TestLMDBKeys(unittest.TestCase):
+    """
+    Test the sortable key layout and frame index through LMDBReader
+
+    """
+
+    def setUp(self) -> None:
+        self.path = tempfile.mkdtemp()
+        lmdb_store = LMDBStore(path=self.path, name='/keys')
+        lmdb_store.put({'fr': 2}, 'params_dict')
+        for i in [0, 1, 2, 10, 11]:
+            lmdb_store.put(np.full(2, i), 'acq_raw' + str(i))
+            lmdb_store.put(i, 'Call' + str(i))
+        lmdb_store.flush()
+        self.reader = LMDBReader(self.path + '/keys')
+
+    def test_key_order(self):
+        key = LMDBStore.encodeKey(3, 10, 1563288602.5)
+        self.assertEqual(LMDBStore.decodeKey(key), (3, 10, 1563288602.5))
+        self.assertLess(LMDBStore.encodeKey(3, 2, 5.0), LMDBStore.encodeKey(3, 10, 1.0))
+
+    def test_data_types(self):
+        self.assertEqual(self.reader.get_data_types(), {'params_dict', 'acq_raw', 'Call'})
+
+    def test_data_by_number(self):
+        data = self.reader.get_data_by_number(10)
+        self.assertEqual(sorted(k.split('_')[0] for k in data.keys()), ['Call10', 'acq'])
+
+    def test_data_by_type(self):
+        data = self.reader.get_data_by_type('acq_raw')
+        self.assertEqual([v[0] for v in data.values()], [0, 1, 2, 10, 11])
+
+    def test_params(self):
+        self.assertEqual(self.reader.get_params(), {'fr': 2})
+
+    def test_iter_data(self):
+        frames = [frame for frame, name, obj in self.reader.iter_data(types=['Call'])]
+        self.assertEqual(frames, [0, 1, 2, 10, 11])
+
+    def test_iter_frames(self):
+        items = [(frame, name) for frame, name, obj in self.reader.iter_frames(1, 10)]
+        self.assertEqual(sorted(items), [(1, 'Call'), (1, 'acq_raw'), (2, 'Call'), (2, 'acq_raw')])
+
+    def test_export_hdf5(self):
+        h5py = self.assertImportable('h5py')
+        counts = self.reader.export_hdf5(self.path + '/export.h5', types=['acq_raw'])
+        self.assertEqual(counts, {'acq_raw': 5})
+        with h5py.File(self.path + '/export.h5', 'r') as f:
+            self.assertEqual(f['acq_raw/data'].shape, (5, 2))
+            self.assertEqual(list(f['acq_raw/frames'][:]), [0, 1, 2, 10, 11])
+
+    def assertImportable(self, module):
+        try:
+            return __import__(module)
+        except ImportError:
+            self.skipTest(module + ' not installed')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+from unittest import TestCase
+import csv
+import json
+import os
+import tempfile
+import time
+from multiprocessing import Process
+from urllib.request import urlopen
+from improv.metrics import MetricsRegistry, MetricsLog
+from improv.monitor import StatsServer
+from improv.nexus import Nexus
+from improv.tweak import Tweak, TweakModule
+
+
+def _update(registry):
+    registry.counter('Processor.frames').inc(5)
+    registry.histogram('Processor.frame_time').record(0.01)
+
+
+class Metrics_Registry(TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry(capacity=4, shared=True)
+
+    def tearDown(self):
+        self.registry.destroy()
+
+    def test_kinds(self):
+        self.registry.counter('a').inc()
+        self.registry.counter('a').inc(2) # same metric again
+        self.registry.gauge('b').set(7.5)
+        h = self.registry.histogram('c')
+        for t in [1e-3]*9 + [1e-1]:
+            h.record(t)
+        rows = {r['name']: r for r in self.registry.snapshot()}
+        self.assertEqual(rows['a']['count'], 3)
+        self.assertEqual(rows['b']['value'], 7.5)
+        self.assertEqual(rows['c']['count'], 10)
+        self.assertAlmostEqual(rows['c']['mean'], 0.0109)
+        self.assertLess(rows['c']['p50'], 2e-3)
+        self.assertAlmostEqual(h.mean(), 0.0109)
+
+    def test_kindMismatch(self):
+        self.registry.counter('a')
+        with self.assertRaises(TypeError):
+            self.registry.gauge('a')
+
+    def test_full(self):
+        for name in 'abcd':
+            self.registry.counter(name)
+        with self.assertLogs('improv.metrics', 'WARNING'):
+            extra = self.registry.counter('e')
+        extra.inc() # works, but is not recorded
+        self.registry.histogram('f').record(0.01)
+        self.assertEqual([r['name'] for r in self.registry.snapshot()], list('abcd'))
+
+    def test_sharedAcrossProcesses(self):
+        p = Process(target=_update, args=(self.registry,))
+        p.start()
+        p.join()
+        rows = {r['name']: r for r in self.registry.snapshot()}
+        self.assertEqual(rows['Processor.frames']['count'], 5)
+        self.assertEqual(rows['Processor.frame_time']['count'], 1)
+
+    def test_log(self):
+        self.registry.counter('a').inc()
+        path = os.path.join(tempfile.mkdtemp(), 'metrics.csv')
+        log = MetricsLog(path)
+        log.write(self.registry.snapshot(), t=1.0)
+        log.close()
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(rows[0]['name'], 'a')
+        self.assertEqual(rows[0]['count'], '1')
+
+
+class Monitor_StatsServer(TestCase):
+
+    def test_serve(self):
+        server = StatsServer(port=0)
+        try:
+            server.update({'links': {'Processor.q_in': 3}})
+            with urlopen('http://127.0.0.1:{}/'.format(server.port), timeout=5) as r:
+                self.assertEqual(json.loads(r.read()), {'links': {'Processor.q_in': 3}})
+        finally:
+            server.close()
+
+
+class Metrics_Nexus(TestCase):
+
+    def test_perActor(self):
+        nexus = Nexus('Nexus')
+        nexus.tweak = Tweak()
+        nexus.tweak.actors = {'Acquirer': TweakModule('Acquirer', 'improv.actors.acquire', 'FileAcquirer'),
+                              'Processor': TweakModule('Processor', 'improv.actors.process', 'CaimanProcessor', replicas=3)}
+        self.assertEqual(nexus.metricsCapacity(), 5*32) # 4 actor instances and Nexus
+        nexus.tweak.settings['metrics_capacity'] = 10
+        self.assertEqual(nexus.metricsCapacity(), 10)
+
+    def test_logHeartbeat(self):
+        nexus = Nexus('Nexus')
+        nexus.metrics = MetricsRegistry()
+        nexus.metrics.gauge('Processor.heartbeat').set(time.monotonic()-2)
+        with self.assertLogs('improv.nexus', 'INFO') as logs:
+            nexus.logMetrics()
+        self.assertRegex(logs.output[0], r'Processor.heartbeat: 2\.\d+ s ago')
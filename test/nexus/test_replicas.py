@@ -0,0 +1,69 @@
+from unittest import TestCase
+from multiprocessing import Value
+from queue import Empty
+from improv import link
+from improv.link import Numbered, ReorderBuffer
+from improv.nexus import Link
+
+
+class _Take():
+    ''' Hands out queued items like Queue.get
+    '''
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __call__(self, block=True, timeout=None):
+        if not self.items:
+            raise Empty
+        return self.items.pop(0)
+
+
+class Replicas_Reorder(TestCase):
+
+    def test_order(self):
+        take = _Take([Numbered(s, s) for s in [2, 0, 3, 1]])
+        buf = ReorderBuffer()
+        self.assertEqual([buf.get(take).item for i in range(4)], [0, 1, 2, 3])
+
+    def test_gap(self):
+        take = _Take([Numbered(s, s) for s in [0, 2, 3]])
+        buf = ReorderBuffer(wait=0.05)
+        self.assertEqual(buf.get(take).item, 0)
+        self.assertEqual(buf.get(take, timeout=1).item, 2) # 1 never comes
+        self.assertEqual(buf.get(take).item, 3)
+
+    def test_nowait(self):
+        buf = ReorderBuffer(wait=10)
+        with self.assertRaises(Empty):
+            buf.get(_Take([Numbered(1, 1)]), block=False) # holding 1 until 0 arrives
+
+    def test_timeout(self):
+        buf = ReorderBuffer(wait=10)
+        self.assertIsNone(buf.timeout())
+        with self.assertRaises(Empty):
+            buf.get(_Take([Numbered(1, 1)]), block=False)
+        self.assertGreater(buf.timeout(), 5) # waiting for 0
+        buf.get(_Take([Numbered(0, 0)]))
+        self.assertEqual(buf.timeout(), 0) # 1 can go now
+
+    def test_links(self):
+        for backend in ['manager', 'shm']:
+            q_in = Link('in', 'Acquirer.q_out', 'Processor.q_in', backend=backend)
+            q_out = Link('out', 'Processor.q_out', 'Analysis.q_in', backend=backend)
+            q_in.numbering = Value('Q', 0)
+            q_out.reorder = ReorderBuffer()
+            for i in range(4):
+                q_in.put(i)
+            taken = []
+            for i in range(4):
+                item = q_in.get(timeout=1)
+                taken.append((link.current(), item))
+            for seq, item in reversed(taken): # replicas finishing in reverse order
+                link._seq = seq
+                q_out.put(item*10)
+            self.assertEqual([q_out.get(timeout=1) for i in range(4)], [0, 10, 20, 30])
+            q_in.destroy()
+            q_out.destroy()
+
+    def tearDown(self):
+        link._seq = None
@@ -0,0 +1,172 @@
+from unittest import TestCase
+import asyncio
+import time
+from queue import Empty
+from threading import Thread
+from improv.actor import RunManager, AsyncRunManager, Spike
+from improv.link import RingQueue, Numbered, ReorderBuffer
+from improv.nexus import Link
+
+
+class RunManager_Events(TestCase):
+
+    def setUp(self):
+        self.q_sig, self.q_comm, self.q_in = RingQueue(), RingQueue(), RingQueue()
+        self.received = []
+        self.calls = 0
+
+    def runMethod(self):
+        self.calls += 1
+        self.received.append(self.q_in.get_nowait())
+
+    def manage(self):
+        with RunManager('test', self.runMethod, lambda: None, self.q_sig, self.q_comm, links=[self.q_in]):
+            pass
+
+    def test_dispatchOnData(self):
+        t = Thread(target=self.manage)
+        t.start()
+        self.q_sig.put(Spike.setup())
+        self.assertEqual(self.q_comm.get(timeout=5), [Spike.ready()])
+        self.q_sig.put(Spike.run())
+        for i in range(10):
+            self.q_in.put([i])
+        deadline = time.time()+5
+        while len(self.received) < 10 and time.time() < deadline:
+            time.sleep(0.01)
+        self.q_sig.put(Spike.quit())
+        t.join(5)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(self.calls, 10)
+        self.assertEqual(self.received, [[i] for i in range(10)])
+
+    def test_heldItems(self):
+        ''' An item held back for one that never comes is handed out
+            after the reorder wait, without any more data arriving
+        '''
+        q_in = Link('out', 'Processor.q_out', 'Analysis.q_in', backend='shm')
+        q_in.reorder = ReorderBuffer(wait=0.1)
+        received = []
+
+        def runMethod():
+            try:
+                received.append(q_in.get_nowait())
+            except Empty:
+                pass
+
+        def manage():
+            with RunManager('test', runMethod, lambda: None, self.q_sig, self.q_comm, links=[q_in]):
+                pass
+
+        t = Thread(target=manage)
+        t.start()
+        self.q_sig.put(Spike.setup())
+        self.assertEqual(self.q_comm.get(timeout=5), [Spike.ready()])
+        self.q_sig.put(Spike.run())
+        q_in.queue.put(Numbered(1, 'b')) # 0 never comes
+        deadline = time.time()+5
+        while not received and time.time() < deadline:
+            time.sleep(0.01)
+        self.q_sig.put(Spike.quit())
+        t.join(5)
+        q_in.destroy()
+        self.assertEqual(received, ['b'])
+
+    def tearDown(self):
+        for q in [self.q_sig, self.q_comm, self.q_in]:
+            q.destroy()
+
+
+class RunManager_Batch(TestCase):
+
+    def setUp(self):
+        self.q_sig, self.q_comm, self.q_in = RingQueue(), RingQueue(), RingQueue()
+        self.batches = []
+
+    def runBatch(self, items):
+        if items:
+            self.batches.append(items)
+
+    def test_batches(self):
+        for i in range(7):
+            self.q_in.put(i)
+        self.q_sig.put(Spike.run())
+        rm = RunManager('test', None, None, self.q_sig, self.q_comm, links=[self.q_in],
+                        runBatch=self.runBatch, batchSize=3)
+        t = Thread(target=rm.__enter__)
+        t.start()
+        deadline = time.time()+5
+        while len(self.batches) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.q_sig.put(Spike.quit())
+        t.join(5)
+        self.assertEqual(self.batches, [[0, 1, 2], [3, 4, 5], [6]])
+
+    def test_needsLinks(self):
+        with self.assertRaises(ValueError):
+            RunManager('test', None, None, self.q_sig, self.q_comm, runBatch=self.runBatch)
+
+    def tearDown(self):
+        for q in [self.q_sig, self.q_comm, self.q_in]:
+            q.destroy()
+
+
+class _Comm():
+    ''' Collects what an actor sends to Nexus '''
+    def __init__(self):
+        self.items = []
+
+    async def put_async(self, item):
+        self.items.append(item)
+
+
+class AsyncRunManager_Signals(TestCase):
+
+    def setUp(self):
+        self.q_sig = RingQueue()
+        self.q_comm = _Comm()
+        self.started = 0
+        self.cancelled = 0
+
+    async def runMethod(self):
+        self.started += 1
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+    async def manage(self):
+        rm = AsyncRunManager('test', self.runMethod, lambda: None, self.q_sig, self.q_comm, workers=2)
+        async def signal():
+            for s in [Spike.setup(), Spike.run(), Spike.pause(), Spike.resume(), Spike.quit()]:
+                self.q_sig.put(s)
+                await asyncio.sleep(0.02)
+        sender = asyncio.ensure_future(signal())
+        async with rm:
+            pass
+        await sender
+        return rm
+
+    def test_pauseResumeQuit(self):
+        rm = asyncio.run(asyncio.wait_for(self.manage(), 5))
+        self.assertEqual(self.q_comm.items, [[Spike.ready()]])
+        self.assertEqual(self.started, 2)
+        self.assertEqual(self.cancelled, 2)
+        self.assertTrue(rm.task.done())
+
+    def test_spawnBounded(self):
+        async def spawnMany():
+            rm = AsyncRunManager('test', self.runMethod, None, self.q_sig, self.q_comm, workers=2)
+            running = []
+            async def work():
+                running.append(len(rm.tasks))
+                await asyncio.sleep(0.01)
+            for i in range(6):
+                await rm.spawn(work())
+            await asyncio.gather(*rm.tasks)
+            return running
+        self.assertLessEqual(max(asyncio.run(spawnMany())), 2)
+
+    def tearDown(self):
+        self.q_sig.destroy()
@@ -0,0 +1,39 @@
+from unittest import TestCase, mock
+import os
+from improv.utils import scheduling
+
+
+class Scheduling_Apply(TestCase):
+
+    def setUp(self):
+        self.cpus = os.sched_getaffinity(0)
+
+    def tearDown(self):
+        os.sched_setaffinity(0, self.cpus)
+
+    def test_parse(self):
+        self.assertEqual(scheduling.parseCPUList('0-3,8,10-11\n'), {0, 1, 2, 3, 8, 10, 11})
+
+    def test_affinity(self):
+        cpu = min(self.cpus)
+        scheduling.apply('Processor', cpu_affinity=[cpu])
+        self.assertEqual(os.sched_getaffinity(0), {cpu})
+
+    def test_numaNode(self):
+        if not os.path.exists('/sys/devices/system/node/node0'):
+            self.skipTest('no NUMA information')
+        scheduling.apply('Processor', numa_node=0)
+        self.assertTrue(os.sched_getaffinity(0) <= scheduling.nodeCPUs(0))
+
+    def test_numaMismatch(self):
+        if not os.path.exists('/sys/devices/system/node/node0'):
+            self.skipTest('no NUMA information')
+        node = scheduling.nodeCPUs(0)
+        with self.assertLogs(scheduling.logger, 'ERROR'):
+            scheduling.apply('Processor', cpu_affinity=[max(node)+4096], numa_node=0)
+        self.assertTrue(os.sched_getaffinity(0) <= node)
+
+    def test_unsupported(self):
+        with mock.patch.object(scheduling, 'os', mock.Mock(spec=[])):
+            with self.assertLogs(scheduling.logger, 'WARNING'):
+                scheduling.apply('Processor', cpu_affinity=[0], sched='fifo', priority=10)
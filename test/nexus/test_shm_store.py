@@ -0,0 +1,170 @@
+from unittest import TestCase
+import numpy as np
+from scipy.sparse import csc_matrix, coo_matrix
+from improv.store import SharedMemoryStore
+from improv.store import ObjectNotFoundError
+from improv.store import CannotGetObjectError
+from improv.tweak import Tweak, InvalidSettingError
+
+# No store server is needed for the shared memory backend
+
+class SharedMemoryStore_PutGet(TestCase):
+
+    def setUp(self):
+        self.limbo = SharedMemoryStore('test', store_loc='/tmp/improv_test')
+
+    def test_putArray(self):
+        frame = np.arange(12, dtype=np.float32).reshape(3, 4)
+        id = self.limbo.put(frame, 'frame0')
+        res = self.limbo.getID(id)
+        self.assertTrue(np.array_equal(res, frame))
+        self.assertFalse(res.flags.writeable)
+
+    def test_fortranArray(self):
+        frame = np.asfortranarray(np.arange(12).reshape(3, 4))
+        id = self.limbo.put(frame, 'frame0')
+        self.assertTrue(np.array_equal(self.limbo.getID(id), frame))
+
+    def test_putObject(self):
+        self.limbo.put({'one': 1}, 'params_dict')
+        self.assertEqual(self.limbo.get('params_dict'), {'one': 1})
+
+    def test_otherClient(self):
+        id = self.limbo.put(np.ones(5), 'ones')
+        other = SharedMemoryStore('other', store_loc='/tmp/improv_test')
+        self.assertTrue(np.array_equal(other.getID(id), np.ones(5)))
+        self.assertEqual(other.getList([id])[0].shape, (5,))
+
+    def test_get_nonexistent(self):
+        with self.assertRaises(CannotGetObjectError):
+            self.limbo.get('three')
+        with self.assertRaises(ObjectNotFoundError):
+            self.limbo.getID(self.limbo.random_ObjectID(1)[0])
+
+    def test_destroy(self):
+        self.limbo.put(1, 'one')
+        self.assertTrue(self.limbo.get_all())
+        self.limbo.client.destroy()
+        self.assertFalse(self.limbo.get_all())
+
+    def test_deleteViewed(self):
+        id = self.limbo.put(np.ones(5), 'ones')
+        view = self.limbo.getID(id)
+        self.limbo.client.delete([id])
+        self.assertEqual(len(self.limbo.client.unlinked), 1) # kept mapped for the view
+        self.assertTrue(np.array_equal(view, np.ones(5)))
+        del view
+        self.limbo.client.disconnect()
+        self.assertEqual(self.limbo.client.unlinked, [])
+
+    def tearDown(self):
+        self.limbo.client.destroy()
+
+
+class SharedMemoryStore_FrameArena(TestCase):
+
+    def setUp(self):
+        self.producer = SharedMemoryStore('Acquirer', store_loc='/tmp/improv_test')
+        self.consumer = SharedMemoryStore('Processor', store_loc='/tmp/improv_test')
+        self.arena = self.producer.createArena('acq_raw', (4, 5), np.uint16, slots=2,
+                                               subscribers=['Processor'])
+
+    def test_putFrame(self):
+        ref = self.producer.putFrame(self.arena, np.full((4, 5), 7))
+        res = self.consumer.getID(ref)
+        self.assertEqual(res.dtype, np.uint16)
+        self.assertTrue(np.all(res == 7))
+        self.assertFalse(res.flags.writeable)
+
+    def test_slotReuse(self):
+        first = self.producer.putFrame(self.arena, np.zeros((4, 5)))
+        self.producer.putFrame(self.arena, np.zeros((4, 5)))
+        # Both slots are held by the subscriber
+        self.assertIsNone(self.producer.putFrame(self.arena, np.zeros((4, 5))))
+        self.consumer.releaseID(first)
+        self.assertIsNotNone(self.producer.putFrame(self.arena, np.zeros((4, 5))))
+        with self.assertRaises(ObjectNotFoundError):
+            self.consumer.getID(first)
+
+    def test_replicaRelease(self):
+        replica = SharedMemoryStore('Processor#1', store_loc='/tmp/improv_test')
+        first = self.producer.putFrame(self.arena, np.zeros((4, 5)))
+        self.producer.putFrame(self.arena, np.zeros((4, 5)))
+        replica.releaseID(first)
+        self.assertIsNotNone(self.producer.putFrame(self.arena, np.zeros((4, 5))))
+
+    def tearDown(self):
+        self.producer.client.destroy()
+
+
+class SharedMemoryStore_Window(TestCase):
+
+    def setUp(self):
+        self.limbo = SharedMemoryStore('test', store_loc='/tmp/improv_test', window=2)
+
+    def test_evictOldFrames(self):
+        ids = [self.limbo.put(np.ones(3)*i, 'acq_raw'+str(i)) for i in range(4)]
+        self.limbo.put({'init_batch': 100}, 'params_dict')
+        self.assertEqual(sorted(self.limbo.getStored().keys()), ['acq_raw2', 'acq_raw3', 'params_dict'])
+        self.assertEqual(len(self.limbo.get_all()), 3)
+        with self.assertRaises(ObjectNotFoundError):
+            self.limbo.getID(ids[0])
+        self.assertTrue(np.all(self.limbo.getID(ids[3]) == 3))
+
+    def tearDown(self):
+        self.limbo.client.destroy()
+
+
+class SharedMemoryStore_PutMany(TestCase):
+
+    def setUp(self):
+        self.limbo = SharedMemoryStore('test', store_loc='/tmp/improv_test')
+
+    def test_putMany(self):
+        ids = self.limbo.putMany({'Cx0': np.arange(3), 'tune0': [1, 2], 'Cpop0': None})
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(ids[1], self.limbo.getStored()['tune0'])
+        res = self.limbo.getList(ids)
+        self.assertTrue(np.array_equal(res[0], np.arange(3)))
+        self.assertEqual(res[1:], [[1, 2], None])
+
+    def tearDown(self):
+        self.limbo.client.destroy()
+
+
+class SharedMemoryStore_Sparse(TestCase):
+
+    def setUp(self):
+        self.limbo = SharedMemoryStore('test', store_loc='/tmp/improv_test')
+
+    def test_csc(self):
+        csc = csc_matrix(np.eye(5, 4, dtype=np.float32))
+        res = self.limbo.getID(self.limbo.put(csc, 'Ab'))
+        self.assertIsInstance(res, csc_matrix)
+        self.assertTrue(np.array_equal(res.toarray(), csc.toarray()))
+        self.assertFalse(res.data.flags.writeable) # a view, not a copy
+
+    def test_otherSparse(self):
+        coo = coo_matrix(np.eye(3))
+        res = self.limbo.getID(self.limbo.put(coo, 'coo'))
+        self.assertTrue(np.array_equal(res.toarray(), np.eye(3)))
+
+    def test_bytes(self):
+        # Raw bytes are no longer mistaken for pickles
+        self.assertEqual(self.limbo.getID(self.limbo.put(b'raw', 'raw')), b'raw')
+
+    def tearDown(self):
+        self.limbo.client.destroy()
+
+
+class SharedMemoryStore_Settings(TestCase):
+
+    def test_storeSize(self):
+        tweak = Tweak()
+        tweak.settings['store'] = 'shm'
+        tweak.checkSettings()
+        tweak.settings['store_size'] = 10**9 # not enforced by the shm store
+        with self.assertRaises(InvalidSettingError):
+            tweak.checkSettings()
+        tweak.settings['store'] = 'plasma'
+        tweak.checkSettings()
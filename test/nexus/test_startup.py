@@ -0,0 +1,120 @@
+from unittest import TestCase
+import asyncio
+from queue import Queue
+from improv.actor import Actor, Spike
+from improv.metrics import MetricsRegistry
+from improv.nexus import Nexus, DeferredActor
+from improv.tweak import TweakModule
+from improv.utils.checks import consumers_first
+
+
+class _Actor(Actor):
+    def __init__(self, *args, rate=1):
+        super().__init__(*args)
+        self.rate = rate
+
+    def run(self):
+        self.ran = True
+
+
+class _Process():
+    def __init__(self, exitcode):
+        self.exitcode = exitcode
+        self.sentinel = 0
+
+    def join(self):
+        pass
+
+
+class Startup_Deferred(TestCase):
+
+    def test_instance(self):
+        registry = MetricsRegistry()
+        deferred = DeferredActor('Processor', TweakModule('Processor', __name__, '_Actor', options={'rate': 5}))
+        deferred.setMetrics(registry)
+        deferred.setLinkIn('q_in')
+        deferred.checkpoint_id = 3
+        actor = deferred.instance()
+        self.assertIsInstance(actor, _Actor)
+        self.assertEqual((actor.rate, actor.q_in, actor.checkpoint_id), (5, 'q_in', 3))
+        self.assertIn('Processor.load_time', [row['name'] for row in registry.snapshot()])
+
+    def test_loadError(self):
+        q_comm = Queue()
+        deferred = DeferredActor('Processor', TweakModule('Processor', __name__, '_Missing'))
+        deferred.setCommLinks(q_comm, Queue())
+        with self.assertRaises(AttributeError):
+            deferred.run()
+        sig = q_comm.get_nowait()
+        self.assertEqual(sig[0], Spike.failed())
+        self.assertIn('_Missing', sig[1])
+
+    def test_failed(self):
+        nexus = Nexus('Nexus')
+        nexus.failure = None
+        nexus.actorStates = {'Processor': None}
+        nexus.restarting = set()
+
+        async def fail():
+            nexus.failed = asyncio.get_event_loop().create_future()
+            nexus.actorFailed('Processor', 'AttributeError: _Missing')
+            nexus.actorFailed('Processor', 'exit code 1') # first error is kept
+            await asyncio.wait_for(nexus.failed, timeout=1)
+
+        asyncio.run(fail())
+        self.assertEqual(nexus.failure, ('Processor', 'AttributeError: _Missing'))
+
+    def test_exited(self):
+        nexus = Nexus('Nexus')
+        nexus.failure = None
+        nexus.flags = {'quit': False}
+        nexus.actorStates = {'Processor': None, 'Visual': None}
+        nexus.restarting = set()
+        nexus.actorProcesses = {'Processor': _Process(1)}
+
+        async def exit():
+            nexus.failed = asyncio.get_event_loop().create_future()
+            nexus.processExited('Visual', _Process(0)) # finished, e.g. run() returned
+            nexus.processExited('Processor', _Process(1))
+            await asyncio.wait_for(nexus.failed, timeout=2)
+
+        asyncio.run(exit())
+        self.assertEqual(nexus.failure, ('Processor', 'exit code 1'))
+
+    def test_finishedNotRestarted(self):
+        nexus = Nexus('Nexus')
+        nexus.flags = {'quit': False}
+        nexus.actorStates = {'Visual': Spike.ready()}
+        nexus.restarting = set()
+        nexus.restartActor = lambda name: self.fail('restarted a finished actor')
+
+        async def exit():
+            nexus.processExited('Visual', _Process(0))
+
+        asyncio.run(exit())
+
+    def test_readyAfterAll(self):
+        nexus = Nexus('Nexus')
+        nexus.failure = None
+        nexus.actorStates = {'Processor': Spike.ready()}
+        nexus.restarting = set()
+        nexus.actorFailed('Processor', 'exit code 1')
+        self.assertIsNone(nexus.failure)
+
+    def test_unknownMethod(self):
+        deferred = DeferredActor('Processor', None)
+        with self.assertRaises(AttributeError):
+            deferred.setup()
+
+
+class Startup_Order(TestCase):
+
+    def test_consumersFirst(self):
+        order = consumers_first({'Acquirer.q_out': {'targets': ['Processor.q_in', 'Visual.raw_frame_queue']},
+                                 'Processor.q_out': ['Analysis.q_in'],
+                                 'Analysis.q_out': ['Visual.q_in']})
+        for producer, consumer in [('Acquirer', 'Processor'), ('Processor', 'Analysis'), ('Analysis', 'Visual')]:
+            self.assertLess(order.index(consumer), order.index(producer))
+
+    def test_loop(self):
+        self.assertIsNone(consumers_first({'A.q_out': ['B.q_in'], 'B.q_out': ['A.q_in']}))
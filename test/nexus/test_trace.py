@@ -0,0 +1,89 @@
+from unittest import TestCase
+import json
+import os
+import pickle
+import tempfile
+from multiprocessing import Process
+from improv import trace
+
+
+class _Link():
+    def __init__(self, name, start, end):
+        self.name, self.start, self.end = name, start, end
+
+
+class Trace_Hops(TestCase):
+
+    def test_untraced(self):
+        trace._current = None
+        self.assertEqual(trace.wrap([1]), [1])
+        self.assertEqual(trace.unwrap([1], None), ([1], None))
+
+    def test_hops(self):
+        stats = trace.LatencyStats()
+        trace.begin(7)
+        sent = pickle.loads(pickle.dumps(trace.wrap([{'7': 'id'}])))
+        item, record = trace.unwrap(sent, _Link('Acquirer_multi', 'Acquirer.q_out', 'Processor.q_in'))
+        self.assertEqual(item, [{'7': 'id'}])
+        self.assertEqual(record[0], 7)
+        stats.record(record)
+
+        # Processor forwards its result; the context follows it
+        item, record = trace.unwrap(trace.wrap(['est']), _Link('Processor_Analysis', 'Processor.q_out', 'Analysis.q_in'))
+        stats.record(record)
+        summary = stats.summary()
+        self.assertEqual(sorted(summary.keys()), ['e2e Analysis', 'e2e Processor', 'process Processor',
+                                                  'transit Acquirer_multi', 'transit Processor_Analysis'])
+        self.assertEqual(summary['e2e Analysis']['count'], 1)
+
+    def test_histogram(self):
+        h = trace.Histogram()
+        for t in [1e-4]*90 + [1e-2]*10:
+            h.record(t)
+        self.assertLess(h.percentile(50), 2e-4)
+        self.assertGreaterEqual(h.percentile(99), 1e-2)
+        self.assertAlmostEqual(h.summary()['mean'], 1.09e-3)
+
+    def tearDown(self):
+        trace._current = None
+
+
+def _work(ring):
+    trace.record(ring)
+    with trace.span('runProcess', 'run'):
+        with trace.span('Processor_Analysis', 'link.put'):
+            pass
+
+
+class Trace_Spans(TestCase):
+
+    def test_notRecording(self):
+        trace.record(None)
+        with trace.span('a', 'run'):
+            pass
+        self.assertEqual(trace.traced('store')(lambda x: x+1)(1), 2)
+
+    def test_ring(self):
+        ring = trace.SpanRing(slots=4)
+        trace.record(ring)
+        for i in range(6):
+            with trace.span(str(i), 'run'):
+                pass
+        self.assertEqual(ring.overwritten(), 2)
+        self.assertEqual([s['name'] for s in ring.spans()], [b'2', b'3', b'4', b'5'])
+
+    def test_chromeTrace(self):
+        rings = {'Processor': trace.SpanRing(slots=16), 'Analysis': trace.SpanRing(slots=16)}
+        p = Process(target=_work, args=(rings['Processor'],))
+        p.start()
+        p.join()
+        path = os.path.join(tempfile.mkdtemp(), 'timeline.json')
+        trace.writeChromeTrace(path, rings)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        spans = [e for e in events if e['ph'] == 'X']
+        self.assertEqual(sorted(e['name'] for e in spans), ['Processor_Analysis', 'runProcess'])
+        self.assertTrue(all(e['pid'] == 0 and e['dur'] >= 0 for e in spans))
+
+    def tearDown(self):
+        trace.record(None)